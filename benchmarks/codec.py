@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" Compares the codecs of the build results: encode and decode time and size.
+
+    $ python benchmarks/codec.py --history-db /var/lib/lumper/history.db -n 200
+
+The results are the builds of the server history (--history-db of the
+server) with their logs, or the sample of the "samples" directory. Pickle
+is the baseline, crew serializes the messages with it (cPickle on py2,
+protocol 2). ujson and msgpack are measured when they're installed
+(pip install lumper[fast]). """
+import argparse
+import json
+import os
+import sqlite3
+import zlib
+
+from time import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from lumper import codec
+
+
+def load_history(path, limit):
+    db = sqlite3.connect(path)
+    rows = db.execute(
+        "SELECT b.*, l.data FROM builds b LEFT JOIN logs l ON l.build_id = b.id ORDER BY b.id DESC LIMIT ?",
+        (limit,)
+    )
+    columns = [c[0] for c in rows.description]
+
+    results = []
+    for row in rows:
+        result = dict(zip(columns, row))
+        data = result.pop('data')
+        result['timings'] = json.loads(result['timings']) if result['timings'] else {}
+        result['log'] = zlib.decompress(bytes(data)).decode("utf-8").split(u"\n") if data else []
+        results.append(result)
+
+    if not results:
+        raise SystemExit("No builds found in %s" % path)
+
+    return results
+
+
+def load_sample(path):
+    with open(path) as f:
+        return [json.load(f)]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.
+    return values[min(len(values) - 1, int(len(values) * p / 100.))]
+
+
+def codecs():
+    # The same pickle as crew's
+    yield "pickle", lambda obj: pickle.dumps(obj, protocol=2), pickle.loads
+    yield "json", lambda obj: json.dumps(obj).encode("utf-8"), lambda body: json.loads(body.decode("utf-8"))
+
+    if codec.ujson is not None:
+        yield "ujson", codec.JSONCodec.encode, codec.JSONCodec.decode
+
+    if codec.msgpack is not None:
+        yield "msgpack", codec.MsgpackCodec.encode, codec.MsgpackCodec.decode
+
+
+def measure(results, encode, decode, compress, rounds):
+    encoding, decoding, sizes = [], [], []
+
+    for result in results:
+        for _ in range(rounds):
+            start = time()
+            body = encode(result)
+            if compress:
+                body = zlib.compress(body, codec.COMPRESS_LEVEL)
+            encoding.append(time() - start)
+
+            start = time()
+            decode(zlib.decompress(body) if compress else body)
+            decoding.append(time() - start)
+
+        sizes.append(len(body))
+
+    return sorted(encoding), sorted(decoding), sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build result codec benchmark")
+    parser.add_argument("--history-db", help="SQLite history of the server, the sample is used without it")
+    parser.add_argument("--sample", default=os.path.join(os.path.dirname(__file__), "samples", "build_result.json"))
+    parser.add_argument("-l", "--limit", type=int, default=100, help="Builds of the history [default: 100]")
+    parser.add_argument("-n", "--rounds", type=int, default=50, help="Rounds per build [default: 50]")
+    args = parser.parse_args()
+
+    results = load_history(args.history_db, args.limit) if args.history_db else load_sample(args.sample)
+    lines = sum(len(r.get('log') or []) for r in results)
+    print("%d build results, %d log lines, %d rounds" % (len(results), lines, args.rounds))
+    print("")
+    print("%-16s %12s %10s %10s %10s %10s" % ("codec", "avg bytes", "enc p50 ms", "enc p95 ms", "dec p50 ms", "dec p95 ms"))
+
+    for name, encode, decode in codecs():
+        for compress in (False, True):
+            encoding, decoding, sizes = measure(results, encode, decode, compress, args.rounds)
+            print("%-16s %12d %10.3f %10.3f %10.3f %10.3f" % (
+                name + ("+zlib" if compress else ""), sum(sizes) / len(sizes),
+                percentile(encoding, 50) * 1000, percentile(encoding, 95) * 1000,
+                percentile(decoding, 50) * 1000, percentile(decoding, 95) * 1000,
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" Replays recorded webhook payloads against a running lumper server.
+
+    $ python benchmarks/webhook.py -u http://localhost:8228 -n 5000 -c 50 --rate 500
+
+Payloads are the JSON files of the "payloads" directory:
+{"headers": {...}, "body": {...}}. The path of the hook is chosen by
+the file name prefix (github_* or gitlab_*). """
+import argparse
+import glob
+import hashlib
+import hmac
+import json
+import os
+import uuid
+
+from copy import deepcopy
+from time import time
+
+import tornado.gen
+import tornado.ioloop
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPError
+
+
+PATHS = {
+    "github": "/webhook/github",
+    "gitlab": "/webhook/gitlab",
+}
+
+
+def load_payloads(path, names, commits):
+    payloads = []
+    for fname in sorted(glob.glob(os.path.join(path, "*.json"))):
+        name = os.path.splitext(os.path.basename(fname))[0]
+        if names and name not in names:
+            continue
+
+        with open(fname) as f:
+            payload = json.load(f)
+
+        body = payload['body']
+        if commits and body.get('commits'):
+            # Inflate the payload to the size of the big push
+            body['commits'] = [deepcopy(body['commits'][i % len(body['commits'])]) for i in range(commits)]
+
+        payloads.append((name, PATHS[name.split("_", 1)[0]], payload['headers'], json.dumps(body)))
+
+    if not payloads:
+        raise SystemExit("No payloads found in %s" % path)
+
+    return payloads
+
+
+def percentile(values, p):
+    if not values:
+        return 0.
+    return values[min(len(values) - 1, int(len(values) * p / 100.))]
+
+
+class Benchmark(object):
+    def __init__(self, args, payloads):
+        self.args = args
+        self.payloads = payloads
+        self.client = AsyncHTTPClient(max_clients=args.concurrency)
+        self.timings = dict((name, []) for name, _, _, _ in payloads)
+        self.codes = {}
+        self.sent = 0
+
+    def request(self, n):
+        name, path, headers, body = self.payloads[n % len(self.payloads)]
+        headers = dict(headers)
+        headers["X-Github-Delivery"] = headers["X-Gitlab-Event-UUID"] = str(uuid.uuid4())
+
+        if self.args.secret:
+            headers["X-Hub-Signature"] = "sha1=%s" % hmac.new(self.args.secret, body, hashlib.sha1).hexdigest()
+
+        return name, HTTPRequest(
+            self.args.url.rstrip("/") + path, method="POST", headers=headers, body=body,
+            request_timeout=self.args.timeout
+        )
+
+    @tornado.gen.coroutine
+    def worker(self, started):
+        while self.sent < self.args.requests:
+            n = self.sent
+            self.sent += 1
+
+            if self.args.rate:
+                delay = started + float(n) / self.args.rate - time()
+                if delay > 0:
+                    yield tornado.gen.sleep(delay)
+
+            name, request = self.request(n)
+            start = time()
+            try:
+                response = yield self.client.fetch(request)
+                code = response.code
+            except HTTPError as e:
+                code = e.code
+            except Exception as e:
+                code = type(e).__name__
+
+            self.timings[name].append(time() - start)
+            self.codes[code] = self.codes.get(code, 0) + 1
+
+    @tornado.gen.coroutine
+    def run(self):
+        started = time()
+        yield [self.worker(started) for _ in range(self.args.concurrency)]
+        raise tornado.gen.Return(time() - started)
+
+    def report(self, elapsed):
+        print("%d requests in %.2f sec: %.1f req/sec" % (self.sent, elapsed, self.sent / elapsed))
+        print("Responses: %s" % ", ".join("%s: %d" % item for item in sorted(self.codes.items())))
+        print("")
+        print("%-20s %8s %10s %10s %10s %10s" % ("payload", "count", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+
+        for name, values in sorted(self.timings.items()):
+            values.sort()
+            print("%-20s %8d %10.2f %10.2f %10.2f %10.2f" % (
+                name, len(values),
+                percentile(values, 50) * 1000, percentile(values, 95) * 1000,
+                percentile(values, 99) * 1000, (values[-1] if values else 0) * 1000,
+            ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook ingress benchmark")
+    parser.add_argument("-u", "--url", default="http://localhost:8228", help="Lumper server url")
+    parser.add_argument("-n", "--requests", type=int, default=1000, help="Total requests [default: 1000]")
+    parser.add_argument("-c", "--concurrency", type=int, default=10, help="Requests in flight [default: 10]")
+    parser.add_argument("-r", "--rate", type=float, default=0, help="Requests per second, 0 - unlimited")
+    parser.add_argument("-p", "--payload", action="append", dest="payloads", default=[],
+                        help="Replay only these payloads (file names without extension)")
+    parser.add_argument("--payloads-dir", default=os.path.join(os.path.dirname(__file__), "payloads"))
+    parser.add_argument("--commits", type=int, default=0, help="Inflate the commit list of the payloads")
+    parser.add_argument("--secret", help="Sign requests like GitHub does (must match --github-secret)")
+    parser.add_argument("--timeout", type=float, default=30, help="Request timeout [default: 30]")
+    args = parser.parse_args()
+
+    benchmark = Benchmark(args, load_payloads(args.payloads_dir, set(args.payloads), args.commits))
+    elapsed = tornado.ioloop.IOLoop.current().run_sync(benchmark.run)
+    benchmark.report(elapsed)
+
+
+if __name__ == '__main__':
+    main()
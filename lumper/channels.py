@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Pubsub channels shared by the server and workers
+
+BUILD_LOG = "lumper.build.log"
+BUILD_STATUS = "lumper.build.status"
+BUILD_RESULT = "lumper.build.result"
+WORKER_STATUS = "lumper.worker.status"
+
+# Fanout exchange of the cluster heartbeat. Every node binds an own
+# exclusive queue to it and answers to the queue of the sender.
+HEARTBEAT_EXCHANGE = "lumper.heartbeat"
+
+# Fanout exchange of the build supersession notices. A new tag of the
+# repository makes the queued and running builds of the older tags stale.
+SUPERSEDE_EXCHANGE = "lumper.build.supersede"
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# encoding: utf-8
+""" Codecs of the payloads shared by the server, the workers and the mailer.
+
+JSON is encoded by ujson when it's installed, msgpack is available when the
+msgpack package is installed. Bodies larger than COMPRESS_THRESHOLD are
+compressed with zlib. The codec and the compression travel with the payload
+(as content type and content encoding), so a consumer decodes any of them
+and the payloads without them are plain JSON. """
+import json
+import logging
+import zlib
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    STRING_TYPES = frozenset((str, unicode))
+    SCALAR_TYPES = frozenset((str, unicode, int, long, float, bool, type(None)))
+except NameError:
+    STRING_TYPES = frozenset((str,))
+    SCALAR_TYPES = frozenset((str, bytes, int, float, bool, type(None)))
+
+log = logging.getLogger("codec")
+
+COMPRESS_THRESHOLD = 4096
+COMPRESS_LEVEL = 6
+DEFLATE = "deflate"
+IDENTITY = "identity"
+
+
+def default(obj):
+    if hasattr(obj, '__dict__'):
+        return obj.__dict__
+    elif hasattr(obj, '_to_json'):
+        return obj._to_json()
+    else:
+        return str(obj)
+
+
+def plain(obj):
+    """ True when the object consists of the JSON types only. ujson 1.x has no
+    default hook and encodes any other object by its own rules. """
+    kind = type(obj)
+    if kind is dict:
+        return set(map(type, obj)) <= STRING_TYPES and _plain_items(obj.values())
+    elif kind is list or kind is tuple:
+        return _plain_items(obj)
+    return kind in SCALAR_TYPES
+
+
+def _plain_items(items):
+    # The types of the items are collected in C, the log lines never reach the loop
+    if set(map(type, items)) <= SCALAR_TYPES:
+        return True
+    return all(plain(item) for item in items)
+
+
+class JSONCodec(object):
+    name = "json"
+    content_type = "application/json"
+
+    @staticmethod
+    def encode(obj, default=default):
+        if ujson is not None and plain(obj):
+            try:
+                return ujson.dumps(obj, ensure_ascii=False).encode("utf-8")
+            except (TypeError, OverflowError, ValueError):
+                # Not finite floats and the bytes which aren't UTF-8
+                pass
+
+        result = json.dumps(obj, ensure_ascii=False, default=default, separators=(",", ":"))
+        return result.encode("utf-8") if not isinstance(result, bytes) else result
+
+    @staticmethod
+    def decode(body):
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        return ujson.loads(body) if ujson is not None else json.loads(body)
+
+
+class MsgpackCodec(object):
+    name = "msgpack"
+    content_type = "application/x-msgpack"
+
+    @staticmethod
+    def encode(obj, default=default):
+        return msgpack.packb(obj, use_bin_type=True, default=default)
+
+    @staticmethod
+    def decode(body):
+        return msgpack.unpackb(body, raw=False)
+
+
+CODECS = dict((c.name, c) for c in (JSONCodec, MsgpackCodec) if c is JSONCodec or msgpack is not None)
+CONTENT_TYPES = dict((c.content_type, c) for c in CODECS.values())
+
+
+def get_codec(name):
+    if name not in CODECS:
+        raise ValueError('Codec "%s" is not available, install the package of it' % name)
+    return CODECS[name]
+
+
+def encode(obj, codec="json", threshold=COMPRESS_THRESHOLD):
+    """ Returns (body, content type, content encoding) of the object. """
+    codec = get_codec(codec)
+    body = codec.encode(obj)
+    if threshold and len(body) > threshold:
+        return zlib.compress(body, COMPRESS_LEVEL), codec.content_type, DEFLATE
+    return body, codec.content_type, IDENTITY
+
+
+def decode(body, content_type=None, content_encoding=None):
+    if content_encoding == DEFLATE:
+        body = zlib.decompress(body)
+    return CONTENT_TYPES.get(content_type, JSONCodec).decode(body)
+
+
+# Large fields of the messages serialized by crew
+
+PACKED = "__packed__"
+
+
+def pack(value, codec="json", threshold=COMPRESS_THRESHOLD):
+    """ Packs the large field (the build log) of the message. Small values are kept as is. """
+    if codec is None:
+        return value
+
+    body, content_type, content_encoding = encode(value, codec, threshold)
+    if content_encoding == IDENTITY and codec == "json":
+        return value
+
+    return {PACKED: True, "content_type": content_type, "content_encoding": content_encoding, "body": body}
+
+
+def unpack(value):
+    """ The field packed by pack(), other values are returned as is. """
+    if isinstance(value, dict) and value.get(PACKED):
+        return decode(value['body'], value.get('content_type'), value.get('content_encoding'))
+    return value
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import json
+import logging
+import pika
+import threading
+import time
+
+from . import channels
+
+log = logging.getLogger("heartbeat")
+
+
+class HeartbeatResponder(threading.Thread):
+    """ Answers the cluster heartbeat of the server. The thread uses an own
+    connection and an exclusive queue, so the queue disappears with the node
+    and the heartbeat never waits behind a running build. """
+
+    RECONNECT_TIMEOUT = 5
+
+    def __init__(self, parameters, role, uuid, node_uuid, info=None):
+        super(HeartbeatResponder, self).__init__(name="heartbeat")
+        self.daemon = True
+        self.parameters = parameters
+        self.role = role
+        self.uuid = uuid
+        self.node_uuid = node_uuid
+        self.info = info
+        self.counter = 0
+
+    def run(self):
+        while True:
+            try:
+                self.consume()
+            except Exception as e:
+                log.warning("Heartbeat connection failed: %r. Reconnecting.", e)
+            time.sleep(self.RECONNECT_TIMEOUT)
+
+    def consume(self):
+        connection = pika.BlockingConnection(self.parameters)
+        try:
+            channel = connection.channel()
+            channel.exchange_declare(exchange=channels.HEARTBEAT_EXCHANGE, exchange_type="fanout")
+            queue = channel.queue_declare(exclusive=True, auto_delete=True).method.queue
+            channel.queue_bind(queue=queue, exchange=channels.HEARTBEAT_EXCHANGE)
+            channel.basic_consume(self.on_ping, queue=queue, no_ack=True)
+            log.debug("Listening the cluster heartbeat")
+            channel.start_consuming()
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def on_ping(self, channel, method, props, body):
+        try:
+            ping = json.loads(body)
+        except ValueError:
+            log.debug("Bad heartbeat message: %r", body)
+            return
+
+        self.counter += 1
+        channel.basic_publish(
+            exchange='',
+            routing_key=str(ping['reply_to']),
+            body=json.dumps({
+                "id": ping['id'],
+                "uuid": self.uuid,
+                "node": self.node_uuid,
+                "role": self.role,
+                "beats": self.counter,
+                "time": time.time(),
+                "info": self.info() if self.info else None,
+            }),
+            properties=pika.BasicProperties(content_type="application/json", expiration="60000")
+        )
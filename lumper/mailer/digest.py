@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import logging
+import os
+import re
+import threading
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from datetime import datetime
+from itertools import count
+from time import time, sleep
+from uuid import uuid4
+from .on_build import Email, attach_log, log_link
+
+log = logging.getLogger('emailer.digest')
+
+
+class DigestSpool(object):
+    """ Buffered build results stored as files named by the time they were
+    added. The results are acked by the mailer when they arrive, so the files
+    are the only copy of them until the digest is sent. """
+
+    def __init__(self, path):
+        self.path = path
+        self._counter = count()
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def put(self, recipient, data, added):
+        # The counter keeps the order of the results added within the same millisecond
+        fname = os.path.join(self.path, "%d-%08d-%s.pickle" % (added * 1000, next(self._counter), uuid4().hex))
+        tmp_name = "%s.tmp" % fname
+        with open(tmp_name, "wb") as f:
+            pickle.dump({"recipient": recipient, "added": added, "data": data}, f, protocol=2)
+        os.rename(tmp_name, fname)
+        return fname
+
+    def load(self):
+        for name in sorted(os.listdir(self.path)):
+            fname = os.path.join(self.path, name)
+            if not name.endswith(".pickle"):
+                # Written at the moment of crash
+                os.remove(fname)
+                continue
+
+            try:
+                with open(fname, "rb") as f:
+                    item = pickle.load(f)
+            except Exception as e:
+                log.warning('Removing broken digest item "%s": %r', fname, e)
+                os.remove(fname)
+                continue
+
+            yield item['recipient'], item['added'], item['data'], fname
+
+    @staticmethod
+    def remove(fnames):
+        for fname in fnames:
+            if fname and os.path.exists(fname):
+                os.remove(fname)
+
+
+class Digest(object):
+    """ Collects successful build results per recipient and sends them as one
+    message when the oldest result waits for `window` seconds or `size`
+    results are collected. With the spool the collected results survive the
+    restart of the mailer and are removed only after the digest is sent. """
+
+    COLUMNS = ("Repository", "Tag", "Commit", "Status", "Build date")
+
+    def __init__(self, pool, sender, window=300, size=20, spool=None):
+        self.pool = pool
+        self.sender = sender
+        self.window = window
+        self.size = size
+        self.spool = DigestSpool(spool) if spool else None
+        # recipient => (created, [(data, file name)])
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+        if self.spool is not None:
+            replayed = 0
+            for recipient, added, data, fname in self.spool.load():
+                self._buffer(recipient, data, fname, added)
+                replayed += 1
+
+            if replayed:
+                log.info("Replaying %d builds of the digests from the spool", replayed)
+
+        self._thread = threading.Thread(target=self._loop, name="digest")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _buffer(self, recipient, data, fname, added):
+        created, entries = self._buffers.setdefault(recipient, (added, []))
+        entries.append((data, fname))
+        return entries
+
+    def add(self, recipient, data):
+        added = time()
+        fname = self.spool.put(recipient, data, added) if self.spool is not None else None
+
+        with self._lock:
+            entries = self._buffer(recipient, data, fname, added)
+            log.debug("Buffered build of <%s> for <%s> (%d in digest)", data.get('name'), recipient, len(entries))
+
+            if len(entries) < self.size:
+                return
+
+            self._buffers.pop(recipient)
+
+        self._send(recipient, entries)
+
+    def _loop(self):
+        while True:
+            sleep(1)
+            edge = time() - self.window
+
+            with self._lock:
+                expired = [(r, e) for r, (created, e) in self._buffers.items() if created <= edge]
+                for recipient, _ in expired:
+                    self._buffers.pop(recipient)
+
+            for recipient, entries in expired:
+                try:
+                    self._send(recipient, entries)
+                except Exception as e:
+                    log.exception(e)
+
+    def flush(self):
+        with self._lock:
+            buffers, self._buffers = self._buffers, {}
+
+        for recipient, (created, entries) in buffers.items():
+            self._send(recipient, entries, retry=False)
+
+    def _send(self, recipient, entries, retry=True):
+        """ Sends the digest and removes its results from the spool. The failed
+        digest is collected again and retried after the window. """
+        if self.send(recipient, [data for data, _ in entries]):
+            if self.spool is not None:
+                self.spool.remove([fname for _, fname in entries])
+            return True
+
+        if retry:
+            log.warning("Digest for <%s> is not sent, retrying in %d seconds", recipient, self.window)
+            with self._lock:
+                now = time()
+                for data, fname in entries:
+                    self._buffer(recipient, data, fname, now)
+
+        return False
+
+    @classmethod
+    def table(cls, items):
+        rows = [cls.COLUMNS]
+        for data in items:
+            rows.append((
+                data.get('name') or '',
+                data.get('tag') or '',
+                (data.get('commit') or '')[:10],
+                'successful' if data.get('status') else 'failed',
+                str(datetime.utcfromtimestamp(data['timestamp'])) if data.get('timestamp') else '',
+            ))
+
+        widths = [max(len(unicode(row[i])) for row in rows) for i in range(len(cls.COLUMNS))]
+        lines = [u"  ".join(unicode(value).ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows]
+        lines.insert(1, u"  ".join("-" * width for width in widths))
+        return u"\n".join(lines)
+
+    @staticmethod
+    def file_name(data):
+        return "%s-%s.log" % (re.sub("[^\w.-]+", "_", data.get('name') or 'build'), data.get('tag'))
+
+    def send(self, recipient, items):
+        failed = sum(1 for i in items if not i.get('status'))
+        email = Email(
+            sender=self.sender,
+            recipient=recipient,
+            subject="Builds digest: %d successful, %d failed" % (len(items) - failed, failed)
+        )
+
+        email.append(u"Builds finished since the last digest:\n\n%s\n\n" % self.table(items))
+
+        for data in items:
+            attach_log(email, data.get('build_log') or [], self.file_name(data), link=log_link(data), inline=False)
+
+        log.info("Sending digest of %d builds for <%s>", len(items), recipient)
+        return email.send(self.pool)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import httplib
+import json
+import logging
+import os
+import threading
+import urlparse
+
+from collections import defaultdict
+from Queue import Queue
+from time import time, sleep
+from uuid import uuid4
+
+log = logging.getLogger('emailer.hooks')
+
+
+class HookDelivery(object):
+    def __init__(self, url, body, attempt=0, id=None):
+        self.id = id or uuid4().hex
+        self.url = url
+        self.body = body
+        self.attempt = attempt
+
+    def dump(self):
+        return json.dumps({"id": self.id, "url": self.url, "body": self.body, "attempt": self.attempt})
+
+    @classmethod
+    def load(cls, data):
+        return cls(**json.loads(data))
+
+
+class RetrySpool(object):
+    """ Failed deliveries stored as files named by the time of the next attempt.
+    A file being delivered is renamed to *.sending and is removed only after
+    the delivery, so nothing is lost on a crash. """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        # Replay deliveries interrupted by the previous run
+        for name in os.listdir(path):
+            if name.endswith(".sending"):
+                fname = os.path.join(path, name)
+                os.rename(fname, fname[:-len(".sending")])
+
+    def put(self, delivery, when):
+        fname = os.path.join(self.path, "%d-%s.json" % (when, delivery.id))
+        tmp_name = "%s.tmp" % fname
+        with open(tmp_name, "w") as f:
+            f.write(delivery.dump())
+        os.rename(tmp_name, fname)
+
+    def due(self):
+        now = time()
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith(".json"):
+                continue
+
+            if int(name.split("-", 1)[0]) > now:
+                break
+
+            fname = os.path.join(self.path, name)
+            sending = "%s.sending" % fname
+            os.rename(fname, sending)
+            with open(sending) as f:
+                delivery = HookDelivery.load(f.read())
+            delivery.spool_file = sending
+            yield delivery
+
+    @staticmethod
+    def done(delivery):
+        fname = getattr(delivery, 'spool_file', None)
+        if fname and os.path.exists(fname):
+            os.remove(fname)
+
+
+class HookDispatcher(object):
+    """ Posts build results to the build-hook urls from a pool of threads over
+    keep-alive connections. Failed deliveries are retried from the spool with
+    exponential backoff. """
+
+    REPORT_EVERY = 100
+
+    def __init__(self, urls, spool, workers=4, timeout=3, retries=8, backoff=10, max_backoff=3600):
+        self.urls = list(urls)
+        self.spool = RetrySpool(spool)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.queue = Queue()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._delivered = 0
+        self.stats = defaultdict(lambda: {
+            "sent": 0, "failed": 0, "retried": 0, "dropped": 0, "time": 0., "max_time": 0.,
+        })
+
+        threads = [threading.Thread(target=self._worker, name="hook-%d" % i) for i in range(workers)]
+        threads.append(threading.Thread(target=self._retry_loop, name="hook-retry"))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+    def send(self, data):
+        body = json.dumps(data, sort_keys=False, encoding="utf-8", default=repr)
+        for url in self.urls:
+            self.queue.put(HookDelivery(url, body))
+
+    def _connection(self, url):
+        parsed = urlparse.urlsplit(url)
+        key = (parsed.scheme, parsed.netloc)
+        connections = self._local.__dict__.setdefault('connections', {})
+
+        if key not in connections:
+            cls = httplib.HTTPSConnection if parsed.scheme == 'https' else httplib.HTTPConnection
+            connections[key] = cls(parsed.netloc, timeout=self.timeout)
+
+        path = parsed.path or '/'
+        if parsed.query:
+            path = "%s?%s" % (path, parsed.query)
+
+        return key, connections[key], path
+
+    def post(self, url, body):
+        key, connection, path = self._connection(url)
+        try:
+            connection.request("POST", path, body, {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        except Exception:
+            # The server could close the keep-alive connection
+            connection.close()
+            self._local.connections.pop(key, None)
+            raise
+
+    def _worker(self):
+        while True:
+            delivery = self.queue.get()
+            try:
+                self.deliver(delivery)
+            except Exception as e:
+                log.exception(e)
+
+    def deliver(self, delivery):
+        start = time()
+        try:
+            status = self.post(delivery.url, delivery.body)
+            error = None if status < 400 else "HTTP %d" % status
+            retry = status >= 500 or status == 429
+        except Exception as e:
+            status, error, retry = None, repr(e), True
+
+        elapsed = time() - start
+        with self._lock:
+            stats = self.stats[delivery.url]
+            stats['time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+            self._delivered += 1
+            report = self._delivered % self.REPORT_EVERY == 0
+
+            if error is None:
+                stats['sent'] += 1
+            else:
+                stats['failed'] += 1
+
+        if error is None:
+            log.info('Build hook response for "%s": HTTP %d (%.3f sec)', delivery.url, status, elapsed)
+        elif retry and delivery.attempt < self.retries:
+            delay = min(self.backoff * 2 ** delivery.attempt, self.max_backoff)
+            log.warning('Build hook "%s" failed: %s. Retrying in %d sec.', delivery.url, error, delay)
+            with self._lock:
+                self.stats[delivery.url]['retried'] += 1
+            self.spool.put(HookDelivery(delivery.url, delivery.body, delivery.attempt + 1, delivery.id), time() + delay)
+        else:
+            log.error('Build hook "%s" failed: %s. Dropping delivery.', delivery.url, error)
+            with self._lock:
+                self.stats[delivery.url]['dropped'] += 1
+
+        self.spool.done(delivery)
+
+        if report:
+            self.report()
+
+    def _retry_loop(self):
+        while True:
+            try:
+                for delivery in self.spool.due():
+                    self.queue.put(delivery)
+            except Exception as e:
+                log.exception(e)
+            sleep(1)
+
+    def report(self):
+        with self._lock:
+            stats = dict((url, dict(s)) for url, s in self.stats.items())
+
+        for url, s in stats.items():
+            calls = s['sent'] + s['failed']
+            log.info(
+                'Build hook "%s": %d sent, %d failed, %d retried, %d dropped, avg %.3f sec, max %.3f sec',
+                url, s['sent'], s['failed'], s['retried'], s['dropped'],
+                s['time'] / calls if calls else 0, s['max_time']
+            )
@@ -1,31 +1,46 @@
 #!/usr/bin/env python
 # encoding: utf-8
 from datetime import datetime
-import json
-import urllib2
 from crew.worker import context, Task
 from email.mime.base import MIMEBase
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email import Encoders
+from contextlib import closing
+from io import BytesIO
+import gzip
 import logging
-import smtplib
+from lumper.codec import unpack
 
 
 class Attachment(object):
     pass
 
 
-class FileAttachment(Attachment):
-    def __init__(self, data, file_name, content_type="application/octet-stream"):
-        self.part = MIMEBase('application', "octet-stream")
-        self.part.set_payload(data.encode('utf-8'))
-        Encoders.encode_base64(self.part)
-        self.part.add_header('Content-Disposition', 'attachment; filename="{0}"'.format(file_name))
+class LogAttachment(Attachment):
+    """ The log compressed with gzip line by line. The joined text of the log
+    is never built, only the compressed log and its base64 copy are in memory. """
+
+    def __init__(self, lines, file_name):
+        self.file_name = "%s.gz" % file_name
+        self.buffer = BytesIO()
+
+        with closing(gzip.GzipFile(filename=file_name, mode="wb", fileobj=self.buffer)) as f:
+            for line in lines:
+                f.write(line.encode('utf-8') if isinstance(line, unicode) else line)
+                f.write("\n")
+
+        # The gzip file is closed, the position is at the end of the compressed log
+        self.size = self.buffer.tell()
 
     def attach(self, email):
         assert isinstance(email, Email)
-        email.add_part(self.part)
+        part = MIMEBase('application', "gzip")
+        part.set_payload(self.buffer.getvalue())
+        self.buffer = None
+        Encoders.encode_base64(part)
+        part.add_header('Content-Disposition', 'attachment; filename="{0}"'.format(self.file_name))
+        email.add_part(part)
 
 
 class Email(object):
@@ -64,20 +79,11 @@ class Email(object):
         self.log.debug('Adding "%s" (length: %s) part to message from <%s> to <%s>', mimetype, len(prt), self.msg['From'], self.msg['To'])
         self.msg.attach(MIMEText(prt, mimetype, _charset='utf-8'))
 
-    def send(self, host='localhost', port=25, tls=False, user=None, password=None):
+    def send(self, pool):
         self.log.info("Sending message for <%s>.", self.msg['To'])
-        self.log.debug("Connecting to SMTP server %s:%d", host, port)
         if not self.__sent:
-            connect = smtplib.SMTP(host, port=port)
             try:
-                connect.ehlo()
-                if tls:
-                    self.log.debug("Establishing TLS")
-                    connect.starttls()
-                    connect.ehlo()
-                if user:
-                    connect.login(user=user, password=password)
-                connect.sendmail(self.msg['From'], self.msg['To'], self.msg.as_string())
+                pool.sendmail(self.msg['From'], self.msg['To'], self.msg.as_string())
                 self.__sent = True
                 return True
             except Exception as e:
@@ -85,16 +91,68 @@ class Email(object):
                 self.log.error("Error: %r", e)
                 self.__sent = False
                 return False
-            finally:
-                connect.close()
         else:
             self.log.error("Message already sent")
             return False
 
 log = logging.getLogger('emailer.task')
 
+
+def excerpt(lines, size):
+    """ First and last `size` lines of the log. """
+    if len(lines) <= size * 2:
+        return list(lines)
+    return lines[:size] + [u"", u"... %d lines skipped ..." % (len(lines) - size * 2), u""] + lines[-size:]
+
+
+def log_link(data):
+    """ Link to the stored log by the --log-url template, formatted with the build
+    fields and the log reference (the "id" is the id of the log). """
+    template = context.settings.options.log_url
+    if not template or not isinstance(data, dict):
+        return None
+
+    fields = dict(data, **(data.get('build_log_ref') or {}))
+    try:
+        return template.format(**fields)
+    except (KeyError, IndexError, ValueError) as e:
+        log.warning("Can't format the log url: %r", e)
+        return None
+
+
+def attach_log(email, lines, file_name, link=None, inline=True):
+    """ Adds the excerpt of the log to the body and the compressed log as the
+    attachment, or the link to the stored log when it's over the limit. """
+    options = context.settings.options
+
+    if inline and options.log_excerpt:
+        email.append(u"Build log excerpt:\n\n%s\n" % u"\n".join(excerpt(lines, options.log_excerpt)))
+
+    attachment = LogAttachment(lines, file_name)
+    if attachment.size <= options.attachment_limit * 1024:
+        attachment.attach(email)
+        if link:
+            email.append(u"Build log: %s\n" % link)
+    elif link:
+        email.append(u"Build log is too large to attach (%d KB compressed): %s\n" % (attachment.size / 1024, link))
+    else:
+        email.append(u"Build log is too large to attach (%d KB compressed)\n" % (attachment.size / 1024))
+
+
+def recipient(data):
+    if context.settings.options.mail_map:
+        return context.settings.options.mail_map.get(data['sender'], context.settings.options.admin_mail)
+    return context.settings.options.admin_mail
+
+
 @Task("build.finished")
 def on_build(data):
+    # The logs packed by the --result-codec of the worker
+    if isinstance(data, Exception):
+        data.log = unpack(getattr(data, "log", None)) or ['No log']
+    elif isinstance(data, dict) and 'build_log' in data:
+        data['build_log'] = unpack(data['build_log'])
+
     if isinstance(data, Exception):
         email = Email(
             sender=context.settings.smtp.sender,
@@ -104,17 +162,23 @@ def on_build(data):
 
         email.append("Error: %r\n\nTraceback: %s\n\n" % (data, getattr(data, '_tb', "No traceback")))
 
-        FileAttachment(
-            "\n".join(getattr(data, "log", ['No log',])),
-            file_name='build_log.txt',
-            content_type='text/plain'
-        ).attach(email)
+        attach_log(email, data.log, file_name='build_log.txt')
 
     else:
-        if context.settings.options.mail_map:
-            recepient = context.settings.options.mail_map.get(data['sender'], context.settings.options.admin_mail)
-        else:
-            recepient = context.settings.options.admin_mail
+        recepient = recipient(data)
+
+        # Hooks are delivered in background and never delay the email
+        if context.settings.hooks is not None:
+            context.settings.hooks.send(data)
+
+        if data.get('superseded'):
+            log.info('Build of "%s" tag "%s" is superseded by tag "%s"', data.get('name'), data.get('tag'), data['superseded'])
+            return True
+
+        # Failed builds are never delayed
+        if context.settings.digest is not None and data.get('status'):
+            context.settings.digest.add(recepient, data)
+            return True
 
         email = Email(
             sender=context.settings.smtp.sender,
@@ -141,30 +205,6 @@ def on_build(data):
                 "\n\n"
             ]))
 
-        FileAttachment(
-            "\n".join(data.get('build_log')),
-            file_name='build_log.txt',
-            content_type='text/plain'
-        ).attach(email)
-
-        if context.settings.options.build_hooks:
-            hook_data = json.dumps(data, sort_keys=False, encoding="utf-8")
-            for url in context.settings.options.build_hooks:
-                try:
-                    log.info('Sending build data to: "%s"', url)
-                    req = urllib2.Request(url)
-                    req.add_header('Content-Type', 'application/json')
-                    response = urllib2.urlopen(req, hook_data, timeout=3)
-                    log.info('Build hook response for "%s": HTTP %d', url, response.code)
-                except Exception as e:
-                    if log.getEffectiveLevel() <= logging.DEBUG:
-                        log.exception(e)
-                    log.error("Build hook error: %r", e)
-
-    return email.send(
-            host=context.settings.smtp.host,
-            port=context.settings.smtp.port,
-            user=context.settings.smtp.user,
-            password=context.settings.smtp.password,
-            tls=context.settings.smtp.tls
-        )
+        attach_log(email, data.get('build_log') or [], file_name='build_log.txt', link=log_link(data))
+
+    return email.send(context.settings.smtp_pool)
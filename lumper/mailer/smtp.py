@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import logging
+import smtplib
+import socket
+import threading
+
+from Queue import LifoQueue, Empty, Full
+from time import time
+
+log = logging.getLogger('emailer.smtp')
+
+
+class SMTPPool(object):
+    """ Keeps authenticated SMTP connections between messages.
+
+    A connection idle for longer than `keepalive` seconds is checked with NOOP
+    before reuse. A broken connection is replaced and the message is sent again. """
+
+    REPORT_EVERY = 100
+
+    def __init__(self, settings, size=2, keepalive=30):
+        self.settings = settings
+        self.size = size
+        self.keepalive = keepalive
+        self._idle = LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self.stats = {
+            "messages": 0,
+            "connects": 0,
+            "reuses": 0,
+            "noop_checks": 0,
+            "failures": 0,
+        }
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _connect(self):
+        s = self.settings
+        log.debug("Connecting to SMTP server %s:%d", s.host, s.port)
+        connection = smtplib.SMTP(s.host, port=s.port)
+        try:
+            connection.ehlo()
+            if s.tls:
+                log.debug("Establishing TLS")
+                connection.starttls()
+                connection.ehlo()
+            if s.user:
+                connection.login(user=s.user, password=s.password)
+        except Exception:
+            self._close(connection)
+            raise
+
+        self._count('connects')
+        return connection
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.quit()
+        except Exception:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def _alive(self, connection):
+        self._count('noop_checks')
+        try:
+            return connection.noop()[0] == 250
+        except Exception:
+            return False
+
+    def acquire(self):
+        while True:
+            try:
+                connection, last_used = self._idle.get_nowait()
+            except Empty:
+                return self._connect()
+
+            if time() - last_used < self.keepalive or self._alive(connection):
+                self._count('reuses')
+                return connection
+
+            log.debug("Dropping dead SMTP connection")
+            self._close(connection)
+
+    def release(self, connection):
+        try:
+            self._idle.put_nowait((connection, time()))
+        except Full:
+            self._close(connection)
+
+    def sendmail(self, sender, recipients, message):
+        # The second attempt covers a connection closed by the server while idle
+        for attempt in range(2):
+            connection = self.acquire()
+            try:
+                connection.sendmail(sender, recipients, message)
+            except (smtplib.SMTPServerDisconnected, socket.error) as e:
+                self._count('failures')
+                self._close(connection)
+                if attempt:
+                    raise
+                log.warning("SMTP connection failed: %r. Reconnecting.", e)
+            except Exception:
+                self._count('failures')
+                self._close(connection)
+                raise
+            else:
+                self.release(connection)
+                break
+
+        self._count('messages')
+        if self.stats['messages'] % self.REPORT_EVERY == 0:
+            self.report()
+
+    def report(self):
+        log.info(
+            "SMTP pool: %(messages)d messages, %(connects)d connects, %(reuses)d reuses, "
+            "%(noop_checks)d keepalive checks, %(failures)d failures", self.stats
+        )
+
+    def close(self):
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except Empty:
+                return
+            self._close(connection)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import logging
+import threading
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from contextlib import contextmanager
+from time import time
+
+log = logging.getLogger("metrics")
+
+
+class Metrics(object):
+    """ Counters and histograms with labels rendered in the Prometheus text format. """
+
+    BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, prefix="lumper"):
+        self.prefix = prefix
+        self.help = {}
+        self.types = {}
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, text):
+        self.types[name] = kind
+        self.help[name] = text
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted((k, unicode(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = [[0] * len(self.BUCKETS), 0, 0.]
+
+            buckets, _, _ = item = series[key]
+            for i, edge in enumerate(self.BUCKETS):
+                if value <= edge:
+                    buckets[i] += 1
+            item[1] += 1
+            item[2] += value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time()
+        try:
+            yield
+        finally:
+            self.observe(name, time() - start, **labels)
+
+    @staticmethod
+    def _labels(key, extra=()):
+        pairs = list(key) + list(extra)
+        if not pairs:
+            return ""
+        return "{%s}" % ",".join(
+            '%s="%s"' % (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs
+        )
+
+    def _header(self, lines, name, kind):
+        full_name = "%s_%s" % (self.prefix, name)
+        if name in self.help:
+            lines.append("# HELP %s %s" % (full_name, self.help[name]))
+        lines.append("# TYPE %s %s" % (full_name, self.types.get(name, kind)))
+        return full_name
+
+    def render(self):
+        with self._lock:
+            counters = dict((n, dict(s)) for n, s in self.counters.items())
+            histograms = dict((n, dict((k, (list(b), c, t)) for k, (b, c, t) in s.items()))
+                              for n, s in self.histograms.items())
+
+        lines = []
+        for name, series in sorted(counters.items()):
+            full_name = self._header(lines, name, "counter")
+            for key, value in sorted(series.items()):
+                lines.append("%s%s %s" % (full_name, self._labels(key), repr(float(value))))
+
+        for name, series in sorted(histograms.items()):
+            full_name = self._header(lines, name, "histogram")
+            for key, (buckets, count, total) in sorted(series.items()):
+                for edge, value in zip(self.BUCKETS, buckets):
+                    lines.append("%s_bucket%s %d" % (full_name, self._labels(key, [("le", repr(float(edge)))]), value))
+                lines.append("%s_bucket%s %d" % (full_name, self._labels(key, [("le", "+Inf")]), count))
+                lines.append("%s_count%s %d" % (full_name, self._labels(key), count))
+                lines.append("%s_sum%s %s" % (full_name, self._labels(key), repr(total)))
+
+        return u"\n".join(lines) + u"\n"
+
+
+def serve(metrics, port, address=""):
+    """ Exposes the metrics on http://address:port/metrics from a daemon thread. """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", Metrics.CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            log.debug(fmt, *args)
+
+    server = HTTPServer((address, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics")
+    thread.daemon = True
+    thread.start()
+    log.info("Serving metrics on %s:%d", address or "*", port)
+    return server
@@ -3,33 +3,70 @@
 from collections import namedtuple
 
 from crew.worker import Listener, Context, NODE_UUID, UUID
-from pika import PlainCredentials
+from pika import PlainCredentials, ConnectionParameters
 from crew.worker import context
+from lumper.heartbeat import HeartbeatResponder
 import logging
 import lumper.mailer
+from lumper.mailer.smtp import SMTPPool
+from lumper.mailer.digest import Digest
+from lumper.mailer.hooks import HookDispatcher
 
 def run(args):
     log = logging.getLogger("main")
+    digest = None
     try:
         SMTPSettings = namedtuple("SmtpSettings", "host port user password tls sender")
+        smtp = SMTPSettings(
+            host=args.smtp_host,
+            port=args.smtp_port,
+            user=args.smtp_user,
+            password=args.smtp_password,
+            tls=args.smtp_tls,
+            sender=args.smtp_sender
+        )
+
+        pool = SMTPPool(smtp, size=args.smtp_pool_size, keepalive=args.smtp_keepalive)
+
+        if args.digest_window:
+            log.info("Digest mode: %d seconds or %d builds", args.digest_window, args.digest_size)
+            digest = Digest(pool, smtp.sender, window=args.digest_window, size=args.digest_size,
+                            spool=args.digest_spool)
+
+        if args.build_hooks:
+            hooks = HookDispatcher(
+                args.build_hooks, args.hook_spool,
+                workers=args.hook_workers,
+                timeout=args.hook_timeout,
+                retries=args.hook_retries
+            )
+        else:
+            hooks = None
+
+        credentials = PlainCredentials(username=args.amqp_user, password=args.amqp_password) if args.amqp_user else None
+
+        HeartbeatResponder(
+            ConnectionParameters(
+                host=args.amqp_address, port=args.amqp_port,
+                credentials=credentials, virtual_host=args.amqp_vhost
+            ),
+            role="mailer", uuid=UUID, node_uuid=NODE_UUID
+        ).start()
+
         Listener(
             port=args.amqp_port,
             host=args.amqp_address,
-            credentials=PlainCredentials(username=args.amqp_user, password=args.amqp_password) if args.amqp_user else None,
+            credentials=credentials,
             virtual_host=args.amqp_vhost,
             handlers=context.handlers,
             set_context=Context(
                 options=args,
                 node_uuid=NODE_UUID,
                 uuid=UUID,
-                smtp=SMTPSettings(
-                    host=args.smtp_host,
-                    port=args.smtp_port,
-                    user=args.smtp_user,
-                    password=args.smtp_password,
-                    tls=args.smtp_tls,
-                    sender=args.smtp_sender
-                )
+                smtp=smtp,
+                smtp_pool=pool,
+                digest=digest,
+                hooks=hooks
             ),
         ).loop()
     except Exception as e:
@@ -37,4 +74,7 @@ def run(args):
             log.exception(e)
         else:
             log.fatal("Exiting by fatal error: %s", e)
+    finally:
+        if digest is not None:
+            digest.flush()
     return 0
@@ -6,6 +6,17 @@ from tornado.web import Application
 from tornado.httpserver import HTTPServer
 from tornado.log import app_log as log
 from lumper.server import HANDLERS
+from lumper.server.dedup import DeliveryIndex
+from lumper.server.spool import BuildSpool
+from lumper.server.scheduler import FairScheduler
+from lumper.server.admission import Admission
+from lumper.server.router import Router
+from lumper.server.cluster import ClusterHeartbeat
+from lumper.metrics import Metrics
+from lumper.server.history import BuildHistory
+from lumper.server.logs import LogStreams
+from lumper.server.supersede import Supersession
+from lumper import channels
 from crew.master.tornado import Client
 from pika import PlainCredentials
 
@@ -16,6 +27,69 @@ def run(args):
         credentials=PlainCredentials(username=args.rmq_user, password=args.rmq_password)
     )
 
+    metrics = Metrics()
+    metrics.describe("webhook_requests_total", "counter", "Handled webhooks by the response code")
+    metrics.describe("webhook_seconds", "histogram", "Duration of the webhook handling")
+    metrics.describe("build_queue_seconds", "histogram", "Time from the webhook to the start of the build")
+
+    deliveries = DeliveryIndex(ttl=args.dedup_ttl, timeout=args.timeout)
+    router = Router(
+        ttl=args.worker_ttl, timeout=args.timeout,
+        on_gone=lambda task: spool.reroute(task)
+    ) if args.affinity else None
+
+    def on_build_status(event):
+        deliveries.on_status(event)
+        spool.on_build_status(event)
+        if router:
+            router.on_build_status(event)
+
+    def on_worker_status(status):
+        scheduler.on_worker_status(status)
+        if router:
+            router.on_worker_status(status)
+
+    crew_client.subscribe(channels.BUILD_STATUS, on_build_status)
+    crew_client.subscribe(channels.WORKER_STATUS, on_worker_status)
+
+    logs = LogStreams(replay=args.log_replay)
+    crew_client.subscribe(channels.BUILD_LOG, logs.on_chunk)
+    tornado.ioloop.PeriodicCallback(logs.expire, 15 * 1000).start()
+
+    history = BuildHistory(args.history_db, retention=args.history_days)
+    crew_client.subscribe(channels.BUILD_RESULT, history.add)
+    # Hourly
+    tornado.ioloop.PeriodicCallback(history.schedule_expire, 3600 * 1000).start()
+
+    admission = Admission(
+        deliveries, max_builds=args.max_builds,
+        max_repo_builds=args.max_repo_builds, retry_after=args.retry_after
+    )
+
+    scheduler = FairScheduler(
+        key=args.fair_key, priorities=args.priorities, weights=args.weights,
+        window=args.dispatch_window, timeout=args.timeout, metrics=metrics, worker_ttl=args.worker_ttl
+    )
+
+    spool = BuildSpool(
+        args.spool, crew_client, scheduler, expiration=args.timeout,
+        batch_size=args.spool_batch, fsync=args.spool_fsync, router=router
+    )
+    if args.dispatch_window != 0:
+        # Frees the window from the builds lost in the queues and follows the capacity of the workers
+        tornado.ioloop.PeriodicCallback(spool.schedule, 5000).start()
+
+    if router:
+        # Notices the gone workers without the new builds
+        tornado.ioloop.PeriodicCallback(router.alive, args.worker_ttl * 1000).start()
+
+    supersession = Supersession(crew_client, args.supersede, spool, deliveries)
+
+    cluster = ClusterHeartbeat(crew_client, deadline=args.heartbeat_deadline)
+    if args.heartbeat_interval:
+        # Regular rounds keep the latency histograms filled between the requests
+        tornado.ioloop.PeriodicCallback(cluster.ping, args.heartbeat_interval * 1000).start()
+
     app = Application(
         args=args,
         handlers=HANDLERS,
@@ -25,10 +99,20 @@ def run(args):
         reload=args.debug,
         gzip=args.gzip,
         crew=crew_client,
-        timeout=args.timeout
+        timeout=args.timeout,
+        deliveries=deliveries,
+        spool=spool,
+        admission=admission,
+        scheduler=scheduler,
+        supersession=supersession,
+        router=router,
+        cluster=cluster,
+        metrics=metrics,
+        history=history,
+        logs=logs,
     )
 
-    http_server = HTTPServer(app, xheaders=True)
+    http_server = HTTPServer(app, xheaders=True, max_body_size=args.max_body_size)
     http_server.listen(args.port, address=args.address)
     log.info('Server started {host}:{port}'.format(host=args.address, port=args.port))
 
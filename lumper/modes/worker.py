@@ -1,17 +1,41 @@
 #!/usr/bin/env python
 # encoding: utf-8
-from crew.worker import Listener, Context, NODE_UUID, UUID
-from pika import PlainCredentials
+from crew.worker import Context, NODE_UUID, UUID
+from pika import PlainCredentials, ConnectionParameters
 from crew.worker import context
+from lumper.heartbeat import HeartbeatResponder
+from lumper.metrics import Metrics, serve as serve_metrics
+from lumper.codec import get_codec
 import logging
+import threading
+import time
+import os
+import tempfile
 import docker
 import docker.tls
 import lumper.worker
+from lumper.worker import BuildHandler
+from lumper.worker.pipeline import Pipeline
+from lumper.worker.listener import BuildListener
+from lumper.worker.pubsub import Publisher
+from lumper.worker.mirror import MirrorStore
+from lumper.worker.mtime import CommitTimes
+from lumper.worker.build_context import ContextCache
+from lumper.worker.image_index import ImageIndex
+from lumper.worker.submodules import Submodules
+from lumper.worker.workspace import WorkspacePool
+from lumper.worker.state import NodeState
+from lumper.worker.supersede import Supersession, SupersedeListener
+from lumper.worker.heartbeat import advertise
 
 
 def run(args):
     log = logging.getLogger("main")
 
+    if args.result_codec:
+        # Fails at the start when the package of the codec isn't installed
+        get_codec(args.result_codec)
+
     if args.docker_tls:
         tls = docker.tls.TLSConfig(client_cert=(args.docker_client_cert, args.docker_client_key),
                                    ca_cert=args.docker_ca_cert, assert_hostname=False)
@@ -21,24 +45,117 @@ def run(args):
     docker_client = docker.Client(base_url=args.docker_url, tls=tls, timeout=300)
     docker_client.verify = args.docker_tls_strict
 
+    if args.git_cache:
+        log.info('Using git mirrors cache: %s (limit %d MB)', args.git_cache, args.git_cache_size)
+        mirrors = MirrorStore(args.git_cache, args.git_cache_size * 1024 * 1024)
+    else:
+        mirrors = None
+
+    workspace_dir = args.workspace_dir or os.path.join(tempfile.gettempdir(), "lumper")
+    log.info('Using workspaces directory: %s (keep %d, limit %d MB)', workspace_dir, args.workspace_keep,
+             args.workspace_size)
+    workspaces = WorkspacePool(workspace_dir, args.workspace_size * 1024 * 1024, keep=args.workspace_keep)
+
+    network_jobs = args.network_jobs or args.concurrency
+
+    # Clone of the next build overlaps with docker build of the current one
+    # and push of the previous one.
+    pipeline = Pipeline(queue_size=args.stage_queue, finalizer=BuildHandler.cleanup)
+    pipeline.add_stage("prepare", BuildHandler.stage_prepare, workers=network_jobs)
+    pipeline.add_stage("build", BuildHandler.stage_build, workers=args.docker_jobs or args.concurrency)
+    pipeline.add_stage("push", BuildHandler.stage_push, workers=network_jobs)
+
+    metrics = Metrics()
+    metrics.describe("build_seconds", "histogram", "Duration of the builds")
+    metrics.describe("build_step_seconds", "histogram", "Duration of the build steps")
+    metrics.describe("builds_total", "counter", "Finished builds")
+    metrics.describe("git_bytes_total", "counter", "Bytes of the git objects cloned or fetched by the builds")
+    metrics.describe("docker_context_bytes_total", "counter", "Bytes of the build contexts sent to docker")
+    metrics.describe("workspaces_total", "counter", "Workspaces of the builds by reuse")
+    metrics.describe("image_cache_total", "counter", "Lookups of the images built from the same commit")
+
+    # Builds routed to this node by the server come to its own queue
+    state = NodeState(NODE_UUID, args.concurrency, UUID)
+    BuildHandler.bind(state.queue)
+
+    credentials = PlainCredentials(username=args.amqp_user, password=args.amqp_password) if args.amqp_user else None
+    parameters = ConnectionParameters(
+        host=args.amqp_address, port=args.amqp_port,
+        credentials=credentials, virtual_host=args.amqp_vhost
+    )
+
+    # Status, log and result messages of all builds go through one connection of the publisher thread
+    publisher = Publisher(parameters)
+
+    settings = Context(
+        options=args,
+        node_uuid=NODE_UUID,
+        uuid=UUID,
+        heartbeat_counter=0,
+        docker=docker_client,
+        mirrors=mirrors,
+        workspaces=workspaces,
+        submodules=Submodules(mirrors, jobs=args.submodule_jobs),
+        mtimes=CommitTimes(args.mtime_cache),
+        contexts=ContextCache(args.context_cache, args.context_cache_size * 1024 * 1024),
+        images=ImageIndex(args.image_index, args.image_index_size) if args.image_index else None,
+        network_slots=threading.BoundedSemaphore(network_jobs),
+        pipeline=pipeline,
+        state=state,
+        supersession=Supersession(),
+        publisher=publisher,
+        metrics=metrics,
+    )
+
+    errors = []
+
+    def listen():
+        try:
+            BuildListener(
+                port=args.amqp_port,
+                host=args.amqp_address,
+                credentials=credentials,
+                virtual_host=args.amqp_vhost,
+                handlers=context.handlers,
+                set_context=settings
+            ).loop()
+        except Exception as e:
+            errors.append(e)
+
     try:
         log.info('Testing docker connection: %s', args.docker_url)
         docker_client.info()
 
-        Listener(
-            port=args.amqp_port,
-            host=args.amqp_address,
-            credentials=PlainCredentials(username=args.amqp_user, password=args.amqp_password) if args.amqp_user else None,
-            virtual_host=args.amqp_vhost,
-            handlers=context.handlers,
-            set_context=Context(
-                options=args,
-                node_uuid=NODE_UUID,
-                uuid=UUID,
-                heartbeat_counter=0,
-                docker=docker_client
-            )
-        ).loop()
+        pipeline.start()
+        publisher.start()
+
+        if args.metrics_port:
+            serve_metrics(metrics, args.metrics_port)
+
+        # Every listener has an own connection and handles one build at a time.
+        # Prefetching listeners take the next builds while the current ones are running.
+        listeners = args.concurrency + args.prefetch
+        log.info('Starting %d listeners', listeners)
+        threads = [threading.Thread(target=listen, name="listener-%d" % i) for i in range(listeners)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        HeartbeatResponder(
+            parameters, role="worker", uuid=UUID, node_uuid=NODE_UUID, info=state.status
+        ).start()
+        SupersedeListener(parameters, settings.supersession).start()
+
+        advertiser = threading.Thread(target=advertise, args=(settings, args.status_interval), name="advertiser")
+        advertiser.daemon = True
+        advertiser.start()
+
+        while not errors and any(thread.is_alive() for thread in threads):
+            time.sleep(1)
+
+        if errors:
+            raise errors[0]
+
     except Exception as e:
         if logging.getLogger().level < logging.INFO:
             log.exception(e)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import logging
+
+log = logging.getLogger("handlers.admission")
+
+
+class Admission(object):
+    """ Limits of the queued and running builds for the whole cluster and per
+    repository. Zero means unlimited. Builds over the limit are rejected and
+    the sender is asked to retry later instead of queueing builds which would
+    expire before a worker picks them up. """
+
+    def __init__(self, index, max_builds=0, max_repo_builds=0, retry_after=60):
+        self.index = index
+        self.max_builds = max_builds
+        self.max_repo_builds = max_repo_builds
+        self.retry_after = retry_after
+        self.counters = {
+            "admitted": 0,
+            "rejected": 0,
+            "repo_rejected": 0,
+        }
+
+    def admit(self, data):
+        """ Returns True when the build might be queued. """
+        if self.max_builds and self.index.in_flight() >= self.max_builds:
+            log.warning('Rejecting build of "%s": %d builds in flight', data['name'], self.max_builds)
+            self.counters['rejected'] += 1
+            return False
+
+        if self.max_repo_builds and self.index.in_flight(data['name']) >= self.max_repo_builds:
+            log.warning('Rejecting build of "%s": %d builds of the repository in flight',
+                        data['name'], self.max_repo_builds)
+            self.counters['repo_rejected'] += 1
+            return False
+
+        self.counters['admitted'] += 1
+        return True
+
+    def stats(self):
+        result = dict(self.counters)
+        result.update({
+            "in_flight": self.index.in_flight(),
+            "max_builds": self.max_builds,
+            "max_repo_builds": self.max_repo_builds,
+        })
+        return result
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import json
+import logging
+import pika
+import tornado.gen
+import tornado.ioloop
+
+from collections import deque
+from datetime import timedelta
+from functools import partial
+from time import time
+from tornado.concurrent import Future
+from uuid import uuid4
+from .. import channels
+
+log = logging.getLogger("handlers.cluster")
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p / 100.))]
+
+
+class ClusterHeartbeat(object):
+    """ Sends the heartbeat to every worker and mailer at once through the
+    fanout exchange and collects the answers within the deadline.
+
+    The round trip times are kept per node in a rolling window. A node which
+    missed `forget` rounds in a row is forgotten. """
+
+    def __init__(self, client, deadline=2, window=1000, forget=10):
+        self.client = client
+        self.deadline = deadline
+        self.window = window
+        self.forget = forget
+        self.io_loop = tornado.ioloop.IOLoop.instance()
+        self.queue = "lumper.heartbeat.%s" % uuid4().hex
+        self.nodes = {}
+        self.rounds = {}
+        self.late = 0
+
+        client.channel.exchange_declare(channels.HEARTBEAT_EXCHANGE, exchange_type="fanout")
+        client.channel.queue_declare(queue=self.queue, exclusive=True, auto_delete=True)
+        client.consume(self.queue, self._on_reply)
+
+    @tornado.gen.coroutine
+    def ping(self, deadline=None):
+        deadline = deadline or self.deadline
+        round_id = uuid4().hex
+        expected = set(self.nodes)
+        current = {"sent": time(), "replies": {}, "expected": expected, "future": Future()}
+        self.rounds[round_id] = current
+
+        self.client.channel.basic_publish(
+            exchange=channels.HEARTBEAT_EXCHANGE,
+            routing_key='',
+            body=json.dumps({"id": round_id, "reply_to": self.queue, "sent": current['sent']}),
+            properties=pika.BasicProperties(
+                content_type="application/json",
+                expiration="%d" % (deadline * 1000)
+            )
+        )
+
+        timeout = self.io_loop.add_timeout(timedelta(seconds=deadline), partial(self._finish, round_id))
+        try:
+            yield current['future']
+        finally:
+            self.io_loop.remove_timeout(timeout)
+            self.rounds.pop(round_id, None)
+
+        for uuid in expected - set(current['replies']):
+            node = self.nodes.get(uuid)
+            if node is None:
+                continue
+
+            node['missed'] += 1
+            log.warning('Node %s (%s) missed the heartbeat %d times', uuid, node['role'], node['missed'])
+            if node['missed'] >= self.forget:
+                log.warning('Forgetting node %s (%s)', uuid, node['role'])
+                self.nodes.pop(uuid)
+
+        raise tornado.gen.Return(self.report(current, deadline))
+
+    def _finish(self, round_id):
+        current = self.rounds.get(round_id)
+        if current is not None and not current['future'].done():
+            current['future'].set_result(None)
+
+    def _on_reply(self, body, headers=None):
+        received = time()
+
+        try:
+            uuid = body['uuid']
+            current = self.rounds.get(body['id'])
+        except (KeyError, TypeError):
+            log.debug("Bad heartbeat reply: %r", body)
+            return
+
+        node = self.nodes.get(uuid)
+        if node is None:
+            log.info('Node %s (%s) joined the heartbeat', uuid, body.get('role'))
+            node = self.nodes[uuid] = {"rtt": deque(maxlen=self.window), "missed": 0}
+
+        node.update({
+            "role": body.get('role'),
+            "node": body.get('node'),
+            "beats": body.get('beats'),
+            "info": body.get('info'),
+            "last_seen": received,
+            "missed": 0,
+        })
+
+        if current is None:
+            # The answer came after the deadline
+            self.late += 1
+            return
+
+        node['rtt'].append(received - current['sent'])
+        current['replies'][uuid] = {
+            "rtt": (received - current['sent']) * 1000,
+            "delta": (body.get('time', received) - current['sent']) * 1000,
+        }
+
+        if current['expected'] and current['expected'] <= set(current['replies']):
+            self._finish(body['id'])
+
+    def histogram(self, uuid):
+        rtt = sorted(self.nodes[uuid]['rtt'])
+        return dict(
+            ("p%d" % p, percentile(rtt, p) * 1000 if rtt else None) for p in (50, 95, 99)
+        )
+
+    def report(self, current, deadline):
+        nodes = []
+        for uuid, node in sorted(self.nodes.items(), key=lambda i: (i[1]['role'], i[0])):
+            reply = current['replies'].get(uuid)
+            item = {
+                "uuid": uuid,
+                "node": node['node'],
+                "role": node['role'],
+                "beats": node['beats'],
+                "info": node['info'],
+                "last_seen": node['last_seen'],
+                "missed": node['missed'],
+                "answered": reply is not None,
+                "rtt": reply['rtt'] if reply else None,
+                "delta": reply['delta'] if reply else None,
+                "samples": len(node['rtt']),
+            }
+            item.update(self.histogram(uuid))
+            nodes.append(item)
+
+        return {
+            "time": current['sent'],
+            "deadline": deadline,
+            "answered": len(current['replies']),
+            "missing": sum(1 for n in nodes if not n['answered']),
+            "late": self.late,
+            "nodes": nodes,
+        }
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import heapq
+import logging
+
+from time import time
+
+log = logging.getLogger("handlers.dedup")
+
+
+class DeliveryIndex(object):
+    """ In-flight and recently finished builds keyed by (name, commit, tag)
+    plus the webhook delivery ids which queued them.
+
+    Queued builds live until the build timeout, finished builds live for `ttl`
+    seconds. The index is fed by the build status events of the workers. """
+
+    QUEUED = "queued"
+    STARTED = "started"
+    FINISHED = "finished"
+
+    def __init__(self, ttl=3600, timeout=600):
+        self.ttl = ttl
+        self.timeout = timeout
+        self.builds = {}
+        self.deliveries = {}
+        self._expires = []
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "delivery_hits": 0,
+            "build_hits": 0,
+        }
+
+    @staticmethod
+    def key(data):
+        return (data['name'].lower(), data['commit'], data['tag'])
+
+    def _push(self, key, expires):
+        self.builds[key]['expires'] = expires
+        heapq.heappush(self._expires, (expires, key))
+
+    def expire(self):
+        now = time()
+        while self._expires and self._expires[0][0] <= now:
+            expires, key = heapq.heappop(self._expires)
+            entry = self.builds.get(key)
+
+            # The entry was refreshed after this heap item was pushed
+            if entry is None or entry['expires'] > now:
+                continue
+
+            log.debug("Expiring build %r", key)
+            self.builds.pop(key)
+            for delivery in entry['deliveries']:
+                self.deliveries.pop(delivery, None)
+
+    def lookup(self, data, delivery=None):
+        """ Returns the entry of the same build or None. Counts hits and misses. """
+        self.expire()
+
+        key = self.deliveries.get(delivery) if delivery else None
+        if key is not None:
+            self.counters['delivery_hits'] += 1
+        else:
+            key = self.key(data)
+            if key in self.builds:
+                self.counters['build_hits'] += 1
+                if delivery:
+                    self.builds[key]['deliveries'].append(delivery)
+                    self.deliveries[delivery] = key
+
+        entry = self.builds.get(key)
+        self.counters['hits' if entry else 'misses'] += 1
+        return entry
+
+    def add(self, data, delivery=None):
+        key = self.key(data)
+        self.builds[key] = {
+            "name": key[0],
+            "commit": key[1],
+            "tag": key[2],
+            "status": self.QUEUED,
+            "created": time(),
+            "deliveries": [delivery] if delivery else [],
+        }
+        self._push(key, time() + self.timeout)
+
+        if delivery:
+            self.deliveries[delivery] = key
+
+        return self.builds[key]
+
+    def discard(self, data):
+        entry = self.builds.pop(self.key(data), None)
+        for delivery in (entry or {}).get('deliveries', []):
+            self.deliveries.pop(delivery, None)
+
+    def on_status(self, event):
+        try:
+            key = self.key(event)
+        except (KeyError, TypeError, AttributeError):
+            log.debug("Bad build status event: %r", event)
+            return
+
+        entry = self.builds.get(key)
+        if entry is None:
+            return
+
+        entry['status'] = event.get('status', entry['status'])
+        entry['node'] = event.get('node')
+
+        if entry['status'] == self.STARTED:
+            self._push(key, time() + self.timeout)
+        elif entry['status'] == self.FINISHED:
+            entry['success'] = event.get('success')
+            self._push(key, time() + self.ttl)
+
+    def in_flight(self, name=None):
+        """ Count of the queued and running builds, of the repository when `name` is passed. """
+        self.expire()
+        name = name.lower() if name else None
+        return sum(
+            1 for i in self.builds.values()
+            if i['status'] != self.FINISHED and (name is None or i['name'] == name)
+        )
+
+    def stats(self):
+        self.expire()
+        result = dict(self.counters)
+        result.update({
+            "builds": len(self.builds),
+            "in_flight": self.in_flight(),
+            "deliveries": len(self.deliveries),
+        })
+        return result
@@ -1,5 +1,9 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
-from heartbeat import HeartBeat
-from webhook import GitHubWebHookHandler
\ No newline at end of file
+from heartbeat import HeartBeat, ClusterHeartBeat
+from webhook import GitHubWebHookHandler
+from stats import DeliveryStats, SpoolStats, AdmissionStats, RoutingStats
+from metrics import MetricsHandler
+from builds import Builds, Build, BuildLogText
+from logs import LiveLogs, LiveLogStream
\ No newline at end of file
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import absolute_import
+import arrow
+from ..json_handler import JSONRequest
+from .. import register
+
+
+def timestamp(value):
+    try:
+        return float(value)
+    except ValueError:
+        return arrow.get(value).timestamp
+
+
+@register(r"/api/v1/builds")
+class Builds(JSONRequest):
+    """ GET /api/v1/builds?repo=&tag=&commit=&image=&success=&since=&until=&limit=&before= """
+    SUPPORTED_METHODS = ('GET',)
+
+    def get(self):
+        arg = self.get_argument
+        success = arg("success", None)
+
+        try:
+            result = self.settings['history'].query(
+                limit=int(arg("limit", 50)),
+                repo=arg("repo", None),
+                tag=arg("tag", None),
+                commit=arg("commit", None),
+                image=arg("image", None),
+                success=int(success.lower() in ("1", "true", "yes")) if success is not None else None,
+                since=timestamp(arg("since")) if arg("since", None) else None,
+                until=timestamp(arg("until")) if arg("until", None) else None,
+                before=int(arg("before")) if arg("before", None) else None,
+            )
+        except (ValueError, TypeError, arrow.parser.ParserError):
+            return self.send_error(400)
+
+        self.response(result)
+
+
+@register(r"/api/v1/builds/(\d+)")
+class Build(JSONRequest):
+    SUPPORTED_METHODS = ('GET',)
+
+    def get(self, build_id):
+        build = self.settings['history'].get(int(build_id))
+        if build is None:
+            return self.send_error(404)
+
+        self.response(build)
+
+
+@register(r"/api/v1/builds/(\d+)/log")
+class BuildLogText(JSONRequest):
+    SUPPORTED_METHODS = ('GET',)
+
+    def get(self, build_id):
+        build_log = self.settings['history'].log(int(build_id))
+        if build_log is None:
+            return self.send_error(404)
+
+        self.set_header("Content-Type", "text/plain; charset=utf-8")
+        self.finish(build_log.encode("utf-8"))
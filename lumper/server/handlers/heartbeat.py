@@ -14,9 +14,29 @@ class HeartBeat(JSONRequest):
     @tornado.gen.coroutine
     def get(self):
         start = time()
-        uuid, result, counter = yield self.settings['crew'].call('heartbeat')
+        reply = yield self.settings['crew'].call('heartbeat')
+        uuid, result, counter = reply[:3]
         self.response({
             "delta": (result - start) * 1000,
             "uuid": uuid,
-            "beats": counter
-        })
\ No newline at end of file
+            "beats": counter,
+            # Workers before the routing return no state
+            "state": reply[3] if len(reply) > 3 else None,
+        })
+
+
+@register(r"/api/v1/cluster/heartbeat")
+class ClusterHeartBeat(JSONRequest):
+    SUPPORTED_METHODS = ('GET',)
+    MAX_DEADLINE = 30
+
+    @tornado.gen.coroutine
+    def get(self):
+        try:
+            deadline = max(0, min(float(self.get_argument("deadline", 0)), self.MAX_DEADLINE))
+        except ValueError:
+            self.send_error(400)
+            return
+
+        result = yield self.settings['cluster'].ping(deadline or None)
+        self.response(result)
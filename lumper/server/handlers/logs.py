@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import absolute_import
+import json
+import tornado.web
+from tornado.iostream import StreamClosedError
+from ..json_handler import JSONRequest
+from .. import register
+
+
+@register(r"/api/v1/logs")
+class LiveLogs(JSONRequest):
+    """ GET /api/v1/logs?repo=&tag= - running and recently finished builds with the live logs """
+    SUPPORTED_METHODS = ('GET',)
+
+    def get(self):
+        self.response(self.settings['logs'].find(
+            name=self.get_argument("repo", None),
+            tag=self.get_argument("tag", None),
+        ))
+
+
+@register(r"/api/v1/logs/(\w+)/stream")
+class LiveLogStream(tornado.web.RequestHandler):
+    """ Server-Sent Events of the build log: the replay buffer first, then the
+    new lines as they come. The event id is the number of the line, so the
+    browser reconnects with Last-Event-ID and gets only the missed lines. """
+    SUPPORTED_METHODS = ('GET',)
+
+    stream = None
+
+    @tornado.web.asynchronous
+    def get(self, log_id):
+        self.stream = self.settings['logs'].get(log_id)
+        if self.stream is None:
+            return self.send_error(404)
+
+        try:
+            after = int(self.get_argument("after", self.request.headers.get("Last-Event-ID", 0)))
+        except ValueError:
+            after = 0
+
+        self.set_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.set_header("Cache-Control", "no-cache")
+        # Disables the response buffering of nginx
+        self.set_header("X-Accel-Buffering", "no")
+
+        self.send(self.stream.replay(after), self.stream.finished)
+        if not self._finished:
+            self.stream.listeners.add(self.send)
+
+    def send(self, chunk, finished):
+        if self._finished:
+            self.stream.listeners.discard(self.send)
+            return
+
+        if not chunk:
+            # Keeps the connection open through the proxies
+            self.write(": keepalive\n\n")
+
+        for number, line in chunk:
+            self.write("id: %d\n" % number)
+            for part in (line or u"").splitlines() or [u""]:
+                self.write(u"data: %s\n" % part)
+            self.write("\n")
+
+        if finished:
+            self.write("event: finished\ndata: %s\n\n" % json.dumps(self.stream.info()))
+
+        try:
+            self.flush()
+        except StreamClosedError:
+            finished = True
+
+        if finished:
+            self.stream.listeners.discard(self.send)
+            if not self._finished:
+                self.finish()
+
+    def on_connection_close(self):
+        if self.stream is not None:
+            self.stream.listeners.discard(self.send)
@@ -0,0 +1,15 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import absolute_import
+import tornado.web
+from .. import register
+
+
+@register(r"/metrics")
+class MetricsHandler(tornado.web.RequestHandler):
+    SUPPORTED_METHODS = ('GET',)
+
+    def get(self):
+        metrics = self.settings['metrics']
+        self.set_header("Content-Type", metrics.CONTENT_TYPE)
+        self.finish(metrics.render().encode("utf-8"))
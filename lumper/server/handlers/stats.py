@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import absolute_import
+from ..json_handler import JSONRequest
+from .. import register
+
+
+@register(r"/api/v1/stats/deliveries")
+class DeliveryStats(JSONRequest):
+    SUPPORTED_METHODS = ('GET',)
+
+    def get(self):
+        self.response(self.settings['deliveries'].stats())
+
+
+@register(r"/api/v1/stats/spool")
+class SpoolStats(JSONRequest):
+    SUPPORTED_METHODS = ('GET',)
+
+    def get(self):
+        self.response(self.settings['spool'].stats())
+
+
+@register(r"/api/v1/stats/admission")
+class AdmissionStats(JSONRequest):
+    SUPPORTED_METHODS = ('GET',)
+
+    def get(self):
+        self.response(self.settings['admission'].stats())
+
+
+@register(r"/api/v1/stats/scheduler")
+class SchedulerStats(JSONRequest):
+    SUPPORTED_METHODS = ('GET',)
+
+    def get(self):
+        self.response(self.settings['scheduler'].stats())
+
+
+@register(r"/api/v1/stats/supersede")
+class SupersedeStats(JSONRequest):
+    SUPPORTED_METHODS = ('GET',)
+
+    def get(self):
+        self.response(self.settings['supersession'].stats())
+
+
+@register(r"/api/v1/stats/routing")
+class RoutingStats(JSONRequest):
+    SUPPORTED_METHODS = ('GET',)
+
+    def get(self):
+        router = self.settings['router']
+        self.response(router.stats() if router else None)
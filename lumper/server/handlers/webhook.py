@@ -15,12 +15,54 @@ from tornado.gen import Future
 from tornado.log import app_log as log
 
 REXP={
-    "split_refs": re.compile("^refs\/(?P<key>\S+)\/(?P<value>\S+)")
+    "split_refs": re.compile("^refs\/(?P<key>\S+)\/(?P<value>\S+)"),
+    # Top level "ref" preceded by scalar members only, as GitHub and GitLab send it
+    "head_ref": re.compile(
+        r'^\s*\{(?:\s*"[^"\\]*"\s*:\s*(?:"(?:[^"\\]|\\.)*"|[-+\w.]+)\s*,)*?\s*"ref"\s*:\s*"(?P<ref>[^"\\]*)"'
+    ),
 }
 
+class BuildWebHook(JSONRequest):
+    PEEK_SIZE = 4096
+
+    def peek_ref(self):
+        """ Returns the "ref" of the payload without decoding the whole body, or None when it's not at the head. """
+        matcher = REXP['head_ref'].match(self.request.body[:self.PEEK_SIZE])
+        return matcher.group('ref') if matcher else None
+
+    def is_branch_push(self):
+        ref = self.peek_ref()
+        return ref is not None and not ref.startswith("refs/tags/")
+
+    def on_finish(self):
+        metrics = self.settings['metrics']
+        handler = type(self).__name__
+        metrics.inc("webhook_requests_total", handler=handler, code=self.get_status())
+        metrics.observe("webhook_seconds", self.request.request_time(), handler=handler)
+
+    def queue_build(self, data, delivery=None):
+        index = self.settings['deliveries']
+        entry = index.lookup(data, delivery)
+
+        if entry:
+            log.info('Build of "%s" tag "%s" (%s) is already %s', data['name'], data['tag'], data['commit'], entry['status'])
+            return self.response({"duplicate": True, "build": entry})
+
+        admission = self.settings['admission']
+        if not admission.admit(data):
+            self.set_status(429, reason="Too Many Requests")
+            self.set_header("Retry-After", admission.retry_after)
+            return self.response({"queued": False, "retry_after": admission.retry_after})
+
+        index.add(data, delivery)
+        self.settings['supersession'].on_build(data)
+        self.settings['spool'].put(data)
+        self.response(True)
+
+
 @register("/github/webhook/")
 @register("/webhook/github")
-class GitHubWebHookHandler(JSONRequest):
+class GitHubWebHookHandler(BuildWebHook):
     @tornado.web.asynchronous
     @tornado.gen.coroutine
     def post(self, *args, **kwargs):
@@ -48,7 +90,7 @@ class GitHubWebHookHandler(JSONRequest):
     def verify(self):
         signature = self.request.headers.get("X-Hub-Signature")
         h = hmac.new(self.settings['args'].github_secret, self.request.body, hashlib.sha1)
-        return "sha1=%s" % h.hexdigest() == signature
+        return hmac.compare_digest("sha1=%s" % h.hexdigest(), str(signature or ""))
 
     def event_ping(self):
         """ Just ping. """
@@ -61,6 +103,9 @@ class GitHubWebHookHandler(JSONRequest):
         return self._process_tag()
 
     def _process_tag(self):
+        if self.is_branch_push():
+            return self.response(False)
+
         matcher = REXP['split_refs'].match(self.json.get('ref', ""))
         if matcher:
             refs = matcher.groupdict()
@@ -77,8 +122,7 @@ class GitHubWebHookHandler(JSONRequest):
                     "sender": self.json['sender']['login']
                 }
 
-                self.settings['crew'].call("build", data, routing_key="crew.tasks.build.finished", expiration=self.settings.get('timeout', 600))
-                self.response(True)
+                self.queue_build(data, delivery=self.delivery)
         else:
             self.response(False)
 
@@ -124,11 +168,14 @@ class GitHubWebHookHandler(JSONRequest):
 
 
 @register("/webhook/gitlab")
-class CommonWebHookHandler(JSONRequest):
+class CommonWebHookHandler(BuildWebHook):
 
     @tornado.web.asynchronous
     @tornado.gen.coroutine
     def post(self, *args, **kwargs):
+        if self.is_branch_push():
+            return self.response(False)
+
         matcher = REXP['split_refs'].match(self.json.get('ref', ""))
         if matcher:
             refs = matcher.groupdict()
@@ -150,7 +197,6 @@ class CommonWebHookHandler(JSONRequest):
                     "sender": str(self.json['user_id']),
                 }
 
-                self.settings['crew'].call("build", data, routing_key="crew.tasks.build.finished", expiration=self.settings.get('timeout', 600))
-                self.response(True)
+                self.queue_build(data, delivery=self.request.headers.get("X-Gitlab-Event-UUID"))
         else:
             self.response(False)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import json
+import logging
+import os
+import sqlite3
+import tornado.ioloop
+import zlib
+
+from time import time
+from ..codec import unpack
+
+log = logging.getLogger("handlers.history")
+
+
+class BuildHistory(object):
+    """ Results of the builds in SQLite. The logs are compressed and kept in
+    the separate table, so scanning the builds never touches them. Pages are
+    selected by the id of the last build of the previous page instead of
+    OFFSET, so the query cost doesn't grow with the page number. """
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS builds (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            tag TEXT,
+            "commit" TEXT,
+            success INTEGER NOT NULL,
+            image TEXT,
+            node TEXT,
+            repo TEXT,
+            sender TEXT,
+            timestamp REAL,
+            started REAL,
+            finished REAL NOT NULL,
+            duration REAL,
+            timings TEXT,
+            error TEXT,
+            cache_hit INTEGER
+        )""",
+        """CREATE TABLE IF NOT EXISTS logs (
+            build_id INTEGER PRIMARY KEY REFERENCES builds(id) ON DELETE CASCADE,
+            data BLOB
+        )""",
+        'CREATE INDEX IF NOT EXISTS builds_name ON builds (name, id)',
+        'CREATE INDEX IF NOT EXISTS builds_tag ON builds (tag, id)',
+        'CREATE INDEX IF NOT EXISTS builds_commit ON builds ("commit", id)',
+        'CREATE INDEX IF NOT EXISTS builds_success ON builds (success, id)',
+        'CREATE INDEX IF NOT EXISTS builds_image ON builds (image, id)',
+        'CREATE INDEX IF NOT EXISTS builds_finished ON builds (finished)',
+    )
+
+    COLUMNS = (
+        "id", "name", "tag", "commit", "success", "image", "node", "repo",
+        "sender", "timestamp", "started", "finished", "duration", "timings", "error", "cache_hit",
+    )
+
+    # Columns added after the first release of the schema
+    MIGRATIONS = (
+        ("cache_hit", "ALTER TABLE builds ADD COLUMN cache_hit INTEGER"),
+    )
+
+    FILTERS = {
+        "repo": 'name = ?',
+        "tag": 'tag = ?',
+        "commit": '"commit" = ?',
+        "image": 'image = ?',
+        "success": 'success = ?',
+        "since": 'finished >= ?',
+        "until": 'finished < ?',
+        "before": 'id < ?',
+    }
+
+    MAX_LIMIT = 500
+    DELETE_BATCH = 1000
+
+    def __init__(self, path, retention=90):
+        self.path = path
+        self.retention = retention
+        self.io_loop = tornado.ioloop.IOLoop.instance()
+        self._expiring = False
+        self._expired = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        with self.db:
+            for statement in self.SCHEMA:
+                self.db.execute(statement)
+
+            columns = set(row[1] for row in self.db.execute("PRAGMA table_info(builds)"))
+            for column, statement in self.MIGRATIONS:
+                if column not in columns:
+                    self.db.execute(statement)
+
+    def add(self, result):
+        try:
+            started = result.get('started')
+            finished = result.get('finished') or time()
+            row = (
+                result['name'].lower(),
+                result.get('tag'),
+                result.get('commit'),
+                int(bool(result.get('success'))),
+                result.get('image'),
+                result.get('node'),
+                result.get('repo'),
+                result.get('sender'),
+                result.get('timestamp'),
+                started,
+                finished,
+                finished - started if started else None,
+                json.dumps(result.get('timings') or {}),
+                result.get('error'),
+                int(bool(result.get('cache_hit'))),
+            )
+        except (KeyError, TypeError, AttributeError):
+            log.debug("Bad build result: %r", result)
+            return
+
+        build_log = u"\n".join(unpack(result.get('log')) or []).encode("utf-8")
+
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT INTO builds (%s) VALUES (%s)" % (
+                    ", ".join('"%s"' % c for c in self.COLUMNS[1:]), ", ".join("?" * len(row))
+                ), row
+            )
+            self.db.execute(
+                "INSERT INTO logs (build_id, data) VALUES (?, ?)",
+                (cursor.lastrowid, sqlite3.Binary(zlib.compress(build_log)))
+            )
+
+        log.debug('Build %d of "%s" tag "%s" saved to the history', cursor.lastrowid, row[0], row[1])
+        return cursor.lastrowid
+
+    def _row(self, row):
+        item = dict(zip(self.COLUMNS, row))
+        item['success'] = bool(item['success'])
+        item['cache_hit'] = bool(item['cache_hit'])
+        item['timings'] = json.loads(item['timings']) if item['timings'] else {}
+        return item
+
+    def query(self, limit=50, **filters):
+        """ Newest builds first. The next page is requested with before=<id of the last build>. """
+        where, args = [], []
+        for key, value in filters.items():
+            if value is None:
+                continue
+            if key == 'repo':
+                value = value.lower()
+            where.append(self.FILTERS[key])
+            args.append(value)
+
+        limit = max(1, min(int(limit), self.MAX_LIMIT))
+        rows = self.db.execute(
+            "SELECT %s FROM builds %s ORDER BY id DESC LIMIT ?" % (
+                ", ".join('"%s"' % c for c in self.COLUMNS),
+                "WHERE %s" % " AND ".join(where) if where else ""
+            ), args + [limit]
+        ).fetchall()
+
+        builds = [self._row(row) for row in rows]
+        return {
+            "builds": builds,
+            "next": builds[-1]['id'] if len(builds) == limit else None,
+        }
+
+    def get(self, build_id):
+        row = self.db.execute(
+            "SELECT %s FROM builds WHERE id = ?" % ", ".join('"%s"' % c for c in self.COLUMNS), (build_id,)
+        ).fetchone()
+        return self._row(row) if row else None
+
+    def log(self, build_id):
+        row = self.db.execute("SELECT data FROM logs WHERE build_id = ?", (build_id,)).fetchone()
+        return zlib.decompress(bytes(row[0])).decode("utf-8") if row else None
+
+    def expire(self):
+        """ Deletes one batch of the builds older than the retention and
+        schedules the next one on the IOLoop, so a large backlog never blocks
+        the server for long. """
+        if not self.retention:
+            return 0
+
+        edge = time() - self.retention * 86400
+        batch = "SELECT id FROM builds WHERE finished < ? ORDER BY id LIMIT ?"
+        with self.db:
+            self.db.execute("DELETE FROM logs WHERE build_id IN (%s)" % batch, (edge, self.DELETE_BATCH))
+            deleted = self.db.execute("DELETE FROM builds WHERE id IN (%s)" % batch, (edge, self.DELETE_BATCH)).rowcount
+
+        self._expired += deleted
+        if deleted >= self.DELETE_BATCH:
+            self._expiring = True
+            self.io_loop.add_callback(self.expire)
+            return deleted
+
+        self._expiring = False
+        if self._expired:
+            log.info("Deleted %d builds older than %d days from the history", self._expired, self.retention)
+            self._expired = 0
+        return deleted
+
+    def schedule_expire(self):
+        """ Starts the expiration unless the batches of the previous one are still running. """
+        if not self._expiring:
+            self.expire()
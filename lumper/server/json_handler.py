@@ -4,6 +4,7 @@ import tornado.web
 import json
 import traceback
 import logging
+from lumper.codec import CODECS, MsgpackCodec, default
 
 log = logging.getLogger("handlers.json")
 
@@ -44,14 +45,7 @@ class JSONRequest(tornado.web.RequestHandler):
                     log.error(repr(e))
                     self.write_error(400)
 
-    @staticmethod
-    def default(obj):
-        if hasattr(obj, '__dict__'):
-            return obj.__dict__
-        elif hasattr(obj, '_to_json'):
-            return obj._to_json()
-        else:
-            return str(obj)
+    default = staticmethod(default)
 
     def _jsonify(self, data):
         default = self.default
@@ -64,8 +58,17 @@ class JSONRequest(tornado.web.RequestHandler):
             default=default
         )
 
+    @property
+    def accepts_msgpack(self):
+        return MsgpackCodec.name in CODECS and MsgpackCodec.content_type in self.request.headers.get("Accept", "")
+
     def response(self, data, finish=False):
         if not self._finished:
-            self.write(self._jsonify(data))
+            self.set_header("Vary", "Accept")
+            if self.accepts_msgpack:
+                self.set_header("Content-Type", MsgpackCodec.content_type)
+                self.write(MsgpackCodec.encode(data, default=self.default))
+            else:
+                self.write(self._jsonify(data))
             if finish:
                 self.finish()
\ No newline at end of file
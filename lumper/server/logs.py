@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import logging
+
+from collections import deque
+from time import time
+
+log = logging.getLogger("handlers.logs")
+
+
+class LogStream(object):
+    """ Lines of one running build. The last `replay` lines are kept for the
+    viewers which join late. Every line has its number, so a reconnected
+    viewer continues from the last line it got. """
+
+    def __init__(self, meta, replay=500):
+        self.meta = meta
+        self.buffer = deque(maxlen=replay)
+        self.listeners = set()
+        self.lines = 0
+        self.seq = -1
+        self.finished = False
+        self.updated = time()
+
+    def replay(self, after=0):
+        return [(number, line) for number, line in self.buffer if number > after]
+
+    def add(self, seq, lines, finished):
+        # pubsub may deliver a chunk twice after the reconnection of the worker
+        if seq <= self.seq:
+            return
+
+        self.seq = seq
+        self.updated = time()
+        chunk = []
+        for line in lines:
+            self.lines += 1
+            chunk.append((self.lines, line))
+
+        self.buffer.extend(chunk)
+        self.finished = finished
+        self.notify(chunk)
+
+    def notify(self, chunk):
+        for listener in list(self.listeners):
+            try:
+                listener(chunk, self.finished)
+            except Exception as e:
+                log.exception(e)
+                self.listeners.discard(listener)
+
+    def info(self):
+        return dict(self.meta, lines=self.lines, finished=self.finished, viewers=len(self.listeners),
+                    updated=self.updated)
+
+
+class LogStreams(object):
+    """ Build logs published by the workers on the BUILD_LOG channel. The
+    server has one subscription to the channel and fans the lines out to
+    every viewer of the build. The stream lives for `ttl` seconds after the
+    last chunk, so the viewers may read the end of the finished build. """
+
+    def __init__(self, replay=500, ttl=300):
+        self.replay = replay
+        self.ttl = ttl
+        self.streams = {}
+
+    def on_chunk(self, message):
+        try:
+            log_id = message['id']
+            stream = self.streams.get(log_id)
+            if stream is None:
+                meta = dict((k, message.get(k)) for k in ("name", "tag", "commit"))
+                stream = self.streams[log_id] = LogStream(dict(meta, id=log_id), replay=self.replay)
+
+            stream.add(message['seq'], message.get('lines') or [], bool(message.get('finished')))
+        except (KeyError, TypeError, AttributeError):
+            log.debug("Bad build log chunk: %r", message)
+
+    def get(self, log_id):
+        return self.streams.get(log_id)
+
+    def find(self, name=None, tag=None):
+        name = name.lower() if name else None
+        return sorted(
+            (
+                s.info() for s in self.streams.values()
+                if (name is None or (s.meta['name'] or '').lower() == name) and (tag is None or s.meta['tag'] == tag)
+            ),
+            key=lambda i: i['updated'], reverse=True
+        )
+
+    def expire(self):
+        """ Forgets the streams without the chunks for `ttl` seconds and keeps the connections of the viewers alive. """
+        edge = time() - self.ttl
+        for log_id, stream in list(self.streams.items()):
+            if stream.updated < edge:
+                log.debug("Forgetting build log %s", log_id)
+                stream.finished = True
+                stream.notify([])
+                self.streams.pop(log_id)
+            else:
+                stream.notify([])
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import bisect
+import hashlib
+import logging
+
+from time import time
+
+log = logging.getLogger("handlers.router")
+
+
+class HashRing(object):
+    """ Consistent hash of the repository names over the nodes. Adding or
+    removing a node moves only the repositories of its neighbours. """
+
+    def __init__(self, nodes=(), replicas=64):
+        self.replicas = replicas
+        self.nodes = frozenset(nodes)
+        self._ring = sorted(
+            (self.hash("%s:%d" % (node, i)), node) for node in self.nodes for i in range(replicas)
+        )
+        self._keys = [key for key, _ in self._ring]
+
+    @staticmethod
+    def hash(value):
+        return int(hashlib.md5(value.encode("utf-8")).hexdigest()[:16], 16)
+
+    def get(self, name):
+        if not self._ring:
+            return None
+
+        idx = bisect.bisect(self._keys, self.hash(name)) % len(self._ring)
+        return self._ring[idx][1]
+
+
+class Router(object):
+    """ Chooses the queue of the build by the states advertised by the workers.
+
+    The node which built the repository recently has the docker layers in the
+    cache, so it's preferred. Then the node of the repository on the hash ring.
+    A busy node is replaced by the least loaded one, and when the whole cluster
+    is busy or no states were received the build goes to the shared queue.
+
+    The queue of the node outlives it, so `on_gone` is called with the task
+    name of the node which stopped advertising and the builds waiting there
+    are routed again. The unacknowledged builds return to the queue when the
+    broker notices the lost connection, so the queue is drained every `ttl`
+    seconds until the builds would expire.
+
+    Worker processes of one host consume the same node queue, so their
+    capacities and loads are summed up under the node. """
+
+    SHARED = "build"
+
+    def __init__(self, ttl=30, timeout=600, replicas=64, on_gone=None):
+        self.ttl = ttl
+        self.timeout = timeout
+        self.replicas = replicas
+        self.on_gone = on_gone
+        self.nodes = {}
+        # Statuses of the worker processes: node -> {uuid: status}
+        self.processes = {}
+        # Gone nodes: node -> (task, gone time, drained time)
+        self.gone = {}
+        self.ring = HashRing(replicas=replicas)
+        # Builds routed to a node and not started yet: key -> (node, routed time)
+        self.waiting = {}
+        self.counters = {
+            "cached": 0,
+            "hashed": 0,
+            "least_loaded": 0,
+            "shared": 0,
+        }
+
+    @staticmethod
+    def key(data):
+        return (data['name'].lower(), data['commit'], data['tag'])
+
+    @classmethod
+    def task(cls, node, status):
+        return status.get('queue') or "%s.%s" % (cls.SHARED, node)
+
+    def on_worker_status(self, status):
+        try:
+            node = status['node']
+        except (KeyError, TypeError):
+            log.debug("Bad worker status: %r", status)
+            return
+
+        if node not in self.nodes:
+            log.info("Worker node %s joined with %d slots", node, status.get('capacity', 0))
+
+        status['seen'] = time()
+        status['repos'] = set(status.get('repos') or ())
+        processes = self.processes.setdefault(node, {})
+        processes[status.get('uuid') or node] = status
+        self.nodes[node] = self.merge(processes)
+
+    @staticmethod
+    def merge(processes):
+        statuses = list(processes.values())
+        result = dict(max(statuses, key=lambda s: s['seen']))
+        result['capacity'] = sum(s.get('capacity') or 0 for s in statuses)
+        result['running'] = sum(s.get('running') or 0 for s in statuses)
+        result['repos'] = set().union(*(s['repos'] for s in statuses))
+        result['processes'] = len(statuses)
+        return result
+
+    def on_build_status(self, event):
+        try:
+            self.waiting.pop(self.key(event), None)
+        except (KeyError, TypeError, AttributeError):
+            pass
+
+    def alive(self):
+        edge = time() - self.ttl
+        for node, processes in list(self.processes.items()):
+            stale = [uuid for uuid, status in processes.items() if status['seen'] < edge]
+            if not stale:
+                continue
+
+            for uuid in stale:
+                processes.pop(uuid)
+
+            if processes:
+                log.warning("Worker %s of node %s is gone", ", ".join(map(str, stale)), node)
+                self.nodes[node] = self.merge(processes)
+            else:
+                log.warning("Worker node %s is gone", node)
+                self.processes.pop(node)
+                status = self.nodes.pop(node)
+
+                for key, (n, _) in list(self.waiting.items()):
+                    if n == node:
+                        self.waiting.pop(key)
+
+                if self.on_gone is not None:
+                    self.gone[node] = (self.task(node, status), time(), 0)
+
+        now = time()
+        for node, (task, since, drained) in list(self.gone.items()):
+            if node in self.nodes or since < now - self.timeout:
+                # It's back or its builds are expired
+                self.gone.pop(node)
+            elif drained < now - self.ttl:
+                self.gone[node] = (task, since, now)
+                self.on_gone(task)
+
+        # Builds expired in the queue of the node
+        edge = time() - self.timeout
+        for key, (node, routed) in list(self.waiting.items()):
+            if routed < edge:
+                self.waiting.pop(key)
+
+        if self.ring.nodes != frozenset(self.nodes):
+            self.ring = HashRing(self.nodes, self.replicas)
+
+        return self.nodes
+
+    def load(self, node):
+        waiting = sum(1 for n, _ in self.waiting.values() if n == node)
+        status = self.nodes[node]
+        return status.get('running', 0) + waiting, status.get('capacity') or 1
+
+    def free(self, node):
+        load, capacity = self.load(node)
+        return load < capacity
+
+    def route(self, data):
+        """ Returns the crew task name for the build. """
+        nodes = self.alive()
+        name = data['name'].lower()
+
+        def least_loaded(candidates):
+            candidates = [n for n in candidates if self.free(n)]
+            if candidates:
+                return min(candidates, key=lambda n: float(self.load(n)[0]) / self.load(n)[1])
+
+        node = least_loaded(n for n, s in nodes.items() if name in s['repos'])
+        reason = 'cached'
+
+        if node is None:
+            node = self.ring.get(name)
+            reason = 'hashed'
+
+            if node is not None and not self.free(node):
+                node = least_loaded(nodes)
+                reason = 'least_loaded'
+
+        if node is None:
+            self.counters['shared'] += 1
+            return self.SHARED
+
+        log.debug('Routing build of "%s" to node %s (%s)', name, node, reason)
+        self.counters[reason] += 1
+        self.waiting[self.key(data)] = (node, time())
+        return self.task(node, nodes[node])
+
+    def stats(self):
+        nodes = self.alive()
+        result = dict(self.counters)
+        result['nodes'] = dict(
+            (node, {
+                "capacity": status.get('capacity'),
+                "running": status.get('running'),
+                "processes": status.get('processes'),
+                "load": self.load(node)[0],
+                "repos": len(status['repos']),
+                "seen": status['seen'],
+            }) for node, status in nodes.items()
+        )
+        return result
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import logging
+
+from collections import deque
+from fnmatch import fnmatch
+from time import time
+from .cluster import percentile
+
+log = logging.getLogger("handlers.scheduler")
+
+
+def parse_rules(items, kind=int):
+    """ "PATTERN=VALUE" strings of the command line to the list of (pattern, value). """
+    rules = []
+    for item in items:
+        pattern, sep, value = item.rpartition("=")
+        if not sep or not pattern:
+            raise ValueError('Rule "%s" must look like PATTERN=VALUE' % item)
+        rules.append((pattern.lower(), kind(value)))
+    return rules
+
+
+class FairScheduler(object):
+    """ Chooses the next build request of the spool to publish.
+
+    Requests of the highest priority class go first. Within the class the
+    tenants (repositories or organizations) are served by the weighted fair
+    queuing: every published build moves the virtual time of its tenant by
+    1/weight and the tenant with the smallest virtual time is the next, so a
+    tenant which tags in bulk can't starve the others. Each tenant is FIFO.
+
+    The order of the requests matters only while they are in the server, so
+    at most `window` published builds wait for a worker in RabbitMQ and the
+    rest of them wait here. By default the window is twice the build slots
+    advertised by the live workers, 0 disables it. """
+
+    WAIT_WINDOW = 1000
+    MIN_WINDOW = 4
+
+    def __init__(self, key="repo", priorities=(), weights=(), window=None, timeout=600, metrics=None,
+                 worker_ttl=30):
+        self.key = key
+        self.priorities = parse_rules(priorities)
+        self.weights = parse_rules(weights, float)
+        self.window = window
+        self.timeout = timeout
+        self.metrics = metrics
+        self.worker_ttl = worker_ttl
+        # node => (build slots, seen)
+        self.workers = {}
+
+        # (priority, tenant) => deque of request ids
+        self.queues = {}
+        # request id => (priority, tenant)
+        self.requests = {}
+        self.vtime = {}
+        self.clock = 0.
+        # build key => (tenant, accepted, published)
+        self.waiting = {}
+        self.waits = {}
+        self.counters = {
+            "dispatched": 0,
+            "started": 0,
+        }
+
+    def tenant(self, data):
+        name = data['name'].lower()
+        return name.split("/", 1)[0] if self.key == "org" else name
+
+    def priority(self, data):
+        for pattern, priority in self.priorities:
+            if fnmatch(data['tag'].lower(), pattern) or fnmatch(data['name'].lower(), pattern):
+                return priority
+        return 0
+
+    def weight(self, tenant):
+        for pattern, weight in self.weights:
+            if fnmatch(tenant, pattern):
+                return max(weight, 0.001)
+        return 1.
+
+    @staticmethod
+    def build_key(data):
+        return (data['name'].lower(), data['commit'], data['tag'])
+
+    def add(self, request_id, data, front=False):
+        queue_key = (self.priority(data), self.tenant(data))
+        queue = self.queues.setdefault(queue_key, deque())
+        if front:
+            # Returned by the broker, so it isn't in RabbitMQ any more
+            self.waiting.pop(self.build_key(data), None)
+            queue.appendleft(request_id)
+        else:
+            queue.append(request_id)
+        self.requests[request_id] = queue_key
+
+    def remove(self, request_id):
+        queue_key = self.requests.pop(request_id, None)
+        if queue_key is None:
+            return
+
+        queue = self.queues[queue_key]
+        queue.remove(request_id)
+        if not queue:
+            self.queues.pop(queue_key)
+
+    def on_worker_status(self, status):
+        try:
+            # Worker processes of one host have the same node
+            self.workers[(status['node'], status.get('uuid'))] = (int(status.get('capacity') or 1), time())
+        except (KeyError, TypeError, ValueError):
+            log.debug("Bad worker status: %r", status)
+
+    def limit(self):
+        """ Published builds which may wait for a worker, 0 - unlimited. """
+        if self.window is not None:
+            return self.window
+
+        edge = time() - self.worker_ttl
+        for worker, (_, seen) in list(self.workers.items()):
+            if seen < edge:
+                self.workers.pop(worker)
+
+        # The prefetching listeners of the workers take the next builds while the current ones are running
+        return max(self.MIN_WINDOW, 2 * sum(slots for slots, _ in self.workers.values()))
+
+    def ready(self):
+        """ True when one more build may be published. """
+        window = self.limit()
+        if not window:
+            return True
+
+        edge = time() - self.timeout
+        for key, (_, _, published) in list(self.waiting.items()):
+            # Lost in the queue or its status event was lost
+            if published < edge:
+                self.waiting.pop(key)
+
+        return len(self.waiting) < window
+
+    def pop(self):
+        """ Returns the id of the next request or None. """
+        if not self.queues:
+            return None
+
+        priority = max(p for p, _ in self.queues)
+        start, tenant = min(
+            (max(self.vtime.get(t, 0.), self.clock), t) for p, t in self.queues if p == priority
+        )
+
+        # An idle tenant starts from the current virtual time and never saves up the credit
+        self.clock = start
+        self.vtime[tenant] = start + 1. / self.weight(tenant)
+
+        queue_key = (priority, tenant)
+        queue = self.queues[queue_key]
+        request_id = queue.popleft()
+        if not queue:
+            self.queues.pop(queue_key)
+
+        self.requests.pop(request_id, None)
+        return request_id
+
+    def dispatched(self, data, accepted):
+        self.counters['dispatched'] += 1
+        self.waiting[self.build_key(data)] = (self.tenant(data), accepted, time())
+
+    def on_build_status(self, event):
+        """ Returns True when the build left the RabbitMQ queue. """
+        try:
+            key = self.build_key(event)
+        except (KeyError, TypeError, AttributeError):
+            return False
+
+        entry = self.waiting.pop(key, None)
+        if entry is None:
+            return False
+
+        tenant, accepted, _ = entry
+        wait = time() - accepted
+        self.counters['started'] += 1
+        self.waits.setdefault(tenant, deque(maxlen=self.WAIT_WINDOW)).append(wait)
+        if self.metrics is not None:
+            self.metrics.observe("build_queue_seconds", wait, tenant=tenant)
+        return True
+
+    def stats(self):
+        tenants = {}
+
+        def item(tenant):
+            if tenant not in tenants:
+                tenants[tenant] = {"pending": 0, "priorities": {}, "waiting": 0, "weight": self.weight(tenant)}
+            return tenants[tenant]
+
+        for (priority, tenant), queue in self.queues.items():
+            item(tenant)['pending'] += len(queue)
+            item(tenant)['priorities'][priority] = len(queue)
+
+        for tenant, _, _ in self.waiting.values():
+            item(tenant)['waiting'] += 1
+
+        # Time from the webhook to the start of the build
+        for tenant, waits in self.waits.items():
+            waits = sorted(waits)
+            item(tenant).update(("wait_p%d" % p, percentile(waits, p)) for p in (50, 95, 99))
+
+        result = dict(self.counters)
+        result.update({
+            "key": self.key,
+            "window": self.limit(),
+            "workers": len(self.workers),
+            "waiting": len(self.waiting),
+            "tenants": tenants,
+        })
+        return result
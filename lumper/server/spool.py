@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import json
+import logging
+import os
+import pika
+import tornado.ioloop
+import zlib
+
+from collections import OrderedDict
+from uuid import uuid4
+from time import time
+
+log = logging.getLogger("handlers.spool")
+
+
+class QueueDrain(object):
+    """ Consumes the queue of a gone worker on an own channel and passes the
+    build requests back to the spool, so they're routed to the live workers.
+    The channel is closed when the queue is idle for IDLE seconds. """
+
+    IDLE = 5
+
+    def __init__(self, spool, connection, queue):
+        self.spool = spool
+        self.queue = queue
+        self.channel = None
+        self.timeout = None
+        self.moved = 0
+        connection.channel(on_open_callback=self.on_open)
+
+    def on_open(self, channel):
+        self.channel = channel
+        channel.add_on_close_callback(self.on_close)
+        channel.basic_consume(self.on_message, queue=self.queue)
+        self.touch()
+
+    def touch(self):
+        io_loop = self.spool.io_loop
+        if self.timeout is not None:
+            io_loop.remove_timeout(self.timeout)
+        self.timeout = io_loop.add_timeout(time() + self.IDLE, self.close)
+
+    def on_message(self, channel, method, props, body):
+        self.touch()
+        try:
+            data = self.spool.client.parse_body(body, props)
+        except Exception as e:
+            log.warning('Dropping broken build request from "%s": %r', self.queue, e)
+        else:
+            # Written to the journal before the broker forgets it
+            self.spool.restore(data, getattr(props, 'timestamp', None))
+            self.moved += 1
+
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+
+    def close(self):
+        self.timeout = None
+        if self.channel is not None and self.channel.is_open:
+            self.channel.close()
+
+    def on_close(self, channel, *args):
+        if self.timeout is not None:
+            self.spool.io_loop.remove_timeout(self.timeout)
+            self.timeout = None
+        log.info('Moved %d build requests from "%s" back to the spool', self.moved, self.queue)
+
+
+class BuildSpool(object):
+    """ Accepted build requests are appended to the journal before the webhook
+    is answered and published to RabbitMQ in the background.
+
+    The journal is a file of JSON lines: {"id", "time", "data"} for the accepted
+    request and {"ack": [ids]} for the requests confirmed by the broker. The
+    requests without "ack" are published again after the restart. The spool
+    uses its own channel in the confirm mode on the connection of crew client.
+    With the router every request is routed at the moment of publishing. The
+    scheduler chooses the order of the pending requests and holds them back
+    while its window of published builds is full. Builds routed to a worker
+    which is gone are taken back from its queue and routed again. """
+
+    TASK = "build"
+    REPLY_TO = "crew.tasks.build.finished"
+    JOURNAL = "builds.journal"
+    COMPACT_SIZE = 16 * 1024 * 1024
+    GZIP_SIZE = 32 * 1024
+
+    def __init__(self, path, client, scheduler, expiration=600, batch_size=100, fsync=False, router=None):
+        self.path = path
+        self.client = client
+        self.scheduler = scheduler
+        self.router = router
+        self.expiration = expiration
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.io_loop = tornado.ioloop.IOLoop.instance()
+
+        self.pending = OrderedDict()
+        self.unconfirmed = OrderedDict()
+        self.channel = None
+        self.connection = None
+        self._delivery_tag = 0
+        self._drain_scheduled = False
+        self.counters = {
+            "accepted": 0,
+            "published": 0,
+            "confirmed": 0,
+            "nacked": 0,
+            "republished": 0,
+            "expired": 0,
+            "discarded": 0,
+            "rerouted": 0,
+        }
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        self.journal_name = os.path.join(path, self.JOURNAL)
+        self._replay()
+        self.journal = open(self.journal_name, "a")
+
+        client.channel.add_open_listener(self._on_connection_open)
+        client.channel.add_close_listener(self._on_connection_close)
+
+    def _replay(self):
+        if not os.path.exists(self.journal_name):
+            return
+
+        records = OrderedDict()
+        with open(self.journal_name) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The tail of the journal written at the moment of crash
+                    log.warning("Skipping broken journal record: %r", line)
+                    continue
+
+                if 'ack' in record:
+                    for request_id in record['ack']:
+                        records.pop(request_id, None)
+                else:
+                    records[record['id']] = record
+
+        self._rewrite(records.values())
+        self.pending = records
+        for request_id, record in records.items():
+            self.scheduler.add(request_id, record['data'])
+
+        if records:
+            log.info("Replaying %d build requests from the spool", len(records))
+
+    def _rewrite(self, records):
+        tmp_name = "%s.tmp" % self.journal_name
+        with open(tmp_name, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_name, self.journal_name)
+
+    def _write(self, record):
+        self.journal.write(json.dumps(record) + "\n")
+        self.journal.flush()
+        if self.fsync:
+            os.fsync(self.journal.fileno())
+
+    def put(self, data):
+        record = {"id": uuid4().hex, "time": time(), "data": data}
+        self._write(record)
+        self.pending[record['id']] = record
+        self.scheduler.add(record['id'], data)
+        self.counters['accepted'] += 1
+        self.schedule()
+        return record['id']
+
+    def restore(self, data, timestamp=None):
+        """ The published request taken back from the queue of a gone worker. """
+        record = {"id": uuid4().hex, "time": timestamp or time(), "data": data}
+        self._write(record)
+        self.pending[record['id']] = record
+        self.scheduler.add(record['id'], data, front=True)
+        self.counters['rerouted'] += 1
+        self.schedule()
+        return record['id']
+
+    def reroute(self, task):
+        """ Takes the builds back from the queue of the crew task of a gone worker. """
+        if self.connection is None or not self.connection.is_open:
+            log.warning('Can\'t take the builds back from "%s": not connected', task)
+            return
+
+        log.warning('Taking the builds back from the queue of "%s"', task)
+        return QueueDrain(self, self.connection, "crew.tasks.%s" % task)
+
+    def discard(self, predicate):
+        """ Drops the pending requests whose data matches the predicate and returns their data. """
+        ids = [request_id for request_id, record in self.pending.items() if predicate(record['data'])]
+        records = [self.pending.pop(request_id) for request_id in ids]
+        for request_id in ids:
+            self.scheduler.remove(request_id)
+
+        self.counters['discarded'] += len(records)
+        self._ack(ids)
+        return [record['data'] for record in records]
+
+    def schedule(self):
+        if not self._drain_scheduled:
+            self._drain_scheduled = True
+            self.io_loop.add_callback(self.drain)
+
+    def _on_connection_open(self, adapter):
+        self.connection = adapter.connection
+        adapter.connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_channel_open(self, channel):
+        channel.add_on_close_callback(self._on_channel_close)
+        channel.confirm_delivery(self._on_confirm)
+        self.channel = channel
+        self._delivery_tag = 0
+        log.info("Build spool channel is opened, %d requests pending", len(self.pending))
+        self.schedule()
+
+    def _on_connection_close(self, adapter):
+        self._on_channel_close(self.channel)
+
+    def _on_channel_close(self, channel, *args):
+        if channel is not self.channel:
+            return
+
+        self.channel = None
+        self._requeue(list(self.unconfirmed))
+
+    def _requeue(self, tags):
+        # Unconfirmed requests go ahead of the new ones
+        records = [self.unconfirmed.pop(tag) for tag in tags]
+        self.counters['republished'] += len(records)
+
+        rest = self.pending
+        self.pending = OrderedDict((r['id'], r) for r in records)
+        self.pending.update(rest)
+        for record in reversed(records):
+            self.scheduler.add(record['id'], record['data'], front=True)
+
+    def _properties(self, record, expiration, gzip=False):
+        """ The same properties as crew's Client.call() sets. The dead letters
+        are routed to the client by the "x-original-sender" header. """
+        return pika.BasicProperties(
+            content_encoding='gzip' if gzip else 'plain',
+            content_type=self.client.SERIALIZERS['pickle'],
+            reply_to=self.REPLY_TO,
+            correlation_id="build.%s" % record['id'],
+            headers={"x-original-sender": self.client._res_queue},
+            timestamp=int(record['time']),
+            delivery_mode=2,
+            priority=min(max(self.scheduler.priority(record['data']), 0), 255),
+            expiration="%d" % (expiration * 1000),
+        )
+
+    def _body(self, data):
+        """ Returns the serialized request and whether it's compressed, like crew's Client.call(). """
+        serializer, _ = self.client.get_serializer('pickle')
+        body = serializer(data)
+        if len(body) > self.GZIP_SIZE:
+            return zlib.compress(body, 6), True
+        return body, False
+
+    def drain(self):
+        self._drain_scheduled = False
+        if self.channel is None or not self.channel.is_open:
+            return
+
+        expired = []
+
+        while self.pending and len(self.unconfirmed) < self.batch_size and self.scheduler.ready():
+            request_id = self.scheduler.pop()
+            record = self.pending.pop(request_id)
+
+            # The request could spend its lifetime in the spool while the broker was down
+            expiration = int(self.expiration - (time() - record['time']))
+            if expiration <= 0:
+                log.warning('Build request of "%s" tag "%s" expired in the spool',
+                            record['data'].get('name'), record['data'].get('tag'))
+                expired.append(request_id)
+                continue
+
+            task = self.router.route(record['data']) if self.router else self.TASK
+            body, gzip = self._body(record['data'])
+            self.channel.basic_publish(
+                exchange='',
+                routing_key="crew.tasks.%s" % task,
+                body=body,
+                properties=self._properties(record, expiration, gzip)
+            )
+
+            self._delivery_tag += 1
+            self.unconfirmed[self._delivery_tag] = record
+            self.scheduler.dispatched(record['data'], record['time'])
+            self.counters['published'] += 1
+
+        if expired:
+            self.counters['expired'] += len(expired)
+            self._ack(expired)
+
+    def on_build_status(self, event):
+        # The build left the queue, so the window of the scheduler has a free slot
+        if self.scheduler.on_build_status(event):
+            self.schedule()
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        if method.multiple:
+            tags = [tag for tag in self.unconfirmed if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag] if method.delivery_tag in self.unconfirmed else []
+
+        if isinstance(method, pika.spec.Basic.Ack):
+            records = [self.unconfirmed.pop(tag) for tag in tags]
+            self.counters['confirmed'] += len(records)
+            self._ack([r['id'] for r in records])
+        else:
+            log.warning("Broker rejected %d build requests, publishing them again", len(tags))
+            self.counters['nacked'] += len(tags)
+            self._requeue(tags)
+
+        self.schedule()
+
+    def _ack(self, ids):
+        if not ids:
+            return
+
+        self._write({"ack": ids})
+
+        if not self.pending and not self.unconfirmed:
+            self.journal.seek(0)
+            self.journal.truncate()
+        elif self.journal.tell() > self.COMPACT_SIZE:
+            self.journal.close()
+            self._rewrite(list(self.unconfirmed.values()) + list(self.pending.values()))
+            self.journal = open(self.journal_name, "a")
+
+    def stats(self):
+        result = dict(self.counters)
+        result.update({
+            "pending": len(self.pending),
+            "unconfirmed": len(self.unconfirmed),
+            "connected": self.channel is not None,
+        })
+        return result
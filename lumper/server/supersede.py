@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import json
+import logging
+import pika
+
+from fnmatch import fnmatch
+from time import time
+from .. import channels
+from ..versions import version_key
+
+log = logging.getLogger("handlers.supersede")
+
+
+class Supersession(object):
+    """ Opt-in supersession of the builds of the repositories matched by the
+    patterns: only the latest tag of the repository matters. Tags are compared
+    as versions, so a late webhook of an older tag never cancels the build of
+    a newer one. The later request of the same tag replaces the earlier one.
+
+    The older requests still waiting in the spool are dropped here. The
+    workers get the notice through the fanout exchange, answer the queued
+    older builds with a short "superseded" result and cancel the running ones. """
+
+    def __init__(self, client, patterns, spool, deliveries):
+        self.client = client
+        self.patterns = [p.lower() for p in patterns]
+        self.spool = spool
+        self.deliveries = deliveries
+        self.counters = {
+            "notices": 0,
+            "dropped": 0,
+        }
+
+        client.channel.exchange_declare(channels.SUPERSEDE_EXCHANGE, exchange_type="fanout")
+
+    def applies(self, name):
+        name = name.lower()
+        return any(fnmatch(name, pattern) for pattern in self.patterns)
+
+    @staticmethod
+    def order(data):
+        return version_key(data.get('tag')), data.get('accepted', 0)
+
+    def on_build(self, data):
+        """ Stamps the accepted build request, so the workers can tell the older builds. """
+        if not self.patterns or not self.applies(data['name']):
+            return
+
+        name = data['name'].lower()
+        data['accepted'] = time()
+        order = self.order(data)
+
+        dropped = self.spool.discard(
+            lambda item: item.get('name', '').lower() == name and self.order(item) < order
+        )
+        for item in dropped:
+            log.info('Build of "%s" tag "%s" is superseded by tag "%s" in the spool', name, item['tag'], data['tag'])
+            self.deliveries.on_status(dict(item, status=self.deliveries.FINISHED, success=False))
+
+        self.counters['dropped'] += len(dropped)
+        self.counters['notices'] += 1
+
+        self.client.channel.basic_publish(
+            exchange=channels.SUPERSEDE_EXCHANGE,
+            routing_key='',
+            body=json.dumps({
+                "name": name,
+                "tag": data['tag'],
+                "commit": data['commit'],
+                "accepted": data['accepted'],
+            }),
+            properties=pika.BasicProperties(content_type="application/json")
+        )
+
+    def stats(self):
+        result = dict(self.counters)
+        result['patterns'] = self.patterns
+        return result
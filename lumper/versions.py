@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import re
+
+NUMBERS_EXPR = re.compile(r"(\d+)")
+RELEASE_EXPR = re.compile(r"^(\d+(?:\.\d+)*)(.*)$")
+
+
+def _natural(text):
+    parts = NUMBERS_EXPR.split(text)
+    # Text parts are at the even positions and numbers at the odd ones
+    return tuple(int(part) if i % 2 else part for i, part in enumerate(parts))
+
+
+def version_key(tag):
+    """ Sort key of the tag as a version: the numbers are compared as numbers,
+    so "v1.10.0" goes after "v1.9.2". The leading "v" is ignored. A text after
+    the release numbers marks a pre-release like in semver, so "v1.4.0-rc1"
+    goes before "v1.4.0". Tags without the release numbers go first. """
+    tag = (tag or "").lower().lstrip("v")
+
+    match = RELEASE_EXPR.match(tag)
+    if match is None:
+        return (), 0, _natural(tag)
+
+    release, suffix = match.groups()
+    suffix = suffix.lstrip("-._+")
+    return tuple(int(i) for i in release.split(".")), 0 if suffix else 1, _natural(suffix)
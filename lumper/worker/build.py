@@ -4,72 +4,232 @@
 import logging
 import json
 import os
-import shutil
 import traceback
 import git
 import re
 import requests
 
+from collections import OrderedDict
+from contextlib import contextmanager
 from crew.worker import context, HandlerClass
-from uuid import uuid4
-from tempfile import gettempdir
+from .build_log import BuildLog
+from .pubsub import publish
+from .. import channels
+from ..codec import pack
+from time import time
 
 log = logging.getLogger("builder")
 
 
-class TemporaryFolder(object):
-
-    def __init__(self):
-        self._dir = os.path.join(gettempdir(), str(uuid4()))
-        self._curdir = os.path.abspath(os.getcwd())
-
-    def __enter__(self):
-        assert not os.path.exists(self._dir)
-
-        log.debug('Making directory: "%s"', self._dir)
-        os.makedirs(self._dir)
-
-        log.debug('Changing directory: "%s"', self._dir)
-        os.chdir(self._dir)
-        return self._dir
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        log.debug('Changing directory: "%s"', self._curdir)
-        os.chdir(self._curdir)
-
-        if os.path.exists(self._dir):
-            log.debug('Deleting directory: "%s"', self._dir)
-            shutil.rmtree(self._dir)
-
-
 class BuildHandler(HandlerClass):
     STREAM_EXPR = {
         "build_success": re.compile("^Successfully built\s+(?P<id>\S+)\n?$")
     }
 
+    superseded = None
+
+    @property
+    def cancelled(self):
+        return bool(self.superseded)
+
     def process(self):
+        supersession = context.settings.supersession
+        self.superseded = supersession.superseded(self.data)
+        if self.superseded:
+            # A newer tag of the repository arrived while the build was queued
+            return self.supersede_result()
+
+        options = context.settings.options
+        self.build_log = BuildLog(
+            path=options.build_log_dir,
+            head=options.build_log_head,
+            tail=options.build_log_tail,
+            meta=self.meta
+        )
+
+        self.timings = OrderedDict()
+        self.send_status("started")
+
+        context.settings.state.started()
+        supersession.started(self)
+        start = time()
         try:
-            self.git = git.Git()
             self.docker = context.settings.docker
+            self.workspace = None
 
-            with TemporaryFolder() as path:
-                self.prepare(path)
-                try:
-                    self.data.update({"id": self.build(path)})
-                except Exception as e:
-                    self.data.update({'error': e})
+            context.settings.pipeline.run(self)
 
-                self.data.update({'build_log': self.build_log})
-
-            if self.data.get('status') and context.settings.options.docker_publish:
-                self.push()
+            self.data.update(self.finish_log())
+            if self.superseded:
+                return self.supersede_result()
 
+            self.data['timings'] = self.finish_timings(start, bool(self.data.get('status')))
+            self.send_status("finished", success=bool(self.data.get('status')), timings=self.data['timings'])
+            self.data['build_log'] = self.pack_log(self.data['build_log'])
+            self.send_result(start, self.data['build_log'], self.data.get('error'))
             return self.data
         except Exception as e:
             exc = Exception(repr(e))
-            exc._tb = traceback.format_exc(e)
-            exc.log = getattr(self, 'build_log', [])
+            exc._tb = getattr(e, '_tb', None) or traceback.format_exc(e)
+            exc.log = self.pack_log(self.finish_log()['build_log'])
+            exc.timings = self.finish_timings(start, False)
+            self.send_status("finished", success=False, timings=exc.timings)
+            self.send_result(start, exc.log, e)
             return exc
+        finally:
+            supersession.finished(self)
+            # The image layers stay in the docker cache even when the push fails
+            context.settings.state.finished(self.data['name'] if self.data.get('id') else None)
+
+    def supersede(self, tag):
+        """ Cancels the build between the stages and stops reading the docker build stream. """
+        if not self.superseded:
+            log.warning('Cancelling build of "%s" tag "%s": superseded by tag "%s"',
+                        self.data['name'], self.data['tag'], tag)
+            self.superseded = tag
+
+    def supersede_result(self):
+        """ The short result of the superseded build. The mailer doesn't report it. """
+        log.info('Build of "%s" tag "%s" is superseded by tag "%s"', self.data['name'], self.data['tag'], self.superseded)
+        self.send_status("finished", success=False, superseded=self.superseded)
+        self.data.update({"status": False, "superseded": self.superseded})
+        return self.data
+
+    @contextmanager
+    def timed(self, step):
+        """ Adds the duration of the step to the timings of the build and to the worker metrics. """
+        start = time()
+        try:
+            yield
+        finally:
+            elapsed = time() - start
+            self.timings[step] = self.timings.get(step, 0) + elapsed
+            context.settings.metrics.observe("build_step_seconds", elapsed, step=step, repo=self.data.get('name'))
+
+    def finish_timings(self, start, success):
+        self.timings['total'] = time() - start
+        metrics = context.settings.metrics
+        metrics.observe("build_seconds", self.timings['total'], repo=self.data.get('name'))
+        metrics.inc("builds_total", repo=self.data.get('name'), status="success" if success else "failure")
+        return dict(self.timings)
+
+    @staticmethod
+    def directory_size(path):
+        size = 0
+        for root, dirs, files in os.walk(path):
+            for name in files:
+                fname = os.path.join(root, name)
+                if not os.path.islink(fname):
+                    size += os.path.getsize(fname)
+        return size
+
+    def stage_prepare(self):
+        image_id = self.lookup_image()
+        self.data['cache_hit'] = image_id is not None
+        if image_id is not None:
+            return self.reuse_image(image_id)
+
+        self.workspace = context.settings.workspaces.acquire(self.data['repo'])
+        context.settings.metrics.inc("workspaces_total", result="reused" if self.workspace.reused else "new")
+        self.prepare(self.workspace)
+        self.workspace.ready = True
+
+    def stage_build(self):
+        if self.data.get('cache_hit'):
+            return
+
+        try:
+            self.data.update({"id": self.build(self.workspace.path)})
+            if self.data.get('status') and context.settings.images is not None:
+                images = context.settings.images
+                images.put(images.key(self.data['commit']), self.data['id'])
+        except Exception as e:
+            self.data.update({'error': e})
+        finally:
+            self.cleanup()
+
+    def lookup_image(self):
+        images = context.settings.images
+        if images is None:
+            return None
+
+        key = images.key(self.data['commit'])
+        image_id = images.get(key)
+        result = "miss"
+
+        if image_id is not None:
+            try:
+                self.docker.inspect_image(image_id)
+                result = "hit"
+            except Exception as e:
+                log.info('Image %s of commit "%s" is gone: %r', image_id, self.data['commit'], e)
+                images.discard(key)
+                image_id = None
+
+        context.settings.metrics.inc("image_cache_total", repo=self.data.get('name'), result=result)
+        return image_id
+
+    def reuse_image(self, image_id):
+        """ Tags the image built from the same commit instead of cloning and building. """
+        with self.timed("retag"):
+            self.docker.tag(image_id, self.data['name'].lower(), self.data['tag'].lstrip("v").lower(), force=True)
+
+        log.info('Commit "%s" was already built as %s, skipping the build', self.data['commit'], image_id)
+        self.build_log.append("Reusing image %s built from commit %s" % (image_id, self.data['commit']))
+        self.data.update({"id": image_id, "status": True})
+
+    def stage_push(self):
+        if self.data.get('status') and context.settings.options.docker_publish:
+            with context.settings.network_slots, self.timed("push"):
+                self.push()
+
+    def cleanup(self):
+        if self.workspace is not None:
+            context.settings.workspaces.release(self.workspace)
+            self.workspace = None
+
+    @property
+    def meta(self):
+        return {
+            "name": self.data.get('name'),
+            "tag": self.data.get('tag'),
+            "commit": self.data.get('commit'),
+        }
+
+    def send_status(self, status, **kwargs):
+        kwargs.update(self.meta, status=status, node=context.settings.uuid)
+        publish(channels.BUILD_STATUS, kwargs)
+
+    def send_result(self, started, build_log, error=None):
+        """ The result for the build history of the server with the log packed by pack_log(). """
+        result = dict(
+            self.meta,
+            node=context.settings.uuid,
+            success=bool(self.data.get('status')) and error is None,
+            image=self.data.get('id'),
+            cache_hit=bool(self.data.get('cache_hit')),
+            repo=self.data.get('repo'),
+            sender=self.data.get('sender'),
+            timestamp=self.data.get('timestamp'),
+            started=started,
+            finished=time(),
+            timings=self.timings,
+            error=repr(error) if error is not None else None,
+            log=build_log,
+        )
+        publish(channels.BUILD_RESULT, result)
+
+    @staticmethod
+    def pack_log(lines):
+        """ The log packed by --result-codec, the consumers unpack it with lumper.codec.unpack. """
+        return pack(lines, context.settings.options.result_codec)
+
+    def finish_log(self):
+        self.build_log.close()
+        return {
+            'build_log': self.build_log.summary(),
+            'build_log_ref': self.build_log.reference(),
+        }
 
     def push(self):
         registry = context.settings.options.docker_registry
@@ -119,122 +279,141 @@ class BuildHandler(HandlerClass):
         if registry:
             url = "%s://%s" % ('https' if use_ssl else 'http', registry)
             try:
-                log.debug("Trying to fetch image id")
-                img_id = filter(lambda x: str(x[0]) == str(tag), requests.get("%s/v1/repositories/%s/tags" % (url, name)).json().items())[0][1]
-                log.info('Pushing successful as %s', img_id)
-                log.debug("Deleting tag: latest")
-                resp = requests.delete("%s/v1/repositories/%s/tags/latest" % (url, name))
-                log.debug('%s', resp.json())
-
-                log.debug("Setting latest tag as %s", img_id)
-                resp = requests.put(
-                    "%s/v1/repositories/%s/tags/latest" % (url, name),
-                    '"%s"' % img_id,
-                    headers={'Content-Type': 'application/json'}
-                )
-                log.debug('%s', resp.json())
+                with self.timed("registry_tag"):
+                    log.debug("Trying to fetch image id")
+                    img_id = filter(lambda x: str(x[0]) == str(tag), requests.get("%s/v1/repositories/%s/tags" % (url, name)).json().items())[0][1]
+                    log.info('Pushing successful as %s', img_id)
+                    log.debug("Deleting tag: latest")
+                    resp = requests.delete("%s/v1/repositories/%s/tags/latest" % (url, name))
+                    log.debug('%s', resp.json())
+
+                    log.debug("Setting latest tag as %s", img_id)
+                    resp = requests.put(
+                        "%s/v1/repositories/%s/tags/latest" % (url, name),
+                        '"%s"' % img_id,
+                        headers={'Content-Type': 'application/json'}
+                    )
+                    log.debug('%s', resp.json())
             except Exception:
                 self.build_log.append("ERROR: Can't fetch image id from registry \"%s\"" % url)
 
-    def prepare(self, path):
+    def prepare(self, workspace):
         url = self.data['repo']
-        log.info('Cloning repo "%s" => "%s"', url, path)
-        res = self.git.clone(url, path)
-        log.debug("Cloning result: %s", res)
+        path = workspace.path
+
+        objects = os.path.join(path, ".git", "objects")
+        # Objects of the reused working copy, only the fetched ones are counted
+        before = self.directory_size(objects) if workspace.reused else 0
+
+        with context.settings.network_slots:
+            with self.timed("clone"):
+                if workspace.reused:
+                    try:
+                        res = self.fetch(path, url)
+                    except git.GitCommandError as e:
+                        log.warning('Can\'t update workspace "%s": %s', path, e)
+                        workspace.reset()
+
+                if not workspace.reused:
+                    before = 0
+                    res = self.clone(path, url)
 
-        commit_hash = self.data['commit']
-        log.info('Checkout commit "%s"', commit_hash)
-        self.git.checkout(commit_hash)
-        self.git.submodule("update", "--recursive", "--init")
+            log.debug("Cloning result: %s", res)
 
-        log.info('Updating submodules')
-        for sm in git.Repo(path).submodules:
-            log.info(' Updating submodule: "%s"', sm)
-            sm.update(recursive=True, init=True)
-            log.info(' Submodule "%s" updated', sm)
+            commit_hash = self.data['commit']
+            log.info('Checkout commit "%s"', commit_hash)
+            with self.timed("checkout"):
+                self.git.checkout("--force", commit_hash)
+                if workspace.reused:
+                    # Untracked files and the removed submodules of the previous build
+                    self.git.clean("-ffdxq")
 
-        self.restore_commit_times(path)
+            with self.timed("submodules"):
+                context.settings.submodules.update(path)
+
+        # The automatic gc of git may pack the loose objects into the smaller pack
+        context.settings.metrics.inc("git_bytes_total", max(self.directory_size(objects) - before, 0),
+                                     repo=self.data.get('name'))
+
+        with self.timed("commit_times"):
+            self.restore_commit_times(path)
 
         log.info("Preparing complete")
 
-    @staticmethod
-    def restore_commit_times(path):
+    def clone(self, path, url):
+        mirrors = context.settings.mirrors
 
-        log.info("Restoring file mtimes for path: %s", path)
-
-        def walk(tree):
-            ret = list()
-            for i in tree:
-                ret.append(i)
-                if i.type == 'tree':
-                    ret.extend(walk(i))
-            return ret
-
-        repo = git.Repo(path)
-
-        def find_mtimes(repo):
-            objects = walk(repo.tree())
-            t = repo.head.commit
-            tt = t.traverse()
-            ret = {}
-            while objects:
-                hashes = set(i.binsha for i in walk(t.tree))
-                # iterate over reversed list to be able to remove elements by index
-                for n, i in reversed(list(enumerate(objects))):
-                    if i.binsha not in hashes:
-                        del objects[n]
-                    else:
-                        if i.path not in ret or t.authored_date < ret[i.path]:
-                            ret[i.path] = t.authored_date
-                try:
-                    t = next(tt)
-                except StopIteration:
-                    break
-            return ret
-
-        for i, mtime in find_mtimes(repo).items():
-            fname = os.path.join(path, i)
-            log.debug("%s %s", mtime, fname)
-            os.utime(fname.encode('utf-8'), (mtime, mtime))
-
-        for sm in repo.submodules:
-            sm_internal_path = os.path.join(repo.git_dir, 'modules', sm.name)
-            if os.path.exists(sm_internal_path):
-                sm_repo = git.Repo(sm_internal_path)
-            else:
-                sm_repo = git.Repo(sm.path)
+        if mirrors:
+            with mirrors.mirror(url) as mirror:
+                log.info('Cloning repo "%s" from mirror "%s" => "%s"', url, mirror, path)
+                res = git.Git().clone(mirror, path)
+
+            # Relative submodule urls must be resolved against the real remote
+            self.git = git.Git(path)
+            self.git.remote("set-url", "origin", url)
+        else:
+            log.info('Cloning repo "%s" => "%s"', url, path)
+            res = git.Git().clone(url, path)
+            self.git = git.Git(path)
 
-            for i, mtime in find_mtimes(sm_repo).items():
-                fname = os.path.join(path, sm.path, i)
-                log.debug(u"%s %s", mtime, fname)
-                os.utime(fname.encode('utf-8'), (mtime, mtime))
+        return res
+
+    def fetch(self, path, url):
+        """ Updates the working copy of the previous build of the repo. """
+        mirrors = context.settings.mirrors
+        self.git = git.Git(path)
+        refspec = "+refs/heads/*:refs/remotes/origin/*"
+
+        if mirrors:
+            with mirrors.mirror(url) as mirror:
+                log.info('Fetching repo "%s" from mirror "%s" => "%s"', url, mirror, path)
+                return self.git.fetch("--quiet", "--tags", mirror, refspec)
+
+        log.info('Fetching repo "%s" => "%s"', url, path)
+        return self.git.fetch("--quiet", "--tags", "origin", refspec)
+
+    @staticmethod
+    def restore_commit_times(path):
+        context.settings.mtimes.restore(path)
 
     def build(self, path):
         log.debug("Start building...")
         tag = ("%s:%s" % (self.data['name'], self.data['tag'].lstrip("v"))).lower()
         log.debug("Selecting tag: %s", tag)
 
-        self.build_log = []
         log.debug('Building')
         try:
-            for line in self.docker.build(path, rm=True, tag=tag):
-                chunk = json.loads(line)
-                stream = chunk.get("stream", "").rstrip("\n\r")
-                if stream:
-                    success = self.STREAM_EXPR['build_success'].match(stream)
-                    self.build_log.append(stream)
-                    if success:
-                        self.data['status'] = True
-                        return success.groupdict()['id']
-                    else:
-                        log.info(stream)
-
-                elif chunk.get("error"):
-                    err = chunk['error'].strip("\n\r")
-                    log.error(err)
-                    self.build_log.append(err)
-                    log.error(chunk.get('error'))
-                    raise StandardError(chunk['error'])
+            with self.timed("context"):
+                fileobj = context.settings.contexts.open(path, self.data['commit'])
+
+            with fileobj, self.timed("docker_build"):
+                context.settings.metrics.inc("docker_context_bytes_total", os.fstat(fileobj.fileno()).st_size,
+                                             repo=self.data.get('name'))
+
+                stream = self.docker.build(fileobj=fileobj, custom_context=True, rm=True, tag=tag)
+                for line in stream:
+                    if self.cancelled:
+                        stream.close()
+                        self.build_log.append("Build is superseded by tag %s" % self.superseded)
+                        return None
+
+                    chunk = json.loads(line)
+                    text = chunk.get("stream", "").rstrip("\n\r")
+                    if text:
+                        success = self.STREAM_EXPR['build_success'].match(text)
+                        self.build_log.append(text)
+                        if success:
+                            self.data['status'] = True
+                            return success.groupdict()['id']
+                        else:
+                            log.info(text)
+
+                    elif chunk.get("error"):
+                        err = chunk['error'].strip("\n\r")
+                        log.error(err)
+                        self.build_log.append(err)
+                        log.error(chunk.get('error'))
+                        raise StandardError(chunk['error'])
         except Exception as e:
             log.exception(e)
 
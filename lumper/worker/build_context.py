@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import hashlib
+import logging
+import os
+import re
+import tarfile
+
+from tempfile import TemporaryFile
+from uuid import uuid4
+
+log = logging.getLogger("builder.context")
+
+
+class DockerIgnore(object):
+    """ .dockerignore rules: a pattern excludes the matched path and everything
+    under it, "**" matches any number of directories, "!" re-includes paths. """
+
+    DEFAULT = (".git", "**/.git")
+    ALWAYS_INCLUDE = ("Dockerfile", ".dockerignore")
+
+    def __init__(self, patterns=()):
+        self.rules = [self.compile(p) for p in patterns]
+        self.has_exceptions = any(negate for negate, _ in self.rules)
+
+    @classmethod
+    def load(cls, path):
+        patterns = list(cls.DEFAULT)
+        fname = os.path.join(path, ".dockerignore")
+        if os.path.exists(fname):
+            with open(fname) as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith("#"):
+                        patterns.append(line)
+        return cls(patterns)
+
+    @staticmethod
+    def _segment(segment):
+        regex, i = "", 0
+        while i < len(segment):
+            c = segment[i]
+            if c == "*":
+                regex += "[^/]*"
+            elif c == "?":
+                regex += "[^/]"
+            elif c == "[":
+                end = segment.find("]", i + 1)
+                if end < 0:
+                    regex += re.escape(c)
+                else:
+                    regex += segment[i:end + 1]
+                    i = end
+            elif c == "\\" and i + 1 < len(segment):
+                i += 1
+                regex += re.escape(segment[i])
+            else:
+                regex += re.escape(c)
+            i += 1
+        return regex
+
+    @classmethod
+    def compile(cls, pattern):
+        negate = pattern.startswith("!")
+        pattern = os.path.normpath(pattern.lstrip("!").strip()).lstrip("/")
+
+        segments = pattern.split("/")
+        if segments[-1] == "**":
+            segments[-1] = "*"
+
+        regex = "".join(
+            "(?:[^/]+/)*" if segment == "**" else cls._segment(segment) + "/" for segment in segments
+        )[:-1]
+
+        return negate, re.compile("^%s(?:/.*)?$" % regex)
+
+    def excluded(self, name):
+        if name in self.ALWAYS_INCLUDE:
+            return False
+
+        result = False
+        for negate, regex in self.rules:
+            if regex.match(name):
+                result = not negate
+        return result
+
+    def files(self, path):
+        for root, dirs, files in os.walk(path):
+            rel_root = os.path.relpath(root, path)
+            rel_root = "" if rel_root == "." else rel_root
+
+            for name in sorted(dirs):
+                rel = os.path.join(rel_root, name)
+                if self.excluded(rel):
+                    # Exception rules may include something inside the directory
+                    if not self.has_exceptions:
+                        dirs.remove(name)
+                    continue
+                yield rel
+
+            dirs.sort()
+
+            for name in sorted(files):
+                rel = os.path.join(rel_root, name)
+                if not self.excluded(rel):
+                    yield rel
+
+
+def write_context(path, fileobj):
+    """ Writes the build context of the path into the fileobj as tar stream
+    file by file. Nothing is buffered in memory. """
+    ignore = DockerIgnore.load(path)
+    tar = tarfile.open(fileobj=fileobj, mode="w")
+    try:
+        for rel in ignore.files(path):
+            tar.add(os.path.join(path, rel), arcname=rel, recursive=False)
+    finally:
+        tar.close()
+
+
+class ContextCache(object):
+    """ Build context tarballs keyed by the commit and the Dockerfile. Without
+    the cache directory the context is written to an anonymous temporary file. """
+
+    def __init__(self, path=None, max_size=0):
+        self.path = os.path.abspath(path) if path else None
+        self.max_size = max_size
+
+        if self.path and not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    @staticmethod
+    def key(path, commit, dockerfile="Dockerfile"):
+        digest = hashlib.sha1(commit.encode("utf-8"))
+        fname = os.path.join(path, dockerfile)
+        if os.path.exists(fname):
+            with open(fname, "rb") as f:
+                digest.update(f.read())
+        return digest.hexdigest()
+
+    def open(self, path, commit):
+        if not self.path:
+            fileobj = TemporaryFile()
+            write_context(path, fileobj)
+            fileobj.seek(0)
+            return fileobj
+
+        fname = os.path.join(self.path, "%s.tar" % self.key(path, commit))
+
+        if os.path.exists(fname):
+            log.info('Using cached build context "%s"', fname)
+            os.utime(fname, None)
+            return open(fname, "rb")
+
+        tmp_name = "%s.%s.tmp" % (fname, uuid4().hex)
+        try:
+            with open(tmp_name, "wb") as f:
+                write_context(path, f)
+            os.rename(tmp_name, fname)
+        finally:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+
+        # Opened file survives the eviction
+        fileobj = open(fname, "rb")
+        self.evict()
+        return fileobj
+
+    def evict(self):
+        items = []
+        for name in os.listdir(self.path):
+            fname = os.path.join(self.path, name)
+            if name.endswith(".tar"):
+                try:
+                    st = os.stat(fname)
+                    items.append((st.st_mtime, fname, st.st_size))
+                except OSError:
+                    pass
+
+        total = sum(size for _, _, size in items)
+        for mtime, fname, size in sorted(items):
+            if total <= self.max_size:
+                break
+
+            log.debug('Evicting build context "%s"', fname)
+            try:
+                os.remove(fname)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import logging
+import os
+import time
+
+from collections import deque
+from crew.worker import context
+from tempfile import NamedTemporaryFile
+from uuid import uuid4
+from .pubsub import publish
+from .. import channels
+
+log = logging.getLogger("builder.log")
+
+
+class BuildLog(object):
+    """ Bounded build log.
+
+    Only the first `head` and the last `tail` lines are kept in memory. Every
+    line is spilled to a file and published by chunks on the CHANNEL while the
+    build runs, so the full log never has to travel in the build result. """
+
+    CHANNEL = channels.BUILD_LOG
+    TTL = 3 * 86400
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, path=None, head=200, tail=1000, chunk_size=100, meta=None):
+        self.id = uuid4().hex
+        self.meta = meta or {}
+        self.lines = 0
+        self.seq = 0
+        self.chunk_size = chunk_size
+        self.head = list()
+        self.head_size = head
+        self.tail = deque(maxlen=tail)
+        self.keep = path is not None
+        self._buffer = list()
+        self._flushed = time.time()
+
+        if self.keep:
+            if not os.path.exists(path):
+                os.makedirs(path)
+            self.cleanup(path)
+            self._file = open(os.path.join(path, "%s.log" % self.id), "w+")
+        else:
+            self._file = NamedTemporaryFile(prefix="lumper-", suffix=".log")
+
+    def __len__(self):
+        return self.lines
+
+    def append(self, line):
+        line = line if line is not None else u''
+        self.lines += 1
+        if len(self.head) < self.head_size:
+            self.head.append(line)
+        else:
+            self.tail.append(line)
+
+        self._buffer.append(line)
+        if len(self._buffer) >= self.chunk_size or time.time() - self._flushed > self.FLUSH_INTERVAL:
+            self.flush()
+
+    def extend(self, lines):
+        for line in lines:
+            self.append(line)
+
+    def flush(self, finished=False):
+        lines, self._buffer = self._buffer, list()
+        self._flushed = time.time()
+
+        if lines:
+            for line in lines:
+                self._file.write(line.encode('utf-8') if isinstance(line, unicode) else line)
+                self._file.write("\n")
+            self._file.flush()
+
+        if lines or finished:
+            self.publish(lines, finished)
+
+    def publish(self, lines, finished=False):
+        publish(self.CHANNEL, dict(self.meta, id=self.id, seq=self.seq, lines=lines, finished=finished))
+        self.seq += 1
+
+    def summary(self):
+        skipped = self.lines - len(self.head) - len(self.tail)
+        if skipped > 0:
+            return self.head + ["", "... %d lines skipped ..." % skipped, ""] + list(self.tail)
+        return self.head + list(self.tail)
+
+    def reference(self):
+        return {
+            "id": self.id,
+            "channel": self.CHANNEL,
+            "lines": self.lines,
+            "chunks": self.seq,
+            "node": getattr(context.settings, 'uuid', None),
+            "path": self._file.name if self.keep else None,
+        }
+
+    def close(self):
+        if not self._file.closed:
+            self.flush(finished=True)
+            self._file.close()
+
+    @classmethod
+    def cleanup(cls, path):
+        edge = time.time() - cls.TTL
+        for name in os.listdir(path):
+            fname = os.path.join(path, name)
+            try:
+                if name.endswith(".log") and os.stat(fname).st_mtime < edge:
+                    log.debug('Deleting old build log "%s"', fname)
+                    os.remove(fname)
+            except OSError:
+                pass
@@ -1,10 +1,22 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import logging
 from crew.worker import context, Task
-from time import time
+from time import time, sleep
+from .. import channels
+
+log = logging.getLogger("builder.heartbeat")
+
 
 @Task("heartbeat")
 def heartbeat(data):
     context.settings.heartbeat_counter += 1
-    return context.settings.uuid, time(), context.settings.heartbeat_counter
\ No newline at end of file
+    return context.settings.uuid, time(), context.settings.heartbeat_counter, context.settings.state.status()
+
+
+def advertise(settings, interval):
+    """ Publishes the state of the node for the build routing of the server. """
+    while True:
+        settings.publisher.publish(channels.WORKER_STATUS, settings.state.status())
+        sleep(interval)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import hashlib
+import logging
+import os
+
+from uuid import uuid4
+
+log = logging.getLogger("builder.images")
+
+
+class ImageIndex(object):
+    """ Images built by the docker daemon of this worker keyed by the content
+    of the build. The commit defines the whole tree including the Dockerfile,
+    so the same commit tagged again gives the same image. Only max_entries
+    recently used images are remembered. """
+
+    VERSION = 1
+
+    def __init__(self, path, max_entries=0):
+        self.path = os.path.abspath(path)
+        self.max_entries = max_entries
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    @classmethod
+    def key(cls, commit):
+        return hashlib.sha1(("%d:%s" % (cls.VERSION, commit)).encode("utf-8")).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key)
+
+    def get(self, key):
+        try:
+            fname = self._file(key)
+            with open(fname) as f:
+                image_id = f.read().strip() or None
+            os.utime(fname, None)
+            return image_id
+        except (IOError, OSError):
+            return None
+
+    def put(self, key, image_id):
+        fname = self._file(key)
+        tmp_name = "%s.%s.tmp" % (fname, uuid4().hex)
+        with open(tmp_name, "w") as f:
+            f.write(image_id)
+        os.rename(tmp_name, fname)
+        self.evict()
+
+    def discard(self, key):
+        try:
+            os.remove(self._file(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        if not self.max_entries:
+            return
+
+        items = []
+        for name in os.listdir(self.path):
+            if name.endswith(".tmp"):
+                continue
+            try:
+                items.append((os.stat(self._file(name)).st_mtime, name))
+            except OSError:
+                pass
+
+        # Least recently used first
+        items.sort()
+        for mtime, name in items[:max(len(items) - self.max_entries, 0)]:
+            log.debug('Evicting image of "%s"', name)
+            self.discard(name)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import logging
+import pika
+import time
+
+from crew.worker import Listener
+
+log = logging.getLogger("builder.listener")
+
+
+class BuildListener(Listener):
+    """ crew's Listener keeps the headers of the current request in the global
+    context, which is shared by all listener threads of the worker. This one
+    keeps them per listener and answers with the headers of its own request.
+
+    The listener consumes the shared queue and the queue of the node on one
+    channel. crew's prefetch limit is per consumer, so the channel would take
+    a build from each queue. The limit of the whole channel keeps one build
+    per listener. """
+
+    headers = None
+
+    def __init__(self, *args, **kwargs):
+        super(BuildListener, self).__init__(*args, **kwargs)
+        self.channel.basic_qos(prefetch_count=1, all_channels=True)
+
+    def set_env(self, props, method):
+        super(BuildListener, self).set_env(props, method)
+        self.headers = getattr(props, 'headers', None) or {}
+
+    def reset_env(self):
+        super(BuildListener, self).reset_env()
+        self.headers = {}
+
+    def reply(self, data):
+        if self.cid is None:
+            log.info("Correlation id not presented, skip answering.")
+            return
+
+        body = self.serializer(data)
+        self.channel.basic_publish(
+            exchange='',
+            routing_key=str(self.dst),
+            properties=pika.BasicProperties(
+                correlation_id=self.cid,
+                content_type=self.content_type,
+                headers=self.headers,
+                content_encoding=self.content_encoding,
+                timestamp=time.time(),
+                expiration=str(self.expiration * 1000)
+            ),
+            body=body
+        )
+        log.info('Handle "%s" for %06f sec. Length of response: %s',
+                 self.w_name, time.time() - self.start, len(body) if body else str(body))
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import shutil
+import git
+
+from contextlib import contextmanager
+from uuid import uuid4
+
+log = logging.getLogger("builder.mirror")
+
+
+class FileLock(object):
+    """ flock(2) based lock. Every instance opens its own file description,
+    so it works between threads of one process as well as between processes. """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self, shared=False, blocking=True):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+
+        try:
+            fcntl.flock(self._fd, flags)
+            return True
+        except IOError:
+            if blocking:
+                raise
+            return False
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+class MirrorStore(object):
+    """ Bare mirrors of the remote repositories keyed by repo url.
+
+    The mirror is updated with an incremental fetch under an exclusive lock
+    and then cloned locally under a shared lock. Local clones hardlink objects,
+    so the workspace does not depend on the mirror after cloning and an evicted
+    mirror never breaks a running build. """
+
+    SLUG_EXPR = re.compile("[^\w.-]+")
+
+    def __init__(self, path, max_size):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def key(self, url):
+        slug = self.SLUG_EXPR.sub("_", url).strip("_")[-64:]
+        return "%s-%s" % (slug, hashlib.sha1(url.encode('utf-8')).hexdigest()[:12])
+
+    def mirror_path(self, url):
+        return os.path.join(self.path, "%s.git" % self.key(url))
+
+    @contextmanager
+    def mirror(self, url):
+        path = self.mirror_path(url)
+        lock = FileLock("%s.lock" % path)
+
+        lock.acquire()
+        try:
+            self.update(url, path)
+            os.utime(path, None)
+
+            # Downgrade the lock: a concurrent build of the same repo
+            # may clone from the mirror, but nobody may fetch or evict it.
+            lock.acquire(shared=True)
+            yield path
+        finally:
+            lock.release()
+
+        self.evict(keep=path)
+
+    def update(self, url, path):
+        if os.path.exists(path):
+            log.info('Fetching mirror "%s" => "%s"', url, path)
+            try:
+                git.Git(path).fetch("--prune", "--quiet", "origin")
+                return
+            except git.GitCommandError as e:
+                log.error('Mirror "%s" is broken. Recreating: %s', path, e)
+                shutil.rmtree(path)
+
+        log.info('Creating mirror "%s" => "%s"', url, path)
+        tmp_path = "%s.%s.tmp" % (path, uuid4().hex)
+        try:
+            git.Git().clone("--mirror", "--quiet", url, tmp_path)
+            os.rename(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                shutil.rmtree(tmp_path)
+
+    @staticmethod
+    def size(path):
+        total = 0
+        for root, dirs, files in os.walk(path):
+            for f in files:
+                try:
+                    total += os.lstat(os.path.join(root, f)).st_size
+                except OSError:
+                    pass
+        return total
+
+    def mirrors(self):
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if name.endswith(".git") and os.path.isdir(path):
+                yield path
+
+    def evict(self, keep=None):
+        mirrors = [(os.stat(path).st_mtime, path, self.size(path)) for path in self.mirrors()]
+        total = sum(size for _, _, size in mirrors)
+
+        # Least recently used first
+        for atime, path, size in sorted(mirrors):
+            if total <= self.max_size:
+                break
+
+            if path == keep:
+                continue
+
+            lock = FileLock("%s.lock" % path)
+            if not lock.acquire(blocking=False):
+                log.debug('Mirror "%s" is busy. Skipping eviction.', path)
+                continue
+
+            try:
+                log.info('Evicting mirror "%s" (%d bytes)', path, size)
+                shutil.rmtree(path)
+                total -= size
+            finally:
+                lock.release()
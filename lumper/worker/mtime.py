@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import logging
+import os
+import subprocess
+import threading
+import git
+
+from collections import OrderedDict
+
+log = logging.getLogger("builder.mtime")
+
+
+class CommitTimes(object):
+    """ Restores the mtime of the every file in the checkout to the author time
+    of the last commit which changed it.
+
+    History is read in a single pass of "git log --name-only" and the reading
+    stops as soon as every path of the tree is resolved. Results are cached
+    by commit hash. """
+
+    CHUNK_SIZE = 65536
+
+    def __init__(self, cache_size=32):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def restore(self, path):
+        log.info("Restoring file mtimes for path: %s", path)
+        repo = git.Repo(path)
+
+        for name, mtime in self.get(path, repo.head.commit.hexsha).items():
+            fname = os.path.join(path, name)
+            log.debug("%s %s", mtime, fname)
+            try:
+                os.utime(fname, (mtime, mtime))
+            except OSError as e:
+                log.debug("Can't set mtime for %s: %s", fname, e)
+
+        for sm in repo.submodules:
+            sm_path = os.path.join(path, sm.path)
+            if os.path.exists(os.path.join(sm_path, '.git')):
+                self.restore(sm_path)
+
+    def get(self, path, commit):
+        with self._lock:
+            if commit in self._cache:
+                log.debug("Using cached mtimes for %s", commit)
+                self._cache[commit] = self._cache.pop(commit)
+                return self._cache[commit]
+
+        mtimes = self.find(path, commit)
+
+        with self._lock:
+            self._cache[commit] = mtimes
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return mtimes
+
+    @staticmethod
+    def _git(path, *args):
+        return subprocess.Popen(("git",) + args, cwd=path, stdout=subprocess.PIPE)
+
+    @classmethod
+    def _tokens(cls, stream):
+        tail = b""
+        for chunk in iter(lambda: stream.read(cls.CHUNK_SIZE), b""):
+            items = (tail + chunk).split(b"\0")
+            tail = items.pop()
+            for item in items:
+                yield item
+
+        if tail:
+            yield tail
+
+    @classmethod
+    def find(cls, path, commit):
+        proc = cls._git(path, "ls-tree", "-r", "-z", "--name-only", "--full-tree", commit)
+        pending = set(i for i in cls._tokens(proc.stdout) if i)
+        proc.wait()
+
+        files = {}
+        dirs = {}
+
+        proc = cls._git(path, "log", "-z", "--format=%x01%at", "--name-only", "--no-renames", commit)
+        try:
+            timestamp = None
+            for item in cls._tokens(proc.stdout):
+                if not pending:
+                    break
+
+                # The first file name of the commit follows the header after a newline
+                if item.startswith(b"\n"):
+                    item = item[1:]
+
+                if item.startswith(b"\x01"):
+                    timestamp = int(item[1:])
+                elif item in pending:
+                    pending.discard(item)
+                    files[item] = timestamp
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+
+        # A directory has been changed by the last commit of any file in it
+        for name, mtime in files.items():
+            parent = os.path.dirname(name)
+            while parent and dirs.get(parent, 0) < mtime:
+                dirs[parent] = mtime
+                parent = os.path.dirname(parent)
+
+        files.update(dirs)
+        return files
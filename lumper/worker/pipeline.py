@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import logging
+import threading
+import traceback
+
+from Queue import Queue, Full
+
+log = logging.getLogger("builder.pipeline")
+
+
+class Job(object):
+    def __init__(self, handler):
+        self.handler = handler
+        self.error = None
+        self.cancelled = False
+        self._done = threading.Event()
+
+    @property
+    def stopped(self):
+        # The handler may be cancelled by itself, e.g. when its build is superseded
+        return self.cancelled or getattr(self.handler, 'cancelled', False)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def finish(self):
+        self._done.set()
+
+    def wait(self, timeout=1):
+        # Waiting with a timeout keeps the thread killable by crew on the task expiration
+        while not self._done.wait(timeout):
+            pass
+
+
+class Stage(object):
+    def __init__(self, name, func, workers=1, queue_size=1, finalizer=None):
+        self.name = name
+        self.func = func
+        self.next = None
+        self.finalizer = finalizer
+        self.queue = Queue(maxsize=queue_size)
+        self.threads = [
+            threading.Thread(target=self._loop, name="stage-%s-%d" % (name, i)) for i in range(workers)
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def put(self, job):
+        # Blocks when the stage is saturated: the previous stage stalls
+        # and the amount of prepared workspaces stays bounded.
+        self.queue.put(job)
+
+    def _loop(self):
+        while True:
+            job = self.queue.get()
+            try:
+                self._run(job)
+            except Exception as e:
+                log.exception(e)
+                job.finish()
+
+    def _run(self, job):
+        if not job.stopped and job.error is None:
+            log.debug('Running stage "%s" for %r', self.name, job.handler)
+            try:
+                self.func(job.handler)
+            except Exception as e:
+                e._tb = traceback.format_exc()
+                job.error = e
+
+        if self.next is not None and not job.stopped and job.error is None:
+            self.next.put(job)
+        else:
+            if self.finalizer is not None:
+                self.finalizer(job.handler)
+            job.finish()
+
+
+class Pipeline(object):
+    """ Chain of stages connected by bounded queues. Each stage has its own
+    workers, so the stages of the different jobs overlap. """
+
+    def __init__(self, queue_size=1, finalizer=None):
+        self.queue_size = queue_size
+        self.finalizer = finalizer
+        self.stages = list()
+
+    def add_stage(self, name, func, workers=1):
+        stage = Stage(name, func, workers=workers, queue_size=self.queue_size, finalizer=self.finalizer)
+        if self.stages:
+            self.stages[-1].next = stage
+        self.stages.append(stage)
+        return stage
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def run(self, handler):
+        job = Job(handler)
+        try:
+            while True:
+                try:
+                    self.stages[0].queue.put(job, timeout=1)
+                    break
+                except Full:
+                    continue
+
+            job.wait()
+        finally:
+            if not job.done:
+                log.warning("Cancelling job %r", handler)
+                job.cancelled = True
+
+        if job.error is not None:
+            raise job.error
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import logging
+import pika
+import threading
+import time
+
+try:
+    import cPickle as pickle
+    from Queue import Queue, Empty, Full
+except ImportError:
+    import pickle
+    from queue import Queue, Empty, Full
+
+from crew.worker import context
+
+log = logging.getLogger("builder.pubsub")
+
+
+class Publisher(threading.Thread):
+    """ Publishes the pubsub messages of the builds on an own connection.
+
+    pika connections aren't thread safe and every listener thread consumes on
+    its own one, so the build threads only put the serialized messages to the
+    queue and this thread is the only user of the publishing connection. The
+    messages are the same as crew's PubSub sends. """
+
+    EXCHANGE = "crew.PUBSUB"
+    CONTENT_TYPE = "application/python-pickle"
+    RECONNECT_TIMEOUT = 5
+
+    def __init__(self, parameters, queue_size=10000):
+        super(Publisher, self).__init__(name="publisher")
+        self.daemon = True
+        self.parameters = parameters
+        self.queue = Queue(queue_size)
+        self.current = None
+
+    def publish(self, channel, message):
+        try:
+            self.queue.put_nowait((channel, pickle.dumps(message, protocol=2)))
+            return True
+        except Full:
+            log.debug('Publishing queue is full, dropping message to "%s"', channel)
+            return False
+
+    def run(self):
+        while True:
+            try:
+                self.send()
+            except Exception as e:
+                log.warning("Publisher connection failed: %r. Reconnecting.", e)
+            time.sleep(self.RECONNECT_TIMEOUT)
+
+    def send(self):
+        connection = pika.BlockingConnection(self.parameters)
+        try:
+            channel = connection.channel()
+            while True:
+                if self.current is None:
+                    try:
+                        self.current = self.queue.get(timeout=1)
+                    except Empty:
+                        # Answers the heartbeats of the broker while idle
+                        connection.process_data_events()
+                        continue
+
+                name, body = self.current
+                channel.basic_publish(
+                    exchange=self.EXCHANGE,
+                    routing_key='',
+                    body=body,
+                    properties=pika.BasicProperties(
+                        content_type=self.CONTENT_TYPE, delivery_mode=1, headers={'x-channel-name': name}
+                    )
+                )
+                # The message is sent again after the reconnection when the publishing fails
+                self.current = None
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+
+def publish(channel, message):
+    """ Fire-and-forget publishing. Losing a message must never break a build. """
+    try:
+        return context.settings.publisher.publish(channel, message)
+    except Exception as e:
+        log.debug('Can\'t publish message to "%s": %r', channel, e)
+        return False
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import threading
+
+from collections import OrderedDict
+from time import time
+
+
+class NodeState(object):
+    """ Load of the node and the repositories built on it recently, so their
+    layers are in the docker cache. The state is advertised by the heartbeat
+    and the server routes the next builds of these repositories to the node.
+
+    The worker processes of one host share the queue of the node, every
+    process advertises its own capacity and load under its `uuid`. """
+
+    def __init__(self, node, capacity, uuid=None, repos_limit=256):
+        self.node = node
+        self.capacity = capacity
+        self.uuid = uuid
+        self.repos_limit = repos_limit
+        self.running = 0
+        self.repos = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def queue(self):
+        return "build.%s" % self.node
+
+    def started(self):
+        with self._lock:
+            self.running += 1
+
+    def finished(self, name=None):
+        with self._lock:
+            self.running -= 1
+
+            if name:
+                name = name.lower()
+                self.repos.pop(name, None)
+                self.repos[name] = time()
+
+                while len(self.repos) > self.repos_limit:
+                    self.repos.popitem(last=False)
+
+    def status(self):
+        with self._lock:
+            return {
+                "node": self.node,
+                "uuid": self.uuid,
+                "queue": self.queue,
+                "capacity": self.capacity,
+                "running": self.running,
+                "repos": list(self.repos),
+                "time": time(),
+            }
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import logging
+import os
+import re
+import git
+
+from multiprocessing.pool import ThreadPool
+
+log = logging.getLogger("builder.submodules")
+
+
+class Submodules(object):
+    """ Checks out the submodules of a working copy with `jobs` parallel
+    clones, level by level for the nested ones.
+
+    With the mirror store every submodule is cloned from the local mirror of
+    its url, so a dependency vendored by many repositories is downloaded once
+    per worker and then only fetched incrementally. """
+
+    CONFIG_EXPR = re.compile(r"^submodule\.(?P<name>.+)\.(?P<key>path|url)\s+(?P<value>.*)$")
+
+    def __init__(self, mirrors=None, jobs=4):
+        self.mirrors = mirrors
+        self.jobs = jobs
+
+    @classmethod
+    def _config(cls, g, *args):
+        result = {}
+        try:
+            output = g.config(*args)
+        except git.GitCommandError:
+            # Nothing is matched
+            return result
+
+        for line in output.splitlines():
+            matcher = cls.CONFIG_EXPR.match(line.strip())
+            if matcher:
+                result.setdefault(matcher.group('name'), {})[matcher.group('key')] = matcher.group('value')
+        return result
+
+    def find(self, repo):
+        """ Registers the submodules of the repo and returns (repo, path, url, commit) of each. """
+        if not os.path.exists(os.path.join(repo, ".gitmodules")):
+            return []
+
+        g = git.Git(repo)
+        # Resolves relative urls against the origin of the repo
+        g.submodule("init")
+
+        paths = self._config(g, "-f", ".gitmodules", "--get-regexp", r"^submodule\..*\.path$")
+        urls = self._config(g, "--get-regexp", r"^submodule\..*\.url$")
+
+        items = []
+        for name, item in sorted(paths.items()):
+            url = urls.get(name, {}).get('url')
+            # "160000 commit <sha>\t<path>" for the gitlink of the submodule
+            tree = g.ls_tree("HEAD", "--", item['path']).split()
+            if url and len(tree) > 2 and tree[1] == "commit":
+                items.append((repo, item['path'], url, tree[2]))
+
+        return items
+
+    def checkout(self, item):
+        """ Clones the submodule into its directory and checks out the recorded commit.
+        Nothing is written to the config of the parent repo, so the submodules
+        of one repo are cloned in parallel without the lock conflicts. """
+        repo, path, url, commit = item
+        target = os.path.join(repo, path)
+
+        if os.path.exists(os.path.join(target, ".git")):
+            # The submodule of the reused workspace
+            return self.refresh(target, path, url, commit)
+
+        if self.mirrors is not None:
+            with self.mirrors.mirror(url) as mirror:
+                log.info(' Cloning submodule "%s" from mirror "%s"', path, mirror)
+                git.Git().clone("--no-checkout", mirror, target)
+        else:
+            log.info(' Cloning submodule "%s" from "%s"', path, url)
+            git.Git().clone("--no-checkout", url, target)
+
+        g = git.Git(target)
+        # Nested relative urls must be resolved against the real remote
+        g.remote("set-url", "origin", url)
+
+        try:
+            g.checkout(commit)
+        except git.GitCommandError:
+            # The commit isn't reachable from the branches of the mirror
+            log.info(' Fetching commit "%s" of submodule "%s" from "%s"', commit, path, url)
+            g.fetch("origin", commit)
+            g.checkout(commit)
+
+        return target
+
+    def refresh(self, target, path, url, commit):
+        g = git.Git(target)
+        g.remote("set-url", "origin", url)
+
+        try:
+            g.checkout("--force", commit)
+        except git.GitCommandError:
+            if self.mirrors is not None:
+                with self.mirrors.mirror(url) as mirror:
+                    log.info(' Fetching submodule "%s" from mirror "%s"', path, mirror)
+                    g.fetch("--quiet", mirror, "+refs/heads/*:refs/remotes/origin/*")
+            else:
+                log.info(' Fetching submodule "%s" from "%s"', path, url)
+                g.fetch("--quiet", "origin")
+
+            try:
+                g.checkout("--force", commit)
+            except git.GitCommandError:
+                log.info(' Fetching commit "%s" of submodule "%s" from "%s"', commit, path, url)
+                g.fetch("origin", commit)
+                g.checkout("--force", commit)
+
+        g.clean("-ffdxq")
+        return target
+
+    def update(self, path):
+        pool = ThreadPool(self.jobs)
+        try:
+            level = [path]
+            while level:
+                items = [item for repo in level for item in self.find(repo)]
+                if items:
+                    log.info("Updating %d submodules with %d jobs", len(items), self.jobs)
+                level = pool.map(self.checkout, items)
+        finally:
+            pool.close()
+            pool.join()
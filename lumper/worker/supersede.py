@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import json
+import logging
+import pika
+import threading
+import time
+
+from .. import channels
+from ..versions import version_key
+
+log = logging.getLogger("builder.supersede")
+
+
+class Supersession(object):
+    """ The latest tags of the repositories with the supersession policy of
+    the server. Builds of the older tags (compared as versions, then by the
+    time of acceptance) are answered without building when they come from
+    the queue, the running ones are cancelled. """
+
+    def __init__(self, ttl=86400):
+        self.ttl = ttl
+        # name => ((version, accepted), tag, accepted)
+        self.latest = {}
+        self.running = set()
+        self._lock = threading.Lock()
+
+    def notice(self, message):
+        name, accepted, tag = message['name'].lower(), message['accepted'], message['tag']
+        order = (version_key(tag), accepted)
+        edge = time.time() - self.ttl
+
+        with self._lock:
+            if name not in self.latest or self.latest[name][0] < order:
+                self.latest[name] = (order, tag, accepted)
+
+            for key, (_, _, last) in list(self.latest.items()):
+                if last < edge:
+                    self.latest.pop(key)
+
+            running = list(self.running)
+
+        for handler in running:
+            newer = self.superseded(handler.data)
+            if newer:
+                handler.supersede(newer)
+
+    def superseded(self, data):
+        """ Returns the newer tag of the repository or None. """
+        accepted = data.get('accepted')
+        if not accepted:
+            return None
+
+        with self._lock:
+            latest = self.latest.get(data['name'].lower())
+
+        if latest is None:
+            return None
+
+        order, tag, _ = latest
+        return tag if order > (version_key(data.get('tag')), accepted) else None
+
+    def started(self, handler):
+        with self._lock:
+            self.running.add(handler)
+
+    def finished(self, handler):
+        with self._lock:
+            self.running.discard(handler)
+
+
+class SupersedeListener(threading.Thread):
+    """ Receives the supersession notices of the server through the fanout
+    exchange on an own connection, like the heartbeat responder. """
+
+    RECONNECT_TIMEOUT = 5
+
+    def __init__(self, parameters, supersession):
+        super(SupersedeListener, self).__init__(name="supersede")
+        self.daemon = True
+        self.parameters = parameters
+        self.supersession = supersession
+
+    def run(self):
+        while True:
+            try:
+                self.consume()
+            except Exception as e:
+                log.warning("Supersession connection failed: %r. Reconnecting.", e)
+            time.sleep(self.RECONNECT_TIMEOUT)
+
+    def consume(self):
+        connection = pika.BlockingConnection(self.parameters)
+        try:
+            channel = connection.channel()
+            channel.exchange_declare(exchange=channels.SUPERSEDE_EXCHANGE, exchange_type="fanout")
+            queue = channel.queue_declare(exclusive=True, auto_delete=True).method.queue
+            channel.queue_bind(queue=queue, exchange=channels.SUPERSEDE_EXCHANGE)
+            channel.basic_consume(self.on_notice, queue=queue, no_ack=True)
+            log.debug("Listening the supersession notices")
+            channel.start_consuming()
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def on_notice(self, channel, method, props, body):
+        try:
+            message = json.loads(body)
+            log.info('Tag "%s" of "%s" supersedes the older builds', message['tag'], message['name'])
+            self.supersession.notice(message)
+        except (ValueError, KeyError, TypeError):
+            log.debug("Bad supersession notice: %r", body)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import logging
+import os
+import re
+import shutil
+import threading
+
+from collections import OrderedDict
+from time import time
+from uuid import uuid4
+
+log = logging.getLogger("builder.workspace")
+
+
+class Workspace(object):
+    def __init__(self, pool, path, url, reused=False):
+        self.pool = pool
+        self.path = path
+        self.url = url
+        self.reused = reused
+        # Set when the checkout is complete, so the tree is worth keeping
+        self.ready = False
+
+    def reset(self):
+        """ Replaces the reused tree which can't be updated by the empty directory. """
+        log.info('Resetting workspace "%s"', self.path)
+        self.pool.trash(self.path)
+        os.makedirs(self.path)
+        self.reused = False
+
+    def __repr__(self):
+        return "<Workspace %s (%s)>" % (self.path, self.url)
+
+
+class WorkspacePool(object):
+    """ Working copies of the builds in the `path` directory (tmpfs or the
+    dedicated disk).
+
+    The working copy of the finished build is kept for the next build of the
+    same repository, which only fetches and cleans it instead of cloning.
+    Nothing is deleted on the build path: the directory is renamed into the
+    trash and the reaper thread deletes it in background. The reaper also
+    evicts the least recently used working copies over `keep` or `max_size`. """
+
+    TRASH = ".trash"
+    NAME_EXPR = re.compile("^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+    def __init__(self, path, max_size, keep=4, interval=60):
+        self.path = os.path.abspath(path)
+        self.trash_path = os.path.join(self.path, self.TRASH)
+        self.max_size = max_size
+        self.keep = keep
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        # path => [url, size], the least recently released first
+        self._free = OrderedDict()
+
+        if not os.path.exists(self.trash_path):
+            os.makedirs(self.trash_path)
+
+        # Leftovers of the previous run are in unknown state
+        for name in os.listdir(self.path):
+            if self.NAME_EXPR.match(name):
+                self.trash(os.path.join(self.path, name))
+
+        self._reaper = threading.Thread(target=self._loop, name="workspace-reaper")
+        self._reaper.daemon = True
+        self._reaper.start()
+
+    def acquire(self, url):
+        with self._lock:
+            for path in reversed(self._free):
+                if self._free[path][0] == url:
+                    self._free.pop(path)
+                    log.info('Reusing workspace "%s" of "%s"', path, url)
+                    return Workspace(self, path, url, reused=True)
+
+        path = os.path.join(self.path, str(uuid4()))
+        log.debug('Making directory: "%s"', path)
+        os.makedirs(path)
+        return Workspace(self, path, url)
+
+    def release(self, workspace):
+        if not workspace.ready or not self.keep:
+            self.trash(workspace.path)
+            return
+
+        with self._lock:
+            # The size is measured by the reaper
+            self._free[workspace.path] = [workspace.url, None]
+
+        self._wakeup.set()
+
+    def trash(self, path):
+        if not os.path.exists(path):
+            return
+
+        target = os.path.join(self.trash_path, uuid4().hex)
+        log.debug('Moving directory "%s" to the trash', path)
+        os.rename(path, target)
+        self._wakeup.set()
+
+    @staticmethod
+    def size(path):
+        total = 0
+        for root, dirs, files in os.walk(path):
+            for f in files:
+                try:
+                    total += os.lstat(os.path.join(root, f)).st_size
+                except OSError:
+                    pass
+        return total
+
+    def _loop(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.reap()
+            except Exception as e:
+                log.exception(e)
+
+    def reap(self):
+        start = time()
+        for name in os.listdir(self.trash_path):
+            shutil.rmtree(os.path.join(self.trash_path, name), ignore_errors=True)
+
+        with self._lock:
+            unmeasured = [path for path, (_, size) in self._free.items() if size is None]
+
+        for path in unmeasured:
+            size = self.size(path)
+            with self._lock:
+                if path in self._free:
+                    self._free[path][1] = size
+
+        with self._lock:
+            evicted = []
+            total = sum(size or 0 for _, size in self._free.values())
+            for path in list(self._free):
+                if len(self._free) <= self.keep and total <= self.max_size:
+                    break
+
+                total -= self._free.pop(path)[1] or 0
+                evicted.append(path)
+
+        # Deleted on the next round, the trash wakes up the reaper
+        for path in evicted:
+            log.info('Evicting workspace "%s"', path)
+            self.trash(path)
+
+        log.debug("Workspaces reaped in %.3f seconds", time() - start)
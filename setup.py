@@ -34,7 +34,11 @@ supports = {
         'gitpython',
         'docker-py',
         'arrow'
-    ]
+    ],
+    'extras_require': {
+        'fast': ['ujson', 'msgpack>=0.5.2'],
+    },
+    'tests_require': ['pytest'],
 }
 
 setup(
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import json
+import tempfile
+
+from collections import OrderedDict
+from crew.worker import Context, context
+from lumper.metrics import Metrics
+from lumper.worker.build import BuildHandler
+from lumper.worker.state import NodeState
+from lumper.worker.supersede import Supersession
+
+
+class Contexts(object):
+    def open(self, path, commit):
+        return tempfile.TemporaryFile()
+
+
+class Docker(object):
+    def __init__(self, lines, on_line=None):
+        self.lines = lines
+        self.on_line = on_line
+        self.closed = False
+
+    def build(self, **kwargs):
+        try:
+            for n, line in enumerate(self.lines):
+                yield json.dumps({"stream": line})
+                if self.on_line:
+                    self.on_line(n)
+        finally:
+            self.closed = True
+
+
+def handler(docker):
+    context.settings = Context(contexts=Contexts(), metrics=Metrics())
+    result = BuildHandler({"name": "team/app", "tag": "v1", "commit": "abc"})
+    result.build_log = []
+    result.timings = OrderedDict()
+    result.docker = docker
+    return result
+
+
+def test_build_success():
+    h = handler(Docker(["Step 1 : FROM busybox\n", "Successfully built 0123abcd\n"]))
+    assert h.build("/tmp") == "0123abcd"
+    assert h.data['status'] is True
+    assert h.build_log == ["Step 1 : FROM busybox", "Successfully built 0123abcd"]
+
+
+def test_build_cancelled_closes_stream():
+    docker = Docker(["Step 1 : FROM busybox\n", "Step 2 : RUN make\n", "Successfully built 0123abcd\n"])
+    h = handler(docker)
+    docker.on_line = lambda n: h.supersede("v2") if n == 1 else None
+
+    assert h.build("/tmp") is None
+    assert docker.closed
+    assert 'status' not in h.data
+    assert h.build_log[-1] == "Build is superseded by tag v2"
+
+
+class Pipeline(object):
+    def __init__(self, error=None):
+        self.error = error
+
+    def run(self, handler):
+        handler.build_log.append("Successfully built 0123abcd")
+        if self.error:
+            raise self.error
+        handler.data['status'] = True
+
+
+def process(monkeypatch, pipeline):
+    packed, results = [], []
+
+    def pack(lines, codec):
+        packed.append(lines)
+        return {"__packed__": True, "lines": len(lines)}
+
+    monkeypatch.setattr("lumper.worker.build.pack", pack)
+    monkeypatch.setattr("lumper.worker.build.publish", lambda channel, message: results.append(message))
+    monkeypatch.setattr("lumper.worker.build_log.publish", lambda channel, message: None)
+
+    context.settings = Context(
+        options=Context(build_log_dir=None, build_log_head=200, build_log_tail=1000, result_codec="msgpack"),
+        supersession=Supersession(),
+        state=NodeState("node", 1),
+        pipeline=pipeline,
+        metrics=Metrics(),
+        docker=None,
+        uuid="node",
+    )
+    result = BuildHandler({"name": "team/app", "tag": "v1", "commit": "abc"}).process()
+    return result, packed, [r for r in results if 'log' in r]
+
+
+def test_log_is_packed_once(monkeypatch):
+    result, packed, results = process(monkeypatch, Pipeline())
+
+    assert packed == [["Successfully built 0123abcd"]]
+    assert result['build_log'] == {"__packed__": True, "lines": 1}
+    assert results[0]['log'] is result['build_log']
+
+
+def test_log_of_error_is_packed_once(monkeypatch):
+    result, packed, results = process(monkeypatch, Pipeline(ValueError("boom")))
+
+    assert isinstance(result, Exception)
+    assert packed == [["Successfully built 0123abcd"]]
+    assert results[0]['log'] is result.log
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import os
+import tarfile
+
+from lumper.worker.build_context import DockerIgnore, write_context
+
+
+def test_compile():
+    negate, regex = DockerIgnore.compile("!/docs/*.md")
+    assert negate
+    assert regex.match("docs/README.md")
+    assert regex.match("docs/README.md/inner")
+    assert not regex.match("docs/api/README.md")
+    assert not regex.match("other/docs/README.md")
+
+    negate, regex = DockerIgnore.compile("**/*.pyc")
+    assert not negate
+    assert regex.match("app.pyc")
+    assert regex.match("app/module/app.pyc")
+    assert not regex.match("app.py")
+
+
+def test_excluded():
+    ignore = DockerIgnore(list(DockerIgnore.DEFAULT) + ["build", "*.log", "logs/**", "!logs/keep.log", "fil?.[ab]"])
+
+    assert ignore.excluded(".git")
+    assert ignore.excluded("vendor/lib/.git/config")
+    assert ignore.excluded("build/out/app")
+    assert ignore.excluded("error.log")
+    assert not ignore.excluded("app/error.log")
+    assert ignore.excluded("logs/app/debug.txt")
+    assert not ignore.excluded("logs/keep.log")
+    assert ignore.excluded("file.a")
+    assert not ignore.excluded("file.c")
+    assert not ignore.excluded("src/build")
+
+
+def test_dockerfile_is_always_included():
+    ignore = DockerIgnore(["*", "!src"])
+    assert not ignore.excluded("Dockerfile")
+    assert not ignore.excluded(".dockerignore")
+    assert not ignore.excluded("src/main.py")
+    assert ignore.excluded("README")
+
+
+def test_write_context(tmpdir):
+    path = os.path.join(str(tmpdir), "repo")
+    files = {
+        ".dockerignore": "# comment\n\ntmp\n**/*.log\n!app/keep.log\n",
+        "Dockerfile": "FROM scratch\n",
+        ".git/HEAD": "ref: refs/heads/master\n",
+        "tmp/cache": "",
+        "app/main.py": "print(1)\n",
+        "app/debug.log": "",
+        "app/keep.log": "",
+    }
+    for name, content in files.items():
+        fname = os.path.join(path, name)
+        if not os.path.exists(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        with open(fname, "w") as f:
+            f.write(content)
+
+    fname = os.path.join(str(tmpdir), "context.tar")
+    with open(fname, "wb") as f:
+        write_context(path, f)
+
+    tar = tarfile.open(fname)
+    try:
+        assert sorted(tar.getnames()) == [".dockerignore", "Dockerfile", "app", "app/keep.log", "app/main.py"]
+    finally:
+        tar.close()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import pytest
+
+from datetime import datetime
+
+from lumper import codec
+
+
+LOG = [u"Step %d : RUN make — ünïcode" % i for i in range(500)]
+
+
+def test_small_json_is_kept():
+    assert codec.pack(["one line"]) == ["one line"]
+    assert codec.pack(LOG, None) is LOG
+
+
+def test_large_json_is_compressed():
+    packed = codec.pack(LOG)
+    assert packed[codec.PACKED]
+    assert packed['content_type'] == "application/json"
+    assert packed['content_encoding'] == codec.DEFLATE
+    assert len(packed['body']) < len(codec.JSONCodec.encode(LOG))
+    assert codec.unpack(packed) == LOG
+
+
+def test_unpack_plain_values():
+    assert codec.unpack(LOG) is LOG
+    assert codec.unpack(None) is None
+    assert codec.unpack({"name": "team/app"}) == {"name": "team/app"}
+
+
+def test_encode_decode():
+    body, content_type, encoding = codec.encode({"a": [1, 2]}, threshold=0)
+    assert encoding == codec.IDENTITY
+    assert codec.decode(body, content_type, encoding) == {"a": [1, 2]}
+
+
+def test_json_default():
+    class Obj(object):
+        def __init__(self):
+            self.x = 1
+
+    assert codec.JSONCodec.decode(codec.JSONCodec.encode({"o": Obj()})) == {"o": {"x": 1}}
+
+    # The same output with and without ujson
+    assert codec.JSONCodec.decode(codec.JSONCodec.encode([datetime(2020, 1, 2), ValueError("x")])) == [
+        "2020-01-02 00:00:00", {}
+    ]
+
+
+def test_plain():
+    assert codec.plain({u"name": "team/app", "log": LOG, "timings": {"build": 1.5}, "ok": True, "error": None})
+    assert codec.plain([(1, 2), []])
+    assert not codec.plain({1: "a"})
+    assert not codec.plain({"started": datetime(2020, 1, 2)})
+    assert not codec.plain([{"error": ValueError("x")}])
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        codec.get_codec("bson")
+
+
+def test_msgpack():
+    if codec.msgpack is None:
+        pytest.skip("msgpack isn't installed")
+
+    packed = codec.pack(LOG[:3], "msgpack")
+    assert packed['content_type'] == "application/x-msgpack"
+    assert codec.unpack(packed) == LOG[:3]
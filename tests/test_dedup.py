@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from lumper.server.dedup import DeliveryIndex
+
+BUILD = {"name": "Team/App", "commit": "abc", "tag": "v1"}
+
+
+class Clock(object):
+    def __init__(self, now=1000.):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def index(monkeypatch, clock):
+    monkeypatch.setattr("lumper.server.dedup.time", clock)
+    return DeliveryIndex(ttl=60, timeout=600)
+
+
+def test_lookup_by_build_and_delivery(monkeypatch):
+    deliveries = index(monkeypatch, Clock())
+
+    assert deliveries.lookup(BUILD, "d1") is None
+    deliveries.add(BUILD, "d1")
+
+    assert deliveries.lookup(dict(BUILD, name="team/app"))['status'] == DeliveryIndex.QUEUED
+    assert deliveries.lookup({}, "d1") is not None
+    # A new delivery of the same build is remembered
+    assert deliveries.lookup(BUILD, "d2")['deliveries'] == ["d1", "d2"]
+
+    stats = deliveries.stats()
+    assert (stats['hits'], stats['misses'], stats['delivery_hits'], stats['build_hits']) == (3, 1, 1, 2)
+
+
+def test_queued_build_expires_after_timeout(monkeypatch):
+    clock = Clock()
+    deliveries = index(monkeypatch, clock)
+    deliveries.add(BUILD, "d1")
+
+    clock.now += 599
+    assert deliveries.in_flight("team/app") == 1
+
+    clock.now += 1
+    assert deliveries.lookup(BUILD, "d1") is None
+    assert deliveries.stats()['deliveries'] == 0
+
+
+def test_finished_build_lives_for_ttl(monkeypatch):
+    clock = Clock()
+    deliveries = index(monkeypatch, clock)
+    deliveries.add(BUILD, "d1")
+
+    clock.now += 500
+    deliveries.on_status(dict(BUILD, status=DeliveryIndex.STARTED, node="node-1"))
+
+    # The start refreshes the timeout of the queued build
+    clock.now += 500
+    deliveries.on_status(dict(BUILD, status=DeliveryIndex.FINISHED, node="node-1", success=True))
+    assert deliveries.in_flight() == 0
+
+    # The stale heap items of the earlier states don't expire the finished build
+    clock.now += 59
+    entry = deliveries.lookup(BUILD)
+    assert (entry['status'], entry['node'], entry['success']) == (DeliveryIndex.FINISHED, "node-1", True)
+
+    clock.now += 1
+    assert deliveries.lookup(BUILD) is None
+    assert deliveries.stats()['builds'] == 0
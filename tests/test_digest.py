@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import os
+
+from lumper.mailer.digest import Digest
+
+
+class Recorder(Digest):
+    result = True
+
+    def __init__(self, *args, **kwargs):
+        self.sent = []
+        super(Recorder, self).__init__(None, "lumper@localhost", *args, **kwargs)
+
+    def send(self, recipient, items):
+        self.sent.append((recipient, [i['tag'] for i in items]))
+        return self.result
+
+
+def build(tag):
+    return {"name": "team/app", "tag": tag, "commit": "abc", "status": True, "build_log": ["ok"]}
+
+
+def test_sent_by_size(tmpdir):
+    digest = Recorder(window=300, size=2, spool=str(tmpdir))
+    digest.add("dev@example.com", build("v1"))
+    assert digest.sent == []
+    assert len(os.listdir(str(tmpdir))) == 1
+
+    digest.add("dev@example.com", build("v2"))
+    assert digest.sent == [("dev@example.com", ["v1", "v2"])]
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_buffer_survives_restart(tmpdir):
+    digest = Recorder(window=300, size=10, spool=str(tmpdir))
+    digest.add("dev@example.com", build("v1"))
+    digest.add("qa@example.com", build("v2"))
+    digest.add("dev@example.com", build("v3"))
+
+    replayed = Recorder(window=300, size=10, spool=str(tmpdir))
+    replayed.flush()
+    assert sorted(replayed.sent) == [("dev@example.com", ["v1", "v3"]), ("qa@example.com", ["v2"])]
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_failed_digest_is_kept(tmpdir):
+    digest = Recorder(window=300, size=1, spool=str(tmpdir))
+    digest.result = False
+    digest.add("dev@example.com", build("v1"))
+
+    assert len(os.listdir(str(tmpdir))) == 1
+    assert len(digest._buffers["dev@example.com"][1]) == 1
+
+
+def test_broken_files_are_removed(tmpdir):
+    with open(os.path.join(str(tmpdir), "1-broken.pickle"), "w") as f:
+        f.write("not a pickle")
+    with open(os.path.join(str(tmpdir), "2-partial.pickle.tmp"), "w") as f:
+        f.write("")
+
+    digest = Recorder(spool=str(tmpdir))
+    assert digest._buffers == {}
+    assert os.listdir(str(tmpdir)) == []
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from time import time
+from lumper.codec import pack
+from lumper.server.history import BuildHistory
+
+
+def result(tag, finished=None, **kwargs):
+    return dict({
+        "name": "Team/App", "tag": tag, "commit": "abc", "success": True, "image": "img-%s" % tag,
+        "started": (finished or time()) - 10, "finished": finished or time(), "log": ["line 1", "line 2"],
+    }, **kwargs)
+
+
+def test_add_and_query(tmpdir):
+    history = BuildHistory(str(tmpdir.join("history.db")))
+    first = history.add(result("v1"))
+    second = history.add(result("v2", success=False, log=pack([u"line"] * 1000)))
+
+    assert [b['tag'] for b in history.query()['builds']] == ["v2", "v1"]
+    assert history.get(first)['name'] == "team/app"
+    assert history.log(second) == u"\n".join([u"line"] * 1000)
+
+
+def test_image_filter_uses_index(tmpdir):
+    history = BuildHistory(str(tmpdir.join("history.db")))
+    plan = " ".join(str(row) for row in history.db.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM builds WHERE image = ? ORDER BY id DESC", ("img",)
+    ))
+    assert "builds_image" in plan
+
+
+def test_expire_in_batches(tmpdir):
+    history = BuildHistory(str(tmpdir.join("history.db")), retention=1)
+    history.DELETE_BATCH = 10
+    history.io_loop = Loop()
+
+    old = time() - 2 * 86400
+    for i in range(25):
+        history.add(result("v%d" % i, finished=old))
+    fresh = history.add(result("v-fresh"))
+
+    assert history.expire() == 10
+    assert history.io_loop.callbacks == [history.expire]
+
+    # The hourly run doesn't start another chain of batches
+    history.schedule_expire()
+    assert history.io_loop.callbacks == [history.expire]
+
+    assert history.expire() == 10
+    assert history.expire() == 5
+    assert len(history.io_loop.callbacks) == 2
+
+    assert [b['id'] for b in history.query()['builds']] == [fresh]
+    assert history.db.execute("SELECT COUNT(*) FROM logs").fetchone()[0] == 1
+
+
+class Loop(object):
+    def __init__(self):
+        self.callbacks = []
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
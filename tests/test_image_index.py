@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import os
+
+from lumper.worker.image_index import ImageIndex
+
+
+def touch(index, key, mtime):
+    os.utime(os.path.join(index.path, key), (mtime, mtime))
+
+
+def test_put_get_discard(tmpdir):
+    index = ImageIndex(str(tmpdir))
+    key = ImageIndex.key("abc")
+
+    assert index.get(key) is None
+    index.put(key, "sha256:1")
+    assert index.get(key) == "sha256:1"
+
+    index.discard(key)
+    assert index.get(key) is None
+
+
+def test_least_recently_used_are_evicted(tmpdir):
+    index = ImageIndex(str(tmpdir), max_entries=2)
+
+    index.put("a", "image-a")
+    touch(index, "a", 1000)
+    index.put("b", "image-b")
+    touch(index, "b", 2000)
+
+    # The hit makes "a" the most recently used one
+    assert index.get("a") == "image-a"
+
+    index.put("c", "image-c")
+    assert sorted(os.listdir(index.path)) == ["a", "c"]
+    assert index.get("b") is None
+
+
+def test_unlimited(tmpdir):
+    index = ImageIndex(str(tmpdir))
+    for i in range(20):
+        index.put(str(i), "image")
+    assert len(os.listdir(index.path)) == 20
@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from crew.worker import Listener
+
+from lumper.worker.listener import BuildListener
+
+
+class Channel(object):
+    def __init__(self):
+        self.qos = []
+
+    def basic_qos(self, **kwargs):
+        self.qos.append(kwargs)
+
+
+def test_one_build_per_channel(monkeypatch):
+    def init(self, handlers, **kwargs):
+        self.channel = Channel()
+        # crew limits every consumer only
+        self.channel.basic_qos(prefetch_count=1)
+
+    monkeypatch.setattr(Listener, "__init__", init)
+    listener = BuildListener(handlers={})
+
+    assert listener.channel.qos[-1] == {"prefetch_count": 1, "all_channels": True}
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from lumper.server.logs import LogStream, LogStreams
+
+
+def test_repeated_chunks_are_skipped():
+    stream = LogStream({"id": "log"}, replay=3)
+    chunks = []
+    stream.listeners.add(lambda chunk, finished: chunks.append((chunk, finished)))
+
+    stream.add(0, ["a", "b"], False)
+    stream.add(0, ["a", "b"], False)
+    stream.add(1, ["c"], False)
+    # Delivered again after the reconnection of the worker
+    stream.add(0, ["a", "b"], False)
+    stream.add(2, ["d"], True)
+
+    assert chunks == [
+        ([(1, "a"), (2, "b")], False),
+        ([(3, "c")], False),
+        ([(4, "d")], True),
+    ]
+    assert stream.lines == 4
+    assert stream.finished
+
+
+def test_replay_after_the_last_line():
+    stream = LogStream({"id": "log"}, replay=3)
+    stream.add(0, ["a", "b", "c", "d"], False)
+
+    assert stream.replay() == [(2, "b"), (3, "c"), (4, "d")]
+    assert stream.replay(3) == [(4, "d")]
+    assert stream.replay(4) == []
+
+
+def test_streams_fan_out_chunks():
+    streams = LogStreams(replay=10)
+    streams.on_chunk({"id": "1", "name": "Team/App", "tag": "v1", "seq": 0, "lines": ["a"]})
+    streams.on_chunk({"id": "1", "seq": 0, "lines": ["a"]})
+    streams.on_chunk({"id": "1", "seq": 1, "lines": ["b"], "finished": True})
+    streams.on_chunk({"bad": "chunk"})
+
+    stream = streams.get("1")
+    assert stream.replay() == [(1, "a"), (2, "b")]
+    assert stream.finished
+    assert [i['id'] for i in streams.find(name="team/app", tag="v1")] == ["1"]
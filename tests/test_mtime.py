@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import os
+import subprocess
+
+from io import BytesIO
+
+from lumper.worker.mtime import CommitTimes
+
+
+def commit(path, timestamp, files):
+    for name, content in files.items():
+        fname = os.path.join(path, name)
+        if not os.path.exists(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        with open(fname, "w") as f:
+            f.write(content)
+
+    env = dict(
+        os.environ, GIT_AUTHOR_NAME="lumper", GIT_AUTHOR_EMAIL="lumper@example.com",
+        GIT_COMMITTER_NAME="lumper", GIT_COMMITTER_EMAIL="lumper@example.com",
+        GIT_AUTHOR_DATE="%d +0000" % timestamp, GIT_COMMITTER_DATE="%d +0000" % timestamp,
+    )
+    subprocess.check_call(["git", "add", "-A"], cwd=path, env=env)
+    subprocess.check_call(["git", "commit", "-q", "-m", str(timestamp)], cwd=path, env=env)
+    return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=path).strip().decode("ascii")
+
+
+def test_tokens_split_over_chunks(monkeypatch):
+    monkeypatch.setattr(CommitTimes, "CHUNK_SIZE", 3)
+    stream = BytesIO(b"\x011700000000\0\nfile a\0dir/b\0\0\x011600000000\0\nc")
+    assert list(CommitTimes._tokens(stream)) == [
+        b"\x011700000000", b"\nfile a", b"dir/b", b"", b"\x011600000000", b"\nc",
+    ]
+
+
+def test_find(tmpdir):
+    path = str(tmpdir)
+    subprocess.check_call(["git", "init", "-q", path])
+
+    commit(path, 1600000000, {"a": "1", "dir/b": "1", "dir/sub/c": "1"})
+    first = commit(path, 1650000000, {"dir/b": "2"})
+    commit(path, 1700000000, {"a": "3", "dir/sub/d": "3"})
+
+    assert CommitTimes.find(path, first) == {
+        b"a": 1600000000,
+        b"dir/b": 1650000000,
+        b"dir/sub/c": 1600000000,
+        b"dir": 1650000000,
+        b"dir/sub": 1600000000,
+    }
+
+    assert CommitTimes.find(path, "HEAD") == {
+        b"a": 1700000000,
+        b"dir/b": 1650000000,
+        b"dir/sub/c": 1600000000,
+        b"dir/sub/d": 1700000000,
+        b"dir": 1700000000,
+        b"dir/sub": 1700000000,
+    }
+
+
+def test_cache(monkeypatch):
+    calls = []
+    monkeypatch.setattr(CommitTimes, "find", staticmethod(lambda path, c: calls.append(c) or {c: 1}))
+    times = CommitTimes(cache_size=2)
+
+    times.get("/repo", "a")
+    times.get("/repo", "b")
+    times.get("/repo", "a")
+    times.get("/repo", "c")
+    times.get("/repo", "a")
+    times.get("/repo", "b")
+
+    # "b" was the least recently used one when "c" came
+    assert calls == ["a", "b", "c", "b"]
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from time import time
+from lumper.server.router import HashRing, Router
+
+
+def build(name, tag="v1.0"):
+    return {"name": name, "tag": tag, "commit": "abc"}
+
+
+def status(node, capacity=2, running=0, repos=(), uuid=None):
+    return {
+        "node": node, "uuid": uuid, "queue": "build.%s" % node,
+        "capacity": capacity, "running": running, "repos": list(repos),
+    }
+
+
+def test_hash_ring_is_stable():
+    ring = HashRing(["n1", "n2", "n3"])
+    names = ["team/app%d" % i for i in range(200)]
+    before = dict((name, ring.get(name)) for name in names)
+
+    assert set(before.values()) == set(["n1", "n2", "n3"])
+    assert HashRing(["n3", "n2", "n1"]).get("team/app1") == before["team/app1"]
+
+    # Only the repositories of the removed node move
+    smaller = HashRing(["n1", "n2"])
+    for name, node in before.items():
+        if node != "n3":
+            assert smaller.get(name) == node
+
+
+def test_empty_ring():
+    assert HashRing().get("team/app") is None
+
+
+def test_routes_to_cached_node():
+    router = Router()
+    router.on_worker_status(status("n1"))
+    router.on_worker_status(status("n2", repos=["team/app"]))
+
+    assert router.route(build("Team/App")) == "build.n2"
+    assert router.counters['cached'] == 1
+
+
+def test_busy_cluster_goes_to_shared_queue():
+    router = Router()
+    assert router.route(build("team/app")) == Router.SHARED
+
+    router.on_worker_status(status("n1", capacity=1, running=1))
+    assert router.route(build("team/app")) == Router.SHARED
+
+
+def test_waiting_builds_count_as_load():
+    router = Router()
+    router.on_worker_status(status("n1", capacity=1))
+    router.on_worker_status(status("n2", capacity=1))
+
+    first = router.route(build("team/app", "v1"))
+    second = router.route(build("team/app", "v2"))
+    assert set([first, second]) == set(["build.n1", "build.n2"])
+
+    router.on_build_status(dict(build("team/app", "v1"), status="started"))
+    assert len(router.waiting) == 1
+
+
+def test_gone_node_is_drained():
+    drained = []
+    router = Router(ttl=30, on_gone=drained.append)
+    router.on_worker_status(status("n1"))
+    router.on_worker_status(status("n2"))
+    router.waiting[("team/app", "abc", "v1")] = ("n1", time())
+
+    router.processes["n1"]["n1"]['seen'] = time() - 60
+    assert list(router.alive()) == ["n2"]
+    assert drained == ["build.n1"]
+    assert not router.waiting
+
+    # Drained again only after the ttl
+    router.alive()
+    assert drained == ["build.n1"]
+    router.gone["n1"] = ("build.n1", time() - 40, time() - 31)
+    router.alive()
+    assert drained == ["build.n1", "build.n1"]
+
+    # The node is back
+    router.on_worker_status(status("n1"))
+    router.alive()
+    assert "n1" not in router.gone
+
+
+def test_worker_processes_of_one_node_are_summed_up():
+    drained = []
+    router = Router(ttl=30, on_gone=drained.append)
+    router.on_worker_status(status("n1", capacity=2, running=2, repos=["team/app"], uuid="p1"))
+    router.on_worker_status(status("n1", capacity=2, running=0, repos=["team/web"], uuid="p2"))
+
+    assert router.load("n1") == (2, 4)
+    assert router.nodes["n1"]['repos'] == set(["team/app", "team/web"])
+    assert router.route(build("team/app")) == "build.n1"
+
+    # The status of one process doesn't overwrite the other one
+    router.on_worker_status(status("n1", capacity=2, running=1, uuid="p1"))
+    assert router.load("n1") == (2, 4)
+
+    # One of the processes stopped, the node is alive
+    router.processes["n1"]["p2"]['seen'] = time() - 60
+    assert list(router.alive()) == ["n1"]
+    assert router.load("n1") == (2, 2)
+    assert not router.free("n1")
+    assert not drained
+
+    router.processes["n1"]["p1"]['seen'] = time() - 60
+    assert not router.alive()
+    assert drained == ["build.n1"]
+    assert "n1" not in router.processes
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import pytest
+
+from lumper.server.scheduler import FairScheduler, parse_rules
+
+
+def build(name, tag="v1.0", commit="abc"):
+    return {"name": name, "tag": tag, "commit": commit}
+
+
+def drain(scheduler, requests):
+    order = []
+    while True:
+        request_id = scheduler.pop()
+        if request_id is None:
+            return order
+        order.append(requests[request_id])
+
+
+def test_parse_rules():
+    assert parse_rules(["*-hotfix*=10", "Team/*=2"]) == [("*-hotfix*", 10), ("team/*", 2)]
+    with pytest.raises(ValueError):
+        parse_rules(["10"])
+
+
+def test_tenants_share_fairly():
+    scheduler = FairScheduler()
+    requests = {}
+    for i in range(3):
+        requests["a%d" % i] = ("bulk/app", i)
+        scheduler.add("a%d" % i, build("bulk/app", "v%d" % i))
+    requests["b"] = ("small/app", 0)
+    scheduler.add("b", build("small/app"))
+
+    order = drain(scheduler, requests)
+    assert order[:2] in ([("bulk/app", 0), ("small/app", 0)], [("small/app", 0), ("bulk/app", 0)])
+    # FIFO within the tenant
+    assert [i for name, i in order if name == "bulk/app"] == [0, 1, 2]
+
+
+def test_priority_goes_first():
+    scheduler = FairScheduler(priorities=["*-hotfix*=10"])
+    scheduler.add("release", build("team/app", "v2.0"))
+    scheduler.add("hotfix", build("team/app", "v1.9-hotfix1"))
+    assert scheduler.pop() == "hotfix"
+    assert scheduler.pop() == "release"
+    assert scheduler.pop() is None
+
+
+def test_weights():
+    scheduler = FairScheduler(weights=["heavy/*=3"])
+    requests = {}
+    for name in ("heavy/app", "light/app"):
+        for i in range(6):
+            request_id = "%s%d" % (name, i)
+            requests[request_id] = name
+            scheduler.add(request_id, build(name, "v%d" % i))
+
+    order = drain(scheduler, requests)[:8]
+    assert order.count("heavy/app") == 6
+    assert order.count("light/app") == 2
+
+
+def test_remove():
+    scheduler = FairScheduler()
+    scheduler.add("a", build("team/app"))
+    scheduler.add("b", build("team/app", "v2"))
+    scheduler.remove("a")
+    scheduler.remove("unknown")
+    assert scheduler.pop() == "b"
+    assert scheduler.pop() is None
+
+
+def test_window_follows_worker_slots():
+    scheduler = FairScheduler()
+    assert scheduler.limit() == FairScheduler.MIN_WINDOW
+
+    scheduler.on_worker_status({"node": "n1", "uuid": "p1", "capacity": 2})
+    scheduler.on_worker_status({"node": "n1", "uuid": "p2", "capacity": 2})
+    scheduler.on_worker_status({"node": "n2", "capacity": 3})
+    assert scheduler.limit() == 14
+
+    for i in range(14):
+        assert scheduler.ready()
+        scheduler.dispatched(build("team/app", "v%d" % i), 0)
+    assert not scheduler.ready()
+
+    # The build left the queue
+    assert scheduler.on_build_status(dict(build("team/app", "v3"), status="started"))
+    assert scheduler.ready()
+
+
+def test_window_disabled():
+    scheduler = FairScheduler(window=0)
+    for i in range(100):
+        scheduler.dispatched(build("team/app", "v%d" % i), 0)
+    assert scheduler.ready()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import smtplib
+import socket
+
+import pytest
+
+from lumper.mailer.smtp import SMTPPool
+
+
+class Connection(object):
+    def __init__(self, error=None):
+        self.error = error
+        self.sent = []
+        self.closed = False
+
+    def sendmail(self, sender, recipients, message):
+        if self.error is not None:
+            raise self.error
+        self.sent.append(message)
+
+    def quit(self):
+        self.closed = True
+
+
+def pool(*connections):
+    result = SMTPPool(settings=None)
+    connections = list(connections)
+    result._connect = lambda: connections.pop(0)
+    return result
+
+
+def check_reconnect(error):
+    broken, fresh = Connection(error), Connection()
+    smtp = pool(broken, fresh)
+
+    smtp.sendmail("lumper@example.com", ["dev@example.com"], "message")
+
+    assert broken.closed
+    assert fresh.sent == ["message"]
+    assert smtp.stats['failures'] == 1
+    assert smtp.stats['messages'] == 1
+
+
+def test_disconnected_connection_is_replaced():
+    check_reconnect(smtplib.SMTPServerDisconnected("Connection unexpectedly closed"))
+
+
+def test_reset_connection_is_replaced():
+    check_reconnect(socket.error(104, "Connection reset by peer"))
+
+
+def test_refused_sender_is_not_sent_again():
+    refused, fresh = Connection(smtplib.SMTPSenderRefused(553, "No such user", "lumper@example.com")), Connection()
+    smtp = pool(refused, fresh)
+
+    with pytest.raises(smtplib.SMTPSenderRefused):
+        smtp.sendmail("lumper@example.com", ["dev@example.com"], "message")
+
+    assert refused.closed
+    assert fresh.sent == []
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# encoding: utf-8
+import os
+import pickle
+import zlib
+
+from pika.spec import Basic
+from lumper.server.scheduler import FairScheduler
+from lumper.server.spool import BuildSpool
+
+
+class Adapter(object):
+    def add_open_listener(self, func):
+        pass
+
+    def add_close_listener(self, func):
+        pass
+
+
+class Client(object):
+    SERIALIZERS = {'pickle': 'application/python-pickle'}
+    _res_queue = "crew.master.test"
+
+    def __init__(self):
+        self.channel = Adapter()
+
+    def get_serializer(self, name):
+        return (lambda x: pickle.dumps(x, protocol=2)), self.SERIALIZERS[name]
+
+
+class Channel(object):
+    is_open = True
+
+    def __init__(self):
+        self.published = []
+
+    def basic_publish(self, **kwargs):
+        self.published.append(kwargs)
+
+
+class Frame(object):
+    def __init__(self, method):
+        self.method = method
+
+
+def build(name="team/app", tag="v1.0", **kwargs):
+    return dict({"name": name, "tag": tag, "commit": "abc"}, **kwargs)
+
+
+def spool(path):
+    result = BuildSpool(str(path), Client(), FairScheduler(priorities=["*-hotfix*=10"], window=0))
+    result.channel = Channel()
+    return result
+
+
+def test_publish_like_crew_call(tmpdir):
+    s = spool(tmpdir)
+    s.put(build(tag="v1.0-hotfix1"))
+    s.drain()
+
+    message = s.channel.published[0]
+    props = message['properties']
+    assert message['routing_key'] == "crew.tasks.build"
+    assert pickle.loads(message['body'])['tag'] == "v1.0-hotfix1"
+    assert props.headers == {"x-original-sender": "crew.master.test"}
+    assert props.reply_to == BuildSpool.REPLY_TO
+    assert props.priority == 10
+    assert props.delivery_mode == 2
+    assert props.content_encoding == 'plain'
+
+
+def test_large_requests_are_compressed(tmpdir):
+    s = spool(tmpdir)
+    s.put(build(commits=["%d: %s" % (i, "x" * 100) for i in range(1000)]))
+    s.drain()
+
+    message = s.channel.published[0]
+    assert message['properties'].content_encoding == 'gzip'
+    assert len(pickle.loads(zlib.decompress(message['body']))['commits']) == 1000
+
+
+def test_journal_replay(tmpdir):
+    s = spool(tmpdir)
+    first = s.put(build(tag="v1"))
+    second = s.put(build(tag="v2"))
+    s.drain()
+    assert len(s.unconfirmed) == 2
+
+    third = s.put(build(tag="v3"))
+    s._on_confirm(Frame(Basic.Ack(delivery_tag=1)))
+    s.discard(lambda data: data['tag'] == "v3")
+    s.journal.close()
+
+    replayed = spool(tmpdir)
+    assert list(replayed.pending) == [second]
+    assert first not in replayed.pending and third not in replayed.pending
+    assert replayed.scheduler.pop() == second
+
+
+def test_broken_tail_is_skipped(tmpdir):
+    s = spool(tmpdir)
+    request_id = s.put(build())
+    s.journal.write('{"id": "broken", "ti')
+    s.journal.close()
+
+    assert list(spool(tmpdir).pending) == [request_id]
+
+
+def test_nacked_requests_go_first_in_tenant(tmpdir):
+    s = spool(tmpdir)
+    s.put(build(tag="v1"))
+    s.drain()
+    s.put(build(tag="v2"))
+
+    s._on_confirm(Frame(Basic.Nack(delivery_tag=1)))
+    assert s.counters['nacked'] == 1
+    assert s.pending[s.scheduler.pop()]['data']['tag'] == "v1"
+
+
+def test_journal_is_truncated_when_empty(tmpdir):
+    s = spool(tmpdir)
+    s.put(build())
+    s.drain()
+    s._on_confirm(Frame(Basic.Ack(delivery_tag=1)))
+    assert os.path.getsize(s.journal_name) == 0
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from time import time
+from lumper.versions import version_key
+from lumper.worker.supersede import Supersession
+
+NOW = time()
+
+
+class Handler(object):
+    def __init__(self, tag, accepted):
+        self.data = {"name": "Team/App", "tag": tag, "accepted": NOW + accepted}
+        self.superseded = None
+
+    def supersede(self, tag):
+        self.superseded = tag
+
+
+def notice(supersession, tag, accepted):
+    supersession.notice({"name": "team/app", "tag": tag, "commit": "abc", "accepted": NOW + accepted})
+
+
+def test_version_key():
+    assert version_key("v1.10.0") > version_key("v1.9.2")
+    assert version_key("v2") > version_key("1.99")
+    assert version_key("v1.2.3") == version_key("1.2.3")
+    assert sorted(["v0.10", "v0.2", "v0.9.1"], key=version_key) == ["v0.2", "v0.9.1", "v0.10"]
+
+    # Pre-releases go before the release
+    assert version_key("v1.4.0-rc1") < version_key("v1.4.0") < version_key("v1.4.1")
+    assert sorted(["v1.4.0", "v1.4.0-rc10", "v1.4.0-beta", "v1.4.0-rc2", "v1.3.9"], key=version_key) == [
+        "v1.3.9", "v1.4.0-beta", "v1.4.0-rc2", "v1.4.0-rc10", "v1.4.0"
+    ]
+    assert version_key("latest") < version_key("v0.1")
+
+
+def test_release_isnt_superseded_by_its_pre_release():
+    supersession = Supersession()
+    notice(supersession, "v1.4.0-rc1", 100)
+    assert supersession.superseded({"name": "team/app", "tag": "v1.4.0", "accepted": NOW + 200}) is None
+
+    notice(supersession, "v1.4.0", 200)
+    assert supersession.superseded({"name": "team/app", "tag": "v1.4.0-rc1", "accepted": NOW + 100}) == "v1.4.0"
+
+
+def test_newer_tag_supersedes_queued_build():
+    supersession = Supersession()
+    notice(supersession, "v1.1", 200)
+    assert supersession.superseded({"name": "team/app", "tag": "v1.0", "accepted": NOW + 100}) == "v1.1"
+    assert supersession.superseded({"name": "team/app", "tag": "v1.2", "accepted": NOW + 100}) is None
+    assert supersession.superseded({"name": "other/app", "tag": "v1.0", "accepted": NOW + 100}) is None
+
+
+def test_late_older_tag_never_cancels_newer_build():
+    supersession = Supersession()
+    running = Handler("v1.10", 100)
+    supersession.started(running)
+
+    notice(supersession, "v1.10", 100)
+    notice(supersession, "v1.9", 200)
+
+    assert running.superseded is None
+    assert supersession.superseded({"name": "team/app", "tag": "v1.9", "accepted": NOW + 200}) == "v1.10"
+
+
+def test_same_tag_pushed_again():
+    supersession = Supersession()
+    running = Handler("v1.0", 100)
+    supersession.started(running)
+
+    notice(supersession, "v1.0", 200)
+    assert running.superseded == "v1.0"